@@ -1,37 +1,262 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Query, UploadFile, File, Request, Response
+from fastapi.routing import APIRoute
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteMany, ReplaceOne, ReturnDocument, UpdateOne, monitoring
 import os
+import asyncio
+import math
+import json
+import re
+import bisect
+import hashlib
+import unicodedata
+import shutil
+import uuid
+import socket
+import time
+import threading
+import random
+import functools
+import cProfile
 import logging
 from pathlib import Path
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
-from datetime import datetime, timezone
+from typing import List, Optional, Dict, AsyncIterator, NamedTuple
+from collections import OrderedDict, deque
+from datetime import date, datetime, timedelta, timezone
 import httpx
-from requests_oauthlib import OAuth1
-import requests
+from oauthlib import oauth1
 import pandas as pd
+import numpy as np
+import xlsxwriter
+import tempfile
+import csv
+import io
 from io import BytesIO
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics in the Prometheus text format, served by /api/metrics
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+metrics_registry: list = []
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """Monotonic value per label set; safe to update from worker threads"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values: Dict[tuple, float] = {}
+        self.lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.label_names, labels)} {value}")
+        return lines
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels, value: float):
+        with self.lock:
+            self.values[labels] = value
+
+class Histogram(Counter):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = METRIC_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = buckets
+
+    def observe(self, *labels, value: float):
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            position = bisect.bisect_left(self.buckets, value)
+            if position < len(self.buckets):
+                state[0][position] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for labels, (bucket_counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    le = format_labels(self.label_names, labels, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                inf = format_labels(self.label_names, labels, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{inf} {count}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {count}")
+        return lines
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "API request latency until the last body byte", ("method", "route", "status")
+)
+MAGENTO_REQUEST_SECONDS = Histogram(
+    "magento_request_duration_seconds", "Outbound Magento call latency per attempt", ("method", "endpoint")
+)
+MAGENTO_RESPONSES = Counter(
+    "magento_responses_total", "Outbound Magento calls by response status", ("method", "endpoint", "status")
+)
+MAGENTO_COALESCED = Counter(
+    "magento_coalesced_requests_total", "GETs answered by an identical call already in flight", ("endpoint",)
+)
+PRODUCTS_CACHE_REQUESTS = Counter("products_cache_requests_total", "/products page cache lookups", ("result",))
+MAGENTO_IN_FLIGHT = Gauge("magento_in_flight", "Magento calls in progress", ("host",))
+MAGENTO_WAITING = Gauge("magento_waiting", "Magento calls queued behind the concurrency limit", ("host",))
+MAGENTO_CONCURRENCY_LIMIT = Gauge("magento_concurrency_limit", "Current AIMD concurrency limit", ("host",))
+EXECUTOR_THREADS = Gauge("executor_threads", "Worker threads of the default executor (asyncio.to_thread)")
+EXECUTOR_MAX_WORKERS = Gauge("executor_max_workers", "Thread limit of the default executor")
+EXECUTOR_QUEUE_DEPTH = Gauge("executor_queue_depth", "Calls waiting for a default executor thread")
+IMPORT_JOBS_RUNNING = Gauge("import_jobs_running", "Background import jobs in progress")
+PRICE_ROWS = Counter("price_rows_total", "Spreadsheet rows processed", ("operation",))
+PRICE_ROWS_PER_SECOND = Gauge("price_rows_per_second", "Throughput of the last completed run", ("operation",))
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ("command", "collection", "outcome")
+)
+
+def record_row_throughput(operation: str, rows: int, seconds: float):
+    PRICE_ROWS.inc(operation, amount=rows)
+    if seconds > 0:
+        PRICE_ROWS_PER_SECOND.set(operation, value=round(rows / seconds, 2))
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Time every MongoDB command; called from the driver's threads"""
+
+    def __init__(self):
+        self.collections: Dict[tuple, str] = {}
+
+    def started(self, event):
+        target = event.command.get("collection") if event.command_name == "getMore" else event.command.get(event.command_name)
+        self.collections[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def succeeded(self, event):
+        self.record(event, "ok")
+
+    def failed(self, event):
+        self.record(event, "error")
+
+    def record(self, event, outcome: str):
+        collection = self.collections.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_SECONDS.observe(event.command_name, collection, outcome, value=event.duration_micros / 1e6)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
 # Create the main app
 app = FastAPI(title="Magento Price Manager API")
 
+# Per-request Server-Timing phases, collected through a context variable
+class RequestTimings:
+    """Phase durations of one API request; concurrent sub-calls add up in the same phase"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.endpoint_started: Optional[float] = None
+        self.endpoint_finished: Optional[float] = None
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def header(self, total: float) -> str:
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items()]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+def add_phase(name: str, seconds: float):
+    timings = request_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+@contextmanager
+def timing_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, time.perf_counter() - started)
+
+class TimedRoute(APIRoute):
+    """API route that splits FastAPI's work into validate, endpoint and serialize phases"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        is_coroutine = asyncio.iscoroutinefunction(endpoint)
+
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args, **kwargs):
+            timings = request_timings.get()
+            if timings is not None:
+                timings.endpoint_started = time.perf_counter()
+            try:
+                if is_coroutine:
+                    return await endpoint(*args, **kwargs)
+                # Plain def endpoints run in the threadpool, as FastAPI would run them unwrapped
+                return await run_in_threadpool(endpoint, *args, **kwargs)
+            finally:
+                if timings is not None:
+                    timings.endpoint_finished = time.perf_counter()
+
+        super().__init__(path, timed_endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            started = time.perf_counter()
+            response = await handler(request)
+            timings = request_timings.get()
+            if timings is not None and timings.endpoint_finished is not None:
+                timings.add("validate", timings.endpoint_started - started)
+                timings.add("endpoint", timings.endpoint_finished - timings.endpoint_started)
+                timings.add("serialize", time.perf_counter() - timings.endpoint_finished)
+            return response
+
+        return timed_handler
+
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=TimedRoute)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # Pydantic Models
 class MagentoConfig(BaseModel):
@@ -93,101 +318,599 @@ class BulkPriceUpdate(BaseModel):
     special_price_from: Optional[str] = None
     special_price_to: Optional[str] = None
 
-# Helper function to make Magento API calls with OAuth 1.0a
-def magento_request_sync(
-    magento_url: str,
-    consumer_key: str,
-    consumer_secret: str,
-    access_token: str,
-    access_token_secret: str,
+# Magento REST client settings (per Magento host)
+MAGENTO_TIMEOUT = float(os.environ.get('MAGENTO_TIMEOUT', '30'))
+MAGENTO_CONNECT_TIMEOUT = float(os.environ.get('MAGENTO_CONNECT_TIMEOUT', '10'))
+MAGENTO_MAX_CONNECTIONS = int(os.environ.get('MAGENTO_MAX_CONNECTIONS', '20'))
+MAGENTO_MAX_KEEPALIVE = int(os.environ.get('MAGENTO_MAX_KEEPALIVE', '10'))
+MAGENTO_KEEPALIVE_EXPIRY = float(os.environ.get('MAGENTO_KEEPALIVE_EXPIRY', '60'))
+# Clients kept for this many credential sets, the least recently used is closed beyond that
+MAGENTO_CLIENT_CACHE_SIZE = int(os.environ.get('MAGENTO_CLIENT_CACHE_SIZE', '32'))
+# Identical concurrent GETs (same URL, params and credentials) share one Magento call
+MAGENTO_COALESCE_GETS = os.environ.get('MAGENTO_COALESCE_GETS', 'true').lower() == 'true'
+# /products pages served from memory for this many seconds, 0 = off
+PRODUCTS_CACHE_TTL = float(os.environ.get('PRODUCTS_CACHE_TTL', '0'))
+PRODUCTS_CACHE_SIZE = int(os.environ.get('PRODUCTS_CACHE_SIZE', '256'))
+
+# Outbound traffic control: AIMD concurrency, optional rate cap, retries and circuit breaker
+MAGENTO_MIN_CONCURRENCY = int(os.environ.get('MAGENTO_MIN_CONCURRENCY', '1'))
+MAGENTO_MAX_CONCURRENCY = int(os.environ.get('MAGENTO_MAX_CONCURRENCY', str(MAGENTO_MAX_CONNECTIONS)))
+MAGENTO_BACKOFF_FACTOR = float(os.environ.get('MAGENTO_BACKOFF_FACTOR', '0.5'))
+MAGENTO_BACKOFF_WINDOW = float(os.environ.get('MAGENTO_BACKOFF_WINDOW', '1'))
+MAGENTO_MAX_RPS = float(os.environ.get('MAGENTO_MAX_RPS', '0'))  # 0 = no rate cap
+MAGENTO_RETRIES = int(os.environ.get('MAGENTO_RETRIES', '3'))
+MAGENTO_RETRY_BASE_DELAY = float(os.environ.get('MAGENTO_RETRY_BASE_DELAY', '0.5'))
+MAGENTO_RETRY_MAX_DELAY = float(os.environ.get('MAGENTO_RETRY_MAX_DELAY', '10'))
+MAGENTO_BREAKER_THRESHOLD = int(os.environ.get('MAGENTO_BREAKER_THRESHOLD', '5'))
+MAGENTO_BREAKER_COOLDOWN = float(os.environ.get('MAGENTO_BREAKER_COOLDOWN', '30'))
+
+# Magento is overloaded or down: back off and, for idempotent calls, retry
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "PUT", "DELETE"}
+
+class MagentoUnavailable(Exception):
+    """Raised without contacting Magento while the circuit breaker is open"""
+
+class MagentoTrafficControl:
+    """AIMD concurrency limit, rate cap and circuit breaker shared by all calls to one Magento host"""
+
+    def __init__(self):
+        self.limit = float(MAGENTO_MAX_CONCURRENCY)
+        self.in_flight = 0
+        self.waiting = 0
+        self.condition = asyncio.Condition()
+        self.next_slot = 0.0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.breaker = "closed"
+        self.consecutive_failures = 0
+        self.opened_until = 0.0
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "failures": 0, "rejected": 0}
+
+    def check_breaker(self):
+        """Fail fast while open; after the cooldown let a single probe through (half-open)"""
+        now = time.monotonic()
+        if self.breaker == "open" and now >= self.opened_until:
+            self.breaker = "half_open"
+            return
+        if self.breaker != "closed":
+            self.stats["rejected"] += 1
+            raise MagentoUnavailable()
+
+    async def acquire(self):
+        async with self.condition:
+            self.waiting += 1
+            try:
+                await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            finally:
+                self.waiting -= 1
+            self.check_breaker()
+            self.in_flight += 1
+            self.stats["requests"] += 1
+        
+        # Spacing for the optional rate cap and for Retry-After pauses
+        now = time.monotonic()
+        start = max(now, self.next_slot, self.paused_until)
+        if MAGENTO_MAX_RPS > 0:
+            self.next_slot = start + 1 / MAGENTO_MAX_RPS
+        if start > now:
+            try:
+                await asyncio.sleep(start - now)
+            except BaseException:
+                await self.release("abandoned")
+                raise
+
+    async def release(self, outcome: str, retry_after: Optional[float] = None):
+        """Record 'ok', 'throttled' (429), 'failed' (5xx / connection error) or 'abandoned' and adjust the limit"""
+        now = time.monotonic()
+        if outcome == "abandoned":
+            # Cancelled or failed locally: says nothing about Magento, but an interrupted
+            # half-open probe must let the next call probe instead of blocking every call
+            if self.breaker == "half_open":
+                self.breaker = "open"
+                self.opened_until = now
+        elif outcome == "ok":
+            # Additive increase: about +1 per window of `limit` successful calls
+            self.limit = min(float(MAGENTO_MAX_CONCURRENCY), self.limit + 1 / self.limit)
+            self.consecutive_failures = 0
+            self.breaker = "closed"
+        else:
+            self.stats["throttled" if outcome == "throttled" else "failures"] += 1
+            # Multiplicative decrease, at most once per window so one burst does not collapse the limit
+            if now - self.last_decrease >= MAGENTO_BACKOFF_WINDOW:
+                self.limit = max(float(MAGENTO_MIN_CONCURRENCY), self.limit * MAGENTO_BACKOFF_FACTOR)
+                self.last_decrease = now
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if outcome == "failed":
+                self.consecutive_failures += 1
+                if self.breaker == "half_open" or self.consecutive_failures >= MAGENTO_BREAKER_THRESHOLD:
+                    self.breaker = "open"
+                    self.opened_until = now + MAGENTO_BREAKER_COOLDOWN
+        self.in_flight -= 1
+        # Shielded: the waiters are woken even when the releasing call is being cancelled
+        await asyncio.shield(self.wake_waiters())
+
+    async def wake_waiters(self):
+        async with self.condition:
+            self.condition.notify_all()
+
+    def snapshot(self) -> dict:
+        return {
+            "concurrency_limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 2),
+            "breaker": self.breaker,
+            "consecutive_failures": self.consecutive_failures,
+            "breaker_open_for": round(max(0.0, self.opened_until - time.monotonic()), 2) if self.breaker == "open" else 0,
+            **self.stats
+        }
+
+def retry_delay(attempt: int, retry_after: Optional[float]) -> float:
+    """Exponential backoff with full jitter, never shorter than Magento's Retry-After"""
+    delay = random.uniform(0, min(MAGENTO_RETRY_MAX_DELAY, MAGENTO_RETRY_BASE_DELAY * 2 ** attempt))
+    return max(delay, retry_after or 0)
+
+# Fixed endpoints under /products; any other segment there is a SKU
+MAGENTO_PRODUCT_ACTIONS = {
+    "base-prices", "base-prices-information", "special-price", "special-price-information", "special-price-delete"
+}
+
+def magento_endpoint_template(endpoint: str) -> str:
+    """Metric label for an endpoint, e.g. /products/ABC-1 -> /products/{sku}"""
+    parts = endpoint.split("/")
+    if len(parts) > 2 and parts[1] == "products" and parts[2] not in MAGENTO_PRODUCT_ACTIONS:
+        parts[2] = "{sku}"
+    return "/".join(parts)
+
+def parse_retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+class MagentoClient:
+    """Long-lived OAuth 1.0a client with a keep-alive connection pool for one Magento host"""
+
+    def __init__(self, config: MagentoConfig, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = config.magento_url.rstrip('/')
+        self.oauth = oauth1.Client(
+            config.consumer_key,
+            client_secret=config.consumer_secret,
+            resource_owner_key=config.access_token,
+            resource_owner_secret=config.access_token_secret,
+            signature_method=oauth1.SIGNATURE_HMAC_SHA256
+        )
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=MAGENTO_MAX_CONNECTIONS,
+                max_keepalive_connections=MAGENTO_MAX_KEEPALIVE,
+                keepalive_expiry=MAGENTO_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(MAGENTO_TIMEOUT, connect=MAGENTO_CONNECT_TIMEOUT),
+            transport=transport
+        )
+        self.traffic = MagentoTrafficControl()
+        self.store_views = StoreViewRegistry(STORE_VIEWS_TTL)
+        self.products_pages = PageCache(PRODUCTS_CACHE_TTL, PRODUCTS_CACHE_SIZE)
+        # In-flight GETs by unsigned URL
+        self.inflight: Dict[str, asyncio.Task] = {}
+        # Price comparison matrix built from Magento, see get_price_matrix
+        self.price_matrix = None
+        self.price_matrix_lock = asyncio.Lock()
+        # Calls inside send(), from the first attempt to the last retry
+        self.active_calls = 0
+
+    def build_url(self, endpoint: str, store_code: Optional[str] = None) -> str:
+        scope = f"/{store_code}" if store_code else ""
+        return f"{self.base_url}/rest{scope}/V1{endpoint}"
+
+    async def request(
+        self,
+        method: str,
+        endpoint: str,
+        data: dict = None,
+        params: dict = None,
+        store_code: Optional[str] = None,
+        idempotent: Optional[bool] = None
+    ) -> httpx.Response:
+        """Send a request; an identical GET already in flight is joined instead of sent again"""
+        url = str(httpx.URL(self.build_url(endpoint, store_code), params=params))
+        if method != "GET" or data is not None or not MAGENTO_COALESCE_GETS:
+            return await self.send(method, url, endpoint, data, idempotent)
+        
+        task = self.inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self.send(method, url, endpoint, data, idempotent))
+            self.inflight[url] = task
+            task.add_done_callback(lambda done: self.inflight.pop(url) if self.inflight.get(url) is done else None)
+            # Shielded: a caller going away does not cancel the call the others are waiting for
+            return await asyncio.shield(task)
+        
+        MAGENTO_COALESCED.inc(magento_endpoint_template(endpoint))
+        with timing_phase("magento_shared"):
+            return await asyncio.shield(task)
+
+    async def send(
+        self,
+        method: str,
+        url: str,
+        endpoint: str,
+        data: dict = None,
+        idempotent: Optional[bool] = None
+    ) -> httpx.Response:
+        """Sign and send a request under traffic control; idempotent calls are retried on 429/5xx"""
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = 1 + (MAGENTO_RETRIES if idempotent else 0)
+        template = magento_endpoint_template(endpoint)
+        
+        # Held across retries and backoff sleeps: an evicted client is only closed once this drops to 0
+        self.active_calls += 1
+        try:
+            for attempt in range(attempts):
+                # Signed per attempt: the OAuth nonce and timestamp must be fresh
+                signed_url, headers, _ = self.oauth.sign(
+                    url,
+                    http_method=method,
+                    headers={"Content-Type": "application/json", "Accept": "application/json"}
+                )
+                with timing_phase("magento_queue"):
+                    await self.traffic.acquire()
+                started = time.perf_counter()
+                # Anything leaving this block without an outcome (cancellation included) still gives the slot back
+                outcome, retry_after = "abandoned", None
+                try:
+                    response = await self.http.request(method, signed_url, headers=headers, json=data)
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    add_phase("magento", time.perf_counter() - started)
+                    MAGENTO_REQUEST_SECONDS.observe(method, template, value=time.perf_counter() - started)
+                    MAGENTO_RESPONSES.inc(method, template, type(e).__name__)
+                    outcome = "failed"
+                    if attempt + 1 >= attempts:
+                        raise
+                else:
+                    add_phase("magento", time.perf_counter() - started)
+                    MAGENTO_REQUEST_SECONDS.observe(method, template, value=time.perf_counter() - started)
+                    MAGENTO_RESPONSES.inc(method, template, response.status_code)
+                    if response.status_code not in RETRY_STATUSES:
+                        outcome = "ok"
+                        return response
+                    retry_after = parse_retry_after(response)
+                    outcome = "throttled" if response.status_code == 429 else "failed"
+                    if attempt + 1 >= attempts:
+                        return response
+                finally:
+                    await self.traffic.release(outcome, retry_after)
+                self.traffic.stats["retries"] += 1
+                await asyncio.sleep(retry_delay(attempt, retry_after))
+        finally:
+            self.active_calls -= 1
+
+    async def aclose(self):
+        await self.http.aclose()
+
+# One client per Magento installation and credentials, shared by all requests
+magento_clients: Dict[tuple, MagentoClient] = OrderedDict()
+# Evicted clients closing once their calls are done
+retiring_magento_clients: set = set()
+# Optional transport override (e.g. a local Magento stub in tests)
+magento_transport: Optional[httpx.AsyncBaseTransport] = None
+
+def get_magento_client(config: MagentoConfig) -> MagentoClient:
+    """Return the shared client for this Magento configuration"""
+    key = (
+        config.magento_url.rstrip('/'),
+        config.consumer_key,
+        config.consumer_secret,
+        config.access_token,
+        config.access_token_secret
+    )
+    magento_client = magento_clients.get(key)
+    if magento_client is not None:
+        magento_clients.move_to_end(key)
+        return magento_client
+    magento_client = MagentoClient(config, transport=magento_transport)
+    magento_clients[key] = magento_client
+    while len(magento_clients) > MAGENTO_CLIENT_CACHE_SIZE:
+        _, evicted = magento_clients.popitem(last=False)
+        task = asyncio.create_task(retire_magento_client(evicted))
+        retiring_magento_clients.add(task)
+        task.add_done_callback(retiring_magento_clients.discard)
+    return magento_client
+
+async def retire_magento_client(magento_client: MagentoClient):
+    """Close an evicted client once its in-flight Magento calls are done"""
+    try:
+        while magento_client.active_calls:
+            await asyncio.sleep(1)
+    finally:
+        await magento_client.aclose()
+
+async def magento_request(
+    config: MagentoConfig,
     method: str,
     endpoint: str,
     data: dict = None,
-    params: dict = None
+    params: dict = None,
+    store_code: Optional[str] = None,
+    idempotent: Optional[bool] = None
 ) -> dict:
     """Make OAuth 1.0a authenticated request to Magento REST API"""
-    url = f"{magento_url.rstrip('/')}/rest/V1{endpoint}"
-    
-    oauth = OAuth1(
-        consumer_key,
-        client_secret=consumer_secret,
-        resource_owner_key=access_token,
-        resource_owner_secret=access_token_secret,
-        signature_method='HMAC-SHA256'
-    )
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-    
     try:
-        if method == "GET":
-            response = requests.get(url, auth=oauth, headers=headers, params=params, timeout=30)
-        elif method == "POST":
-            response = requests.post(url, auth=oauth, headers=headers, json=data, timeout=30)
-        elif method == "PUT":
-            response = requests.put(url, auth=oauth, headers=headers, json=data, timeout=30)
-        else:
-            raise ValueError(f"Unsupported method: {method}")
-        
-        if response.status_code == 401:
-            raise HTTPException(status_code=401, detail="Credenziali OAuth non valide")
-        elif response.status_code == 404:
-            raise HTTPException(status_code=404, detail="Risorsa non trovata")
-        elif response.status_code >= 400:
-            logger.error(f"Magento API error: {response.status_code} - {response.text}")
-            raise HTTPException(status_code=response.status_code, detail=f"Errore Magento: {response.text}")
-        
-        return response.json()
-    except requests.exceptions.Timeout:
+        response = await get_magento_client(config).request(
+            method, endpoint, data=data, params=params, store_code=store_code, idempotent=idempotent
+        )
+    except MagentoUnavailable:
+        raise HTTPException(status_code=503, detail="Magento non disponibile, nuovo tentativo tra poco")
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Timeout connessione a Magento")
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, httpx.InvalidURL, ValueError) as e:
         raise HTTPException(status_code=502, detail=f"Errore connessione: {str(e)}")
 
-async def magento_request(config: MagentoConfig, method: str, endpoint: str, data: dict = None, params: dict = None) -> dict:
-    """Async wrapper for OAuth request"""
-    import asyncio
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(
-        None,
-        lambda: magento_request_sync(
-            config.magento_url,
-            config.consumer_key,
-            config.consumer_secret,
-            config.access_token,
-            config.access_token_secret,
-            method,
-            endpoint,
-            data,
-            params
+    if response.status_code == 401:
+        raise HTTPException(status_code=401, detail="Credenziali OAuth non valide")
+    elif response.status_code == 404:
+        raise HTTPException(status_code=404, detail="Risorsa non trovata")
+    elif response.status_code >= 400:
+        logger.error(f"Magento API error: {response.status_code} - {response.text}")
+        raise HTTPException(status_code=response.status_code, detail=f"Errore Magento: {response.text}")
+
+    with timing_phase("magento_parse"):
+        return response.json()
+
+# Store views change rarely: cached per Magento client, reloaded after STORE_VIEWS_TTL seconds
+STORE_VIEWS_TTL = float(os.environ.get('STORE_VIEWS_TTL', '300'))
+
+class StoreViewRegistry:
+    """Store views of one Magento installation with id and code lookups; concurrent loads share one call"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.stores: List[dict] = []
+        self.by_id: Dict[int, dict] = {}
+        self.by_code: Dict[str, dict] = {}
+        self.loaded_at: Optional[float] = None
+        self.loading: Optional[asyncio.Task] = None
+
+    def is_fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    async def fetch(self, config: MagentoConfig):
+        stores = await magento_request(config, "GET", "/store/storeViews")
+        # Lookups are replaced together, readers never see a half-updated registry
+        self.stores, self.by_id, self.by_code = (
+            stores,
+            {store.get("id"): store for store in stores},
+            {store.get("code"): store for store in stores}
         )
+        self.loaded_at = time.monotonic()
+
+    async def load(self, config: MagentoConfig, refresh: bool = False):
+        """Reload when stale or asked to; a load already in flight is joined, not repeated"""
+        if self.is_fresh() and not refresh:
+            return
+        if self.loading is None or self.loading.done():
+            self.loading = asyncio.create_task(self.fetch(config))
+        await asyncio.shield(self.loading)
+
+class PageCache:
+    """Short-lived rendered responses by key, oldest dropped first once full; a TTL of 0 disables it"""
+
+    def __init__(self, ttl: float, size: int):
+        self.ttl = ttl
+        self.size = size
+        self.entries: Dict[tuple, tuple] = {}
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        self.entries.pop(key, None)
+        return None
+
+    def put(self, key: tuple, value: tuple):
+        if self.ttl <= 0:
+            return
+        self.entries.pop(key, None)
+        if len(self.entries) >= self.size:
+            self.entries.pop(next(iter(self.entries)))
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self):
+        self.entries.clear()
+
+def forget_product_pages(config: MagentoConfig):
+    """Drop cached /products pages after a price write through this backend"""
+    get_magento_client(config).products_pages.clear()
+
+async def get_store_views(config: MagentoConfig, refresh: bool = False) -> StoreViewRegistry:
+    """Loaded store view registry of this Magento configuration"""
+    registry = get_magento_client(config).store_views
+    await registry.load(config, refresh)
+    return registry
+
+# Magento `fields` projections: each product read asks only for what it uses
+PRODUCT_LIST_FIELDS = "items[id,sku,name,price,custom_attributes[attribute_code,value]],total_count"
+EXPORT_FIELDS = "items[sku,name,price,custom_attributes[attribute_code,value]],total_count"
+CATALOG_SYNC_FIELDS = "items[id,sku,name,price,updated_at,custom_attributes[attribute_code,value]],total_count"
+
+# Catalog pagination for bulk reads
+CATALOG_PAGE_SIZE = int(os.environ.get('CATALOG_PAGE_SIZE', '100'))
+CATALOG_CONCURRENCY = int(os.environ.get('CATALOG_CONCURRENCY', '4'))
+
+async def iter_product_pages(
+    config: MagentoConfig,
+    page_size: int = CATALOG_PAGE_SIZE,
+    concurrency: int = CATALOG_CONCURRENCY,
+    filters: dict = None,
+    fields: str = EXPORT_FIELDS
+) -> AsyncIterator[List[dict]]:
+    """Yield every page of the catalog in order, fetching up to `concurrency` pages ahead"""
+    async def fetch_page(page: int) -> dict:
+        params = {
+            **(filters or {}),
+            "fields": fields,
+            "searchCriteria[pageSize]": page_size,
+            "searchCriteria[currentPage]": page,
+            # Stable ordering so concurrent pages neither overlap nor skip products
+            "searchCriteria[sortOrders][0][field]": "entity_id",
+            "searchCriteria[sortOrders][0][direction]": "ASC",
+        }
+        return await magento_request(config, "GET", "/products", params=params)
+
+    first_page = await fetch_page(1)
+    yield first_page.get("items", [])
+
+    # Magento repeats the last page past the end, so rely on total_count
+    last_page = math.ceil(first_page.get("total_count", 0) / page_size)
+    pending = deque()
+    next_page = 2
+    try:
+        while next_page <= last_page or pending:
+            while next_page <= last_page and len(pending) < max(concurrency, 1):
+                pending.append(asyncio.ensure_future(fetch_page(next_page)))
+                next_page += 1
+            result = await pending.popleft()
+            yield result.get("items", [])
+    finally:
+        for task in pending:
+            task.cancel()
+
+# Store-scoped prices via the Magento 2.2+ batch price APIs
+PRICE_CHUNK_SIZE = int(os.environ.get('PRICE_CHUNK_SIZE', '200'))
+PRICE_CONCURRENCY = int(os.environ.get('PRICE_CONCURRENCY', '4'))
+
+async def fetch_store_prices(config: MagentoConfig, skus: List[str]) -> Dict[str, Dict[int, dict]]:
+    """Read base and special prices of every store for the given SKUs, PRICE_CHUNK_SIZE SKUs per call"""
+    semaphore = asyncio.Semaphore(PRICE_CONCURRENCY)
+    chunks = [skus[i:i + PRICE_CHUNK_SIZE] for i in range(0, len(skus), PRICE_CHUNK_SIZE)]
+
+    async def fetch_chunk(endpoint: str, chunk: List[str]) -> list:
+        async with semaphore:
+            return await magento_request(config, "POST", endpoint, data={"skus": chunk}, idempotent=True)
+
+    base_results, special_results = await asyncio.gather(
+        asyncio.gather(*[fetch_chunk("/products/base-prices-information", chunk) for chunk in chunks]),
+        asyncio.gather(*[fetch_chunk("/products/special-price-information", chunk) for chunk in chunks])
     )
 
+    prices = {sku: {} for sku in skus}
+    for result in base_results:
+        for entry in result or []:
+            store_prices = prices.setdefault(entry.get("sku"), {})
+            store_prices.setdefault(entry.get("store_id", 0), {})["base_price"] = entry.get("price")
+    for result in special_results:
+        for entry in result or []:
+            store_prices = prices.setdefault(entry.get("sku"), {})
+            store_prices.setdefault(entry.get("store_id", 0), {}).update({
+                "special_price": entry.get("price"),
+                "special_price_from": entry.get("price_from"),
+                "special_price_to": entry.get("price_to")
+            })
+    return prices
+
+def resolve_store_price(store_prices: Dict[int, dict], store_id: int, fallback: dict) -> dict:
+    """Pick the store-scoped price, then the default scope (store 0), then the product attributes"""
+    resolved = {}
+    for scope in (store_prices.get(store_id, {}), store_prices.get(0, {}), fallback):
+        if "base_price" not in resolved and scope.get("base_price") is not None:
+            resolved["base_price"] = scope["base_price"]
+        # Special price and its dates always come from the same scope
+        if "special_price" not in resolved and scope.get("special_price") is not None:
+            resolved["special_price"] = scope["special_price"]
+            resolved["special_price_from"] = scope.get("special_price_from")
+            resolved["special_price_to"] = scope.get("special_price_to")
+    return {
+        "base_price": resolved.get("base_price"),
+        "special_price": resolved.get("special_price"),
+        "special_price_from": resolved.get("special_price_from"),
+        "special_price_to": resolved.get("special_price_to")
+    }
+
+# Conditional responses: strong ETags that clients revalidate with If-None-Match on every use
+CONDITIONAL_CACHE_CONTROL = "private, no-cache"
+
+def json_body(payload) -> bytes:
+    """Serialized like FastAPI's JSONResponse, so the hashed bytes are the bytes sent"""
+    return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def etag_for(data: bytes) -> str:
+    return f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Weak comparison against the If-None-Match list, as RFC 9110 asks for GET and HEAD"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+def conditional_json(request: Request, etag: str, body: Optional[bytes] = None) -> Response:
+    """304 when the client already has this version, else the body with its ETag"""
+    headers = {"ETag": etag, "Cache-Control": CONDITIONAL_CACHE_CONTROL}
+    if body is None or etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "Magento Price Manager API", "status": "running"}
 
+@api_router.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    for magento_client in magento_clients.values():
+        MAGENTO_IN_FLIGHT.set(magento_client.base_url, value=magento_client.traffic.in_flight)
+        MAGENTO_WAITING.set(magento_client.base_url, value=magento_client.traffic.waiting)
+        MAGENTO_CONCURRENCY_LIMIT.set(magento_client.base_url, value=magento_client.traffic.limit)
+    # asyncio.to_thread runs on the loop's default executor, created on first use
+    executor = getattr(asyncio.get_running_loop(), "_default_executor", None)
+    if executor is not None:
+        EXECUTOR_THREADS.set(value=len(executor._threads))
+        EXECUTOR_MAX_WORKERS.set(value=executor._max_workers)
+        EXECUTOR_QUEUE_DEPTH.set(value=executor._work_queue.qsize())
+    IMPORT_JOBS_RUNNING.set(value=len(import_job_tasks))
+    
+    lines = [line for metric in metrics_registry for line in metric.render()]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@api_router.get("/magento/traffic")
+async def magento_traffic():
+    """Concurrency limit, breaker state and counters of every Magento host in use"""
+    return {
+        "hosts": [
+            {"magento_url": magento_client.base_url, **magento_client.traffic.snapshot()}
+            for magento_client in magento_clients.values()
+        ]
+    }
+
 @api_router.post("/test-connection")
 async def test_connection(config: MagentoConfig):
     """Test connection to Magento API"""
     try:
-        result = await magento_request(config, "GET", "/store/storeViews")
-        return {"success": True, "message": "Connessione riuscita", "stores_count": len(result)}
+        # Always a live call, which also refreshes the cached store views
+        registry = await get_store_views(config, refresh=True)
+        return {"success": True, "message": "Connessione riuscita", "stores_count": len(registry.stores)}
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/store-views", response_model=List[StoreView])
-async def get_store_views(config: MagentoConfig):
+async def list_store_views(
+    request: Request,
+    config: MagentoConfig,
+    refresh: bool = Query(False, description="Reload from Magento instead of the cache")
+):
     """Get all store views from Magento"""
     try:
-        result = await magento_request(config, "GET", "/store/storeViews")
+        registry = await get_store_views(config, refresh)
         
         store_views = []
-        for sv in result:
+        for sv in registry.stores:
             store_views.append(StoreView(
                 id=sv.get("id", 0),
                 code=sv.get("code", ""),
@@ -196,7 +919,8 @@ async def get_store_views(config: MagentoConfig):
                 store_group_id=sv.get("store_group_id", 0)
             ))
         
-        return store_views
+        body = json_body(store_views)
+        return conditional_json(request, etag_for(body), body)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -205,21 +929,60 @@ async def get_store_views(config: MagentoConfig):
 
 @api_router.post("/products")
 async def get_products(
+    request: Request,
     config: MagentoConfig,
     store_id: int = Query(0, description="Store view ID"),
     page: int = Query(1, description="Page number"),
     page_size: int = Query(20, description="Items per page"),
-    search: Optional[str] = Query(None, description="Search by SKU or name")
+    search: Optional[str] = Query(None, description="Search by SKU or name"),
+    source: str = Query("magento", description="magento or mirror (local catalog copy)")
 ):
     """Get products with pricing information"""
     try:
+        if source == "mirror":
+            # The mirror only changes through syncs: its sync state names the page version without
+            # reading it. age_seconds is left out, a 304 keeps the age of the first response.
+            freshness = await require_mirror(config)
+            version = {key: value for key, value in freshness.items() if key != "age_seconds"}
+            etag = etag_for(json_body([config.magento_url.rstrip('/'), store_id, page, page_size, search, version]))
+            if etag_matches(request, etag):
+                return conditional_json(request, etag)
+            return conditional_json(request, etag, json_body(await get_mirror_products(config, store_id, page, page_size, search)))
+        
+        # Cached pages keep their serialized body and ETag
+        page_cache = get_magento_client(config).products_pages
+        cache_key = (store_id, page, page_size, search)
+        if page_cache.ttl > 0:
+            cached = page_cache.get(cache_key)
+            PRODUCTS_CACHE_REQUESTS.inc("hit" if cached else "miss")
+            if cached:
+                return conditional_json(request, cached[1], cached[0])
+        
         # Build search criteria
         params = {
+            "fields": PRODUCT_LIST_FIELDS,
             "searchCriteria[pageSize]": page_size,
             "searchCriteria[currentPage]": page,
         }
         
-        if search:
+        with timing_phase("search"):
+            # A stale mirror would hide products created since its last sync: fall back to the LIKE query
+            search_index = await get_search_index(config, max_age=SEARCH_INDEX_MAX_AGE) if search else None
+        page_skus = None
+        if search_index:
+            # Rank with the local index, then read live data for just this page of SKUs
+            with timing_phase("search"):
+                ranked = search_index.search(search)
+            page_skus = ranked[(page - 1) * page_size:page * page_size]
+            params = {
+                "fields": PRODUCT_LIST_FIELDS,
+                "searchCriteria[pageSize]": max(len(page_skus), 1),
+                "searchCriteria[currentPage]": 1,
+                "searchCriteria[filter_groups][0][filters][0][field]": "sku",
+                "searchCriteria[filter_groups][0][filters][0][value]": ",".join(page_skus),
+                "searchCriteria[filter_groups][0][filters][0][condition_type]": "in",
+            }
+        elif search:
             params["searchCriteria[filter_groups][0][filters][0][field]"] = "sku"
             params["searchCriteria[filter_groups][0][filters][0][value]"] = f"%{search}%"
             params["searchCriteria[filter_groups][0][filters][0][condition_type]"] = "like"
@@ -228,11 +991,27 @@ async def get_products(
             params["searchCriteria[filter_groups][0][filters][1][condition_type]"] = "like"
         
         # Fetch products
-        products_result = await magento_request(config, "GET", "/products", params=params)
+        if page_skus == []:
+            products_result = {"items": [], "total_count": 0}
+        else:
+            products_result = await magento_request(config, "GET", "/products", params=params)
+        if page_skus is not None:
+            rank = {sku: position for position, sku in enumerate(page_skus)}
+            products_result["items"] = sorted(
+                (item for item in products_result.get("items", []) if item.get("sku") in rank),
+                key=lambda item: rank[item["sku"]]
+            )
+            products_result["total_count"] = len(ranked)
         
         products = []
         items = products_result.get("items", [])
         
+        # Store-scoped prices for the whole page in a couple of batch calls
+        page_prices = {}
+        if store_id > 0 and items:
+            page_prices = await fetch_store_prices(config, [item.get("sku", "") for item in items])
+        
+        extract_started = time.perf_counter()
         for item in items:
             sku = item.get("sku", "")
             
@@ -261,26 +1040,34 @@ async def get_products(
                 elif attr_code == "image" and attr_value:
                     image_url = f"{config.magento_url.rstrip('/')}/media/catalog/product{attr_value}"
             
+            price = {
+                "base_price": base_price,
+                "special_price": special_price,
+                "special_price_from": special_from,
+                "special_price_to": special_to
+            }
+            if sku in page_prices:
+                price = resolve_store_price(page_prices[sku], store_id, price)
+            
             products.append({
                 "id": item.get("id", 0),
                 "sku": sku,
                 "name": item.get("name", ""),
                 "image_url": image_url,
-                "prices": [{
-                    "store_id": store_id,
-                    "base_price": base_price,
-                    "special_price": special_price,
-                    "special_price_from": special_from,
-                    "special_price_to": special_to
-                }]
+                "prices": [{"store_id": store_id, **price}]
             })
+        add_phase("extract", time.perf_counter() - extract_started)
         
-        return {
-            "items": products,
-            "total_count": products_result.get("total_count", 0),
-            "page": page,
-            "page_size": page_size
-        }
+        with timing_phase("serialize"):
+            body = json_body({
+                "items": products,
+                "total_count": products_result.get("total_count", 0),
+                "page": page,
+                "page_size": page_size
+            })
+            etag = etag_for(body)
+        page_cache.put(cache_key, (body, etag))
+        return conditional_json(request, etag, body)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -332,29 +1119,14 @@ async def update_product_price(config: MagentoConfig, price_update: PriceUpdate)
         # Get store code for store-specific updates
         store_code = "all"
         if store_id > 0:
-            stores = await magento_request(config, "GET", "/store/storeViews")
-            for store in stores:
-                if store.get("id") == store_id:
-                    store_code = store.get("code", "all")
-                    break
-        
-        # Use OAuth for the update request
-        oauth = OAuth1(
-            config.consumer_key,
-            client_secret=config.consumer_secret,
-            resource_owner_key=config.access_token,
-            resource_owner_secret=config.access_token_secret,
-            signature_method='HMAC-SHA256'
-        )
-        
-        url = f"{config.magento_url.rstrip('/')}/rest/{store_code}/V1/products/{sku}"
-        headers = {"Content-Type": "application/json"}
+            registry = await get_store_views(config)
+            if store_id not in registry.by_id:
+                # A store view created since the last load
+                registry = await get_store_views(config, refresh=True)
+            store_code = registry.by_id.get(store_id, {}).get("code", "all")
         
-        response = requests.put(url, auth=oauth, headers=headers, json=product_data, timeout=30)
-        
-        if response.status_code >= 400:
-            logger.error(f"Magento update error: {response.text}")
-            raise HTTPException(status_code=response.status_code, detail=f"Errore aggiornamento: {response.text}")
+        await magento_request(config, "PUT", f"/products/{sku}", data=product_data, store_code=store_code)
+        prices_written(config, [sku])
         
         return {"success": True, "message": "Prezzo aggiornato con successo"}
     
@@ -379,6 +1151,7 @@ async def update_special_price(config: MagentoConfig, price_update: PriceUpdate)
         }
         
         result = await magento_request(config, "POST", "/products/special-price", data=payload)
+        prices_written(config, [price_update.sku])
         return {"success": True, "message": "Prezzo scontato aggiornato"}
     except HTTPException as e:
         raise e
@@ -401,6 +1174,7 @@ async def delete_special_price(config: MagentoConfig, sku: str = Query(...), sto
         }
         
         result = await magento_request(config, "POST", "/products/special-price-delete", data=payload)
+        prices_written(config, [sku])
         return {"success": True, "message": "Prezzo scontato rimosso"}
     except HTTPException as e:
         raise e
@@ -441,11 +1215,45 @@ async def load_config():
         raise HTTPException(status_code=500, detail=str(e))
 
 # VAT Rates Management
+# Cached for export, import and comparison; saving invalidates this process' cache and
+# the TTL bounds staleness in other workers. GET /vat-rates always reads MongoDB.
+VAT_RATES_CACHE_TTL = float(os.environ.get('VAT_RATES_CACHE_TTL', '60'))
+
+class VatRateCache:
+    """VAT rate documents keyed by store_id, reloaded after a save or once the TTL expires"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.rates: Optional[Dict[int, dict]] = None
+        self.loaded_at = 0.0
+        # Bumped on every invalidation, so a load that raced with a save is not kept
+        self.generation = 0
+
+    async def get(self) -> Dict[int, dict]:
+        if self.rates is not None and time.monotonic() - self.loaded_at < self.ttl:
+            return self.rates
+        generation = self.generation
+        docs = await db.vat_rates.find({}, {"_id": 0}).to_list(None)
+        rates = {doc["store_id"]: doc for doc in docs}
+        if generation == self.generation:
+            self.rates, self.loaded_at = rates, time.monotonic()
+        return rates
+
+    async def by_store(self) -> Dict[int, float]:
+        return {store_id: doc.get("vat_rate", 0) for store_id, doc in (await self.get()).items()}
+
+    def invalidate(self):
+        self.generation += 1
+        self.rates = None
+
+vat_rate_cache = VatRateCache(VAT_RATES_CACHE_TTL)
+
 @api_router.get("/vat-rates")
 async def get_vat_rates():
     """Get VAT rates for all stores"""
     try:
-        rates = await db.vat_rates.find({}, {"_id": 0}).to_list(100)
+        # Read from MongoDB, not the cache: a save through another worker shows up at once
+        rates = await db.vat_rates.find({}, {"_id": 0}).sort("store_id", 1).to_list(None)
         return {"success": True, "vat_rates": rates}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -454,132 +1262,1354 @@ async def get_vat_rates():
 async def save_vat_rates(data: VatRatesUpdate):
     """Save VAT rates for stores"""
     try:
-        # Clear existing rates and insert new ones
-        await db.vat_rates.delete_many({})
-        if data.vat_rates:
-            rates_dicts = [rate.model_dump() for rate in data.vat_rates]
-            await db.vat_rates.insert_many(rates_dicts)
+        # One ordered bulk write replaces each rate in place and then drops the stores no longer listed,
+        # so a concurrent export never sees an empty table
+        rates_dicts = [rate.model_dump() for rate in data.vat_rates]
+        operations = [ReplaceOne({"store_id": rate["store_id"]}, rate, upsert=True) for rate in rates_dicts]
+        operations.append(DeleteMany({"store_id": {"$nin": [rate["store_id"] for rate in rates_dicts]}}))
+        try:
+            await db.vat_rates.bulk_write(operations, ordered=True)
+        finally:
+            vat_rate_cache.invalidate()
         return {"success": True, "message": "Aliquote IVA salvate"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Excel Export
-@api_router.post("/export-prices")
-async def export_prices(config: MagentoConfig):
-    """Export all products prices to Excel"""
+@app.on_event("startup")
+async def setup_vat_rates():
     try:
-        # Get all store views
-        stores = await magento_request(config, "GET", "/store/storeViews")
+        await db.vat_rates.create_index("store_id", unique=True)
+    except Exception as e:
+        logger.error(f"Error creating VAT rates index: {e}")
+
+# Local catalog mirror (MongoDB), filled by full and incremental syncs
+CATALOG_SYNC_INTERVAL = float(os.environ.get('CATALOG_SYNC_INTERVAL', '0'))  # seconds, 0 = manual only
+# Scheduled syncs are full once the last full one is this old: batch price writes made outside
+# this backend do not move updated_at, so incremental syncs never see them
+CATALOG_FULL_SYNC_INTERVAL = float(os.environ.get('CATALOG_FULL_SYNC_INTERVAL', '86400'))  # seconds, 0 = never
+
+# Keep references to running syncs, one per Magento installation
+catalog_sync_tasks: Dict[str, asyncio.Task] = {}
+periodic_sync_task: Optional[asyncio.Task] = None
+
+def mirror_doc_id(base_url: str, sku: str) -> str:
+    return f"{base_url}|{sku}"
+
+def build_mirror_doc(base_url: str, item: dict, store_prices: Dict[int, dict], synced_at: str) -> dict:
+    """Mirror document for a Magento product: name, image and the prices of every store scope"""
+    image = None
+    fallback = {"base_price": item.get("price")}
+    for attr in item.get("custom_attributes", []):
+        attr_code = attr.get("attribute_code", "")
+        attr_value = attr.get("value")
+        if attr_code == "image" and attr_value:
+            image = attr_value
+        elif attr_code == "special_price" and attr_value:
+            try:
+                fallback["special_price"] = float(attr_value)
+            except:
+                pass
+        elif attr_code == "special_from_date":
+            fallback["special_price_from"] = attr_value
+        elif attr_code == "special_to_date":
+            fallback["special_price_to"] = attr_value
+    
+    # The default scope always carries the product-level values
+    scopes = {0: {**fallback, **store_prices.get(0, {})}}
+    scopes.update({sid: scope for sid, scope in store_prices.items() if sid != 0})
+    return {
+        "_id": mirror_doc_id(base_url, item.get("sku", "")),
+        "magento_url": base_url,
+        "sku": item.get("sku", ""),
+        "product_id": item.get("id", 0),
+        "name": item.get("name", ""),
+        "image": image,
+        "updated_at": item.get("updated_at"),
+        "prices": [{"store_id": sid, **scope} for sid, scope in sorted(scopes.items())],
+        "synced_at": synced_at
+    }
+
+def mirror_store_prices(doc: dict) -> Dict[int, dict]:
+    return {scope["store_id"]: scope for scope in doc.get("prices", [])}
+
+def mirror_doc_to_product(doc: dict) -> dict:
+    """Shape a mirror document like a Magento product for the export row builder"""
+    return {"sku": doc["sku"], "name": doc.get("name", ""), "price": mirror_store_prices(doc).get(0, {}).get("base_price")}
+
+async def sync_catalog(config: MagentoConfig, full: bool = False) -> dict:
+    """Copy products and store prices into the mirror; incremental syncs only read products updated since the last one"""
+    base_url = config.magento_url.rstrip('/')
+    state = await db.catalog_sync.find_one({"_id": base_url}) or {}
+    full = full or not state.get("last_full_sync")
+    started_at = datetime.now(timezone.utc).isoformat()
+    last_updated_at = state.get("last_updated_at") or ""
+    
+    filters = None
+    if not full and last_updated_at:
+        # gteq: products saved within the same second as the cursor are read again
+        filters = {
+            "searchCriteria[filter_groups][0][filters][0][field]": "updated_at",
+            "searchCriteria[filter_groups][0][filters][0][value]": last_updated_at,
+            "searchCriteria[filter_groups][0][filters][0][condition_type]": "gteq",
+        }
+    
+    synced_count = 0
+    async for items in iter_product_pages(config, filters=filters, fields=CATALOG_SYNC_FIELDS):
+        if not items:
+            continue
+        await write_mirror_page(config, items, started_at)
+        for item in items:
+            last_updated_at = max(last_updated_at, item.get("updated_at") or "")
+        synced_count += len(items)
+    
+    if full:
+        # Products no longer in Magento were not touched by this sync
+        await db.catalog_products.delete_many({"magento_url": base_url, "synced_at": {"$lt": started_at}})
+    
+    state_update = {
+        "last_sync": started_at,
+        "last_change": started_at,
+        "last_updated_at": last_updated_at,
+        "product_count": await db.catalog_products.count_documents({"magento_url": base_url})
+    }
+    if full:
+        state_update["last_full_sync"] = started_at
+    await db.catalog_sync.update_one({"_id": base_url}, {"$set": state_update}, upsert=True)
+    logger.info(f"Catalog sync ({'full' if full else 'incremental'}) for {base_url}: {synced_count} products")
+    return {"full": full, "synced_count": synced_count, **state_update}
+
+async def write_mirror_page(config: MagentoConfig, items: List[dict], synced_at: str):
+    """Upsert mirror documents for a page of Magento products, with the prices of every store"""
+    base_url = config.magento_url.rstrip('/')
+    page_prices = await fetch_store_prices(config, [item.get("sku", "") for item in items])
+    operations = []
+    for item in items:
+        doc = build_mirror_doc(base_url, item, page_prices.get(item.get("sku", ""), {}), synced_at)
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": doc}, upsert=True))
+    await db.catalog_products.bulk_write(operations, ordered=False)
+
+async def refresh_mirror_products(config: MagentoConfig, skus: List[str]):
+    """Re-read the given SKUs into the mirror, when this Magento has one"""
+    base_url = config.magento_url.rstrip('/')
+    state = await db.catalog_sync.find_one({"_id": base_url}, {"last_sync": 1}) or {}
+    if not state.get("last_sync"):
+        return
+    synced_at = datetime.now(timezone.utc).isoformat()
+    for i in range(0, len(skus), PRICE_CHUNK_SIZE):
+        filters = {
+            "searchCriteria[filter_groups][0][filters][0][field]": "sku",
+            "searchCriteria[filter_groups][0][filters][0][value]": ",".join(skus[i:i + PRICE_CHUNK_SIZE]),
+            "searchCriteria[filter_groups][0][filters][0][condition_type]": "in",
+        }
+        async for items in iter_product_pages(config, page_size=PRICE_CHUNK_SIZE, filters=filters, fields=CATALOG_SYNC_FIELDS):
+            if items:
+                await write_mirror_page(config, items, synced_at)
+    # Mirror pages and matrices are versioned by the last change, not only by syncs
+    await db.catalog_sync.update_one({"_id": base_url}, {"$set": {"last_change": synced_at}})
+
+# Keep references to running mirror refreshes
+mirror_refresh_tasks: set = set()
+
+def prices_written(config: MagentoConfig, skus: List[str]):
+    """After a price write: drop cached /products pages and comparison matrix, copy the SKUs into the mirror in the background"""
+    forget_product_pages(config)
+    get_magento_client(config).price_matrix = None
+    skus = sorted(set(skus))
+    if not skus:
+        return
+    
+    async def run():
+        try:
+            await refresh_mirror_products(config, skus)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.error(f"Mirror refresh of {len(skus)} SKUs failed: {detail}")
+    
+    task = asyncio.create_task(run())
+    mirror_refresh_tasks.add(task)
+    task.add_done_callback(mirror_refresh_tasks.discard)
+
+def start_catalog_sync(config: MagentoConfig, full: bool = False) -> bool:
+    """Run a sync in the background unless one is already running for this Magento"""
+    base_url = config.magento_url.rstrip('/')
+    if base_url in catalog_sync_tasks:
+        return False
+    
+    async def run():
+        try:
+            await sync_catalog(config, full)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.error(f"Catalog sync failed for {base_url}: {detail}")
+            await db.catalog_sync.update_one({"_id": base_url}, {"$set": {"last_error": detail}}, upsert=True)
+    
+    task = asyncio.create_task(run())
+    catalog_sync_tasks[base_url] = task
+    task.add_done_callback(lambda _: catalog_sync_tasks.pop(base_url, None))
+    return True
+
+async def catalog_freshness(config: MagentoConfig) -> dict:
+    base_url = config.magento_url.rstrip('/')
+    state = await db.catalog_sync.find_one({"_id": base_url}, {"_id": 0}) or {}
+    age_seconds = None
+    if state.get("last_sync"):
+        age_seconds = round((datetime.now(timezone.utc) - datetime.fromisoformat(state["last_sync"])).total_seconds())
+    return {
+        "source": "mirror",
+        "last_sync": state.get("last_sync"),
+        "last_full_sync": state.get("last_full_sync"),
+        "last_change": state.get("last_change") or state.get("last_sync"),
+        "age_seconds": age_seconds,
+        "product_count": state.get("product_count", 0),
+        "syncing": base_url in catalog_sync_tasks,
+        "last_error": state.get("last_error")
+    }
+
+async def require_mirror(config: MagentoConfig) -> dict:
+    freshness = await catalog_freshness(config)
+    if not freshness["last_sync"]:
+        raise HTTPException(status_code=409, detail="Catalogo locale non ancora sincronizzato")
+    return freshness
+
+async def iter_mirror_pages(config: MagentoConfig, page_size: int = CATALOG_PAGE_SIZE) -> AsyncIterator[List[dict]]:
+    cursor = db.catalog_products.find({"magento_url": config.magento_url.rstrip('/')}).sort("product_id", 1)
+    page = []
+    async for doc in cursor:
+        page.append(doc)
+        if len(page) >= page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+async def get_mirror_products(config: MagentoConfig, store_id: int, page: int, page_size: int, search: Optional[str]) -> dict:
+    """/products served from the mirror, same shape as the Magento path plus freshness"""
+    freshness = await require_mirror(config)
+    base_url = config.magento_url.rstrip('/')
+    query = {"magento_url": base_url}
+    
+    if search:
+        # Ranked page of SKUs from the search index, documents fetched by id
+        search_index = await get_search_index(config)
+        ranked = search_index.search(search)
+        page_skus = ranked[(page - 1) * page_size:page * page_size]
+        total_count = len(ranked)
+        by_sku = {}
+        if page_skus:
+            query["_id"] = {"$in": [mirror_doc_id(base_url, sku) for sku in page_skus]}
+            by_sku = {doc["sku"]: doc for doc in await db.catalog_products.find(query).to_list(len(page_skus))}
+        docs = [by_sku[sku] for sku in page_skus if sku in by_sku]
+    else:
+        total_count = await db.catalog_products.count_documents(query)
+        docs = await db.catalog_products.find(query).sort("product_id", 1).skip((page - 1) * page_size).limit(page_size).to_list(page_size)
+    
+    products = []
+    for doc in docs:
+        price = resolve_store_price(mirror_store_prices(doc), store_id, {})
+        products.append({
+            "id": doc.get("product_id", 0),
+            "sku": doc["sku"],
+            "name": doc.get("name", ""),
+            "image_url": f"{base_url}/media/catalog/product{doc['image']}" if doc.get("image") else None,
+            "prices": [{"store_id": store_id, **price}]
+        })
+    
+    return {
+        "items": products,
+        "total_count": total_count,
+        "page": page,
+        "page_size": page_size,
+        "freshness": freshness
+    }
+
+# Product search index (in memory, built from the catalog mirror)
+SEARCH_TOKEN_RE = re.compile(r"\w+")
+# Live /products searches only trust the index while the mirror is at most this old (seconds)
+SEARCH_INDEX_MAX_AGE = float(os.environ.get('SEARCH_INDEX_MAX_AGE', '900'))
+
+def normalize_search_text(text: Optional[str]) -> str:
+    """Lowercase and strip accents, so 'caffè' matches 'caffe'"""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+def tokenize_search_text(text: Optional[str]) -> List[str]:
+    return SEARCH_TOKEN_RE.findall(normalize_search_text(text))
+
+class ProductSearchIndex:
+    """SKU prefix lookup and accent-insensitive name token search, ranked"""
+
+    def __init__(self, docs: List[dict], version: Optional[str]):
+        self.version = version
+        entries = sorted((normalize_search_text(doc["sku"]), doc["sku"], doc.get("name", "")) for doc in docs)
+        self.sku_keys = [key for key, _, _ in entries]
+        self.skus = [sku for _, sku, _ in entries]
+        postings: Dict[str, List[int]] = {}
+        for position, (_, _, name) in enumerate(entries):
+            for token in set(tokenize_search_text(name)):
+                postings.setdefault(token, []).append(position)
+        self.postings = postings
+        self.token_keys = sorted(postings)
+
+    @staticmethod
+    def _prefix_range(keys: List[str], prefix: str) -> range:
+        return range(bisect.bisect_left(keys, prefix), bisect.bisect_left(keys, prefix + "\uffff"))
+
+    def _token_matches(self, token: str) -> Dict[int, bool]:
+        """Positions whose name has a word starting with token; True when the word is exactly token"""
+        matches = {}
+        for key_idx in self._prefix_range(self.token_keys, token):
+            key = self.token_keys[key_idx]
+            for position in self.postings[key]:
+                matches[position] = matches.get(position, False) or key == token
+        return matches
+
+    def search(self, query: str) -> List[str]:
+        """All matching SKUs, best first: exact SKU, SKU prefix, exact name words, name word prefixes"""
+        scores: Dict[int, int] = {}
+        sku_query = normalize_search_text(query).strip()
+        if sku_query:
+            for position in self._prefix_range(self.sku_keys, sku_query):
+                scores[position] = 4 if self.sku_keys[position] == sku_query else 3
         
-        # Get VAT rates
-        vat_rates_cursor = db.vat_rates.find({}, {"_id": 0})
-        vat_rates_list = await vat_rates_cursor.to_list(100)
-        vat_rates = {rate["store_id"]: rate["vat_rate"] for rate in vat_rates_list}
+        tokens = tokenize_search_text(query)
+        if tokens:
+            matched = None
+            for token in tokens:
+                token_matches = self._token_matches(token)
+                if matched is None:
+                    matched = token_matches
+                else:
+                    matched = {p: exact and token_matches[p] for p, exact in matched.items() if p in token_matches}
+                if not matched:
+                    break
+            for position, exact in (matched or {}).items():
+                scores[position] = max(scores.get(position, 0), 2 if exact else 1)
         
-        # Fetch all products (paginated)
-        all_products = []
-        page = 1
-        page_size = 100
+        ranked = sorted(scores, key=lambda position: (-scores[position], position))
+        return [self.skus[position] for position in ranked]
+
+search_indexes: Dict[str, ProductSearchIndex] = {}
+search_index_locks: Dict[str, asyncio.Lock] = {}
+
+async def get_search_index(config: MagentoConfig, max_age: Optional[float] = None) -> Optional[ProductSearchIndex]:
+    """Index for this Magento's mirror, rebuilt after each sync; None when never synced or older than max_age"""
+    base_url = config.magento_url.rstrip('/')
+    state = await db.catalog_sync.find_one({"_id": base_url}, {"last_sync": 1}) or {}
+    if not state.get("last_sync"):
+        return None
+    if max_age is not None:
+        age = (datetime.now(timezone.utc) - datetime.fromisoformat(state["last_sync"])).total_seconds()
+        if age > max_age:
+            return None
+    
+    search_index = search_indexes.get(base_url)
+    if search_index and search_index.version == state["last_sync"]:
+        return search_index
+    
+    # Concurrent searches wait for a single rebuild
+    async with search_index_locks.setdefault(base_url, asyncio.Lock()):
+        search_index = search_indexes.get(base_url)
+        if search_index and search_index.version == state["last_sync"]:
+            return search_index
+        docs = await db.catalog_products.find({"magento_url": base_url}, {"_id": 0, "sku": 1, "name": 1}).to_list(None)
+        search_index = await asyncio.to_thread(ProductSearchIndex, docs, state["last_sync"])
+        search_indexes[base_url] = search_index
+        return search_index
+
+@api_router.post("/catalog/sync")
+async def trigger_catalog_sync(config: MagentoConfig, full: bool = Query(False, description="Full resync instead of incremental")):
+    """Start a background sync of the local catalog mirror"""
+    started = start_catalog_sync(config, full)
+    return {
+        "success": True,
+        "message": "Sincronizzazione avviata" if started else "Sincronizzazione già in corso",
+        "freshness": await catalog_freshness(config)
+    }
+
+@api_router.post("/catalog/status")
+async def get_catalog_status(config: MagentoConfig):
+    """Freshness of the local catalog mirror"""
+    try:
+        return {"success": True, "freshness": await catalog_freshness(config)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def full_sync_due(state: dict) -> bool:
+    if CATALOG_FULL_SYNC_INTERVAL <= 0 or not state.get("last_full_sync"):
+        return False
+    age = (datetime.now(timezone.utc) - datetime.fromisoformat(state["last_full_sync"])).total_seconds()
+    return age >= CATALOG_FULL_SYNC_INTERVAL
+
+async def periodic_catalog_sync():
+    """Sync of the saved configuration every CATALOG_SYNC_INTERVAL seconds, full every CATALOG_FULL_SYNC_INTERVAL"""
+    while True:
+        await asyncio.sleep(CATALOG_SYNC_INTERVAL)
+        try:
+            saved = await db.magento_config.find_one({"_id": "default"}, {"_id": 0, "updated_at": 0})
+            if saved:
+                config = MagentoConfig(**saved)
+                state = await db.catalog_sync.find_one({"_id": config.magento_url.rstrip('/')}, {"last_full_sync": 1}) or {}
+                start_catalog_sync(config, full=full_sync_due(state))
+        except Exception as e:
+            logger.error(f"Error scheduling catalog sync: {e}")
+
+@app.on_event("startup")
+async def setup_catalog_mirror():
+    global periodic_sync_task
+    try:
+        await db.catalog_products.create_index([("magento_url", 1), ("product_id", 1)])
+        await db.catalog_products.create_index([("magento_url", 1), ("sku", 1)], unique=True)
+    except Exception as e:
+        logger.error(f"Error creating catalog indexes: {e}")
+    if CATALOG_SYNC_INTERVAL > 0:
+        periodic_sync_task = asyncio.create_task(periodic_catalog_sync())
+
+# Excel Export
+EXPORT_COLUMNS = [
+    "SKU",
+    "Nome Prodotto",
+    "Store",
+    "Store Nome",
+    "Aliquota IVA %",
+    "Prezzo Base (IVA incl.)",
+    "Prezzo Scontato (IVA incl.)",
+    "Data Inizio Sconto",
+    "Data Fine Sconto"
+]
+# Column widths are estimated from the first rows instead of scanning the whole sheet
+EXPORT_WIDTH_SAMPLE_ROWS = int(os.environ.get('EXPORT_WIDTH_SAMPLE_ROWS', '500'))
+EXPORT_STREAM_CHUNK_SIZE = 64 * 1024
+EXPORT_PARQUET_ROW_GROUP = int(os.environ.get('EXPORT_PARQUET_ROW_GROUP', '50000'))
+EXPORT_MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+def load_pyarrow() -> tuple:
+    """pyarrow is optional and only imported by the Parquet paths"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise HTTPException(status_code=400, detail="Formato Parquet non disponibile: installare pyarrow")
+    return pyarrow, pyarrow.parquet
+
+def parse_export_date(value) -> Optional[date]:
+    """Magento 'Y-m-d H:i:s' or 'Y-m-d' strings as dates, None when empty or malformed"""
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d").date() if value else None
+    except ValueError:
+        return None
+
+def product_price_fallback(product: dict) -> dict:
+    """Product-level prices, used when no store scope carries its own"""
+    base_price = product.get("price", 0)
+    
+    # Extract special price info
+    special_price = None
+    special_from = None
+    special_to = None
+    
+    for attr in product.get("custom_attributes", []):
+        attr_code = attr.get("attribute_code", "")
+        attr_value = attr.get("value")
+        if attr_code == "special_price" and attr_value:
+            try:
+                special_price = float(attr_value)
+            except:
+                pass
+        elif attr_code == "special_from_date":
+            special_from = attr_value
+        elif attr_code == "special_to_date":
+            special_to = attr_value
+    
+    return {
+        "base_price": base_price,
+        "special_price": special_price,
+        "special_price_from": special_from,
+        "special_price_to": special_to
+    }
+
+def build_export_rows(
+    product: dict,
+    stores: List[dict],
+    vat_rates: Dict[int, float],
+    store_prices: Dict[int, dict]
+) -> List[list]:
+    """Build one export row per store view for a Magento product"""
+    sku = product.get("sku", "")
+    name = product.get("name", "")
+    fallback = product_price_fallback(product)
+    
+    # Add row for each store, with the prices of its own scope
+    rows = []
+    for store in stores:
+        store_id = store.get("id", 0)
+        vat_rate = vat_rates.get(store_id, 0)
+        price = resolve_store_price(store_prices, store_id, fallback)
+        store_base_price = price["base_price"]
+        store_special_price = price["special_price"]
         
-        while True:
-            params = {
-                "searchCriteria[pageSize]": page_size,
-                "searchCriteria[currentPage]": page,
-            }
-            result = await magento_request(config, "GET", "/products", params=params)
-            items = result.get("items", [])
-            
-            if not items:
-                break
-                
-            all_products.extend(items)
-            
-            if len(items) < page_size:
-                break
-            page += 1
-            
-            # Safety limit
-            if page > 50:
+        # Calculate price with VAT for display
+        vat_multiplier = 1 + (vat_rate / 100) if vat_rate > 0 else 1
+        base_price_incl_vat = store_base_price * vat_multiplier if store_base_price else None
+        special_price_incl_vat = store_special_price * vat_multiplier if store_special_price else None
+        
+        rows.append([
+            sku,
+            name,
+            store.get("code", ""),
+            store.get("name", ""),
+            vat_rate,
+            round(base_price_incl_vat, 2) if base_price_incl_vat else None,
+            round(special_price_incl_vat, 2) if special_price_incl_vat else None,
+            price["special_price_from"],
+            price["special_price_to"],
+        ])
+    return rows
+
+async def iter_file_chunks(spool) -> AsyncIterator[bytes]:
+    """Stream a spooled file to the client and close it afterwards"""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(spool.read, EXPORT_STREAM_CHUNK_SIZE)
+            if not chunk:
                 break
+            yield chunk
+    finally:
+        spool.close()
+
+async def iter_export_pages(config: MagentoConfig, source: str) -> AsyncIterator[tuple]:
+    """Yield (products, store prices by SKU) pages from Magento or from the local mirror"""
+    if source == "mirror":
+        async for docs in iter_mirror_pages(config):
+            yield [mirror_doc_to_product(doc) for doc in docs], {doc["sku"]: mirror_store_prices(doc) for doc in docs}
+        return
+    async for items in iter_product_pages(config, fields=EXPORT_FIELDS):
+        yield items, await fetch_store_prices(config, [product.get("sku", "") for product in items])
+
+async def iter_export_rows(
+    config: MagentoConfig,
+    source: str,
+    stores: List[dict],
+    vat_rates: Dict[int, float]
+) -> AsyncIterator[List[list]]:
+    """Export rows page by page, as product pages arrive (pages fetched concurrently)"""
+    async for items, page_prices in iter_export_pages(config, source):
+        with timing_phase("rows"):
+            yield [
+                row
+                for product in items
+                for row in build_export_rows(product, stores, vat_rates, page_prices.get(product.get("sku", ""), {}))
+            ]
+
+async def write_xlsx_export(spool, pages: AsyncIterator[List[list]]) -> int:
+    """Constant-memory workbook: each row is flushed to disk once written; returns the row count"""
+    workbook = xlsxwriter.Workbook(spool, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Prezzi')
+    worksheet.write_row(0, 0, EXPORT_COLUMNS)
+    widths = [len(col) for col in EXPORT_COLUMNS]
+    row_idx = 1
+    
+    async for rows in pages:
+        page_started = time.perf_counter()
+        for row in rows:
+            if row_idx <= EXPORT_WIDTH_SAMPLE_ROWS:
+                widths = [
+                    max(width, len(str(value)) if value is not None else 0)
+                    for width, value in zip(widths, row)
+                ]
+            worksheet.write_row(row_idx, 0, row)
+            row_idx += 1
+        add_phase("excel_write", time.perf_counter() - page_started)
+    
+    # Auto-adjust column widths
+    for idx, width in enumerate(widths):
+        worksheet.set_column(idx, idx, min(width + 2, 40))
+    
+    with timing_phase("excel_close"):
+        await asyncio.to_thread(workbook.close)
+    return row_idx - 1
+
+def export_parquet_schema(pa):
+    """Typed columns: prices as float64, special price dates as date32"""
+    return pa.schema([
+        (EXPORT_COLUMNS[0], pa.string()),
+        (EXPORT_COLUMNS[1], pa.string()),
+        (EXPORT_COLUMNS[2], pa.string()),
+        (EXPORT_COLUMNS[3], pa.string()),
+        (EXPORT_COLUMNS[4], pa.float64()),
+        (EXPORT_COLUMNS[5], pa.float64()),
+        (EXPORT_COLUMNS[6], pa.float64()),
+        (EXPORT_COLUMNS[7], pa.date32()),
+        (EXPORT_COLUMNS[8], pa.date32())
+    ])
+
+def build_parquet_table(pa, schema, rows: List[list]):
+    columns = [list(column) for column in zip(*rows)]
+    for date_idx in (7, 8):
+        columns[date_idx] = [parse_export_date(value) for value in columns[date_idx]]
+    return pa.Table.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema
+    )
+
+async def write_parquet_export(spool, pages: AsyncIterator[List[list]]) -> int:
+    """One Parquet row group per EXPORT_PARQUET_ROW_GROUP rows; returns the row count"""
+    pa, pq = load_pyarrow()
+    schema = export_parquet_schema(pa)
+    writer = pq.ParquetWriter(spool, schema, compression="snappy")
+    pending: List[list] = []
+    row_count = 0
+    try:
+        async for rows in pages:
+            pending.extend(rows)
+            row_count += len(rows)
+            if len(pending) >= EXPORT_PARQUET_ROW_GROUP:
+                with timing_phase("parquet_write"):
+                    await asyncio.to_thread(writer.write_table, build_parquet_table(pa, schema, pending))
+                pending = []
+        if pending:
+            with timing_phase("parquet_write"):
+                await asyncio.to_thread(writer.write_table, build_parquet_table(pa, schema, pending))
+    finally:
+        await asyncio.to_thread(writer.close)
+    return row_count
+
+def format_csv_rows(rows: List[list]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue()
+
+async def stream_csv_export(pages: AsyncIterator[List[list]]) -> AsyncIterator[str]:
+    """CSV text sent to the client page by page, nothing is spooled"""
+    started = time.perf_counter()
+    row_count = 0
+    try:
+        yield format_csv_rows([EXPORT_COLUMNS])
+        async for rows in pages:
+            row_count += len(rows)
+            yield format_csv_rows(rows)
+    except Exception as e:
+        # Headers are already sent: the client sees a truncated download
+        logger.error(f"Error streaming CSV export after {row_count} rows: {e}")
+        raise
+    record_row_throughput("export", row_count, time.perf_counter() - started)
+
+@api_router.post("/export-prices")
+async def export_prices(
+    config: MagentoConfig,
+    source: str = Query("magento", description="magento or mirror (local catalog copy)"),
+    format: str = Query("xlsx", description="xlsx, csv or parquet")
+):
+    """Export all products prices to Excel, CSV or Parquet"""
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Formato non supportato: {format}")
+    spool = None
+    try:
+        headers = {}
+        if source == "mirror":
+            freshness = await require_mirror(config)
+            headers["X-Catalog-Synced-At"] = freshness["last_sync"]
+        if format == "parquet":
+            load_pyarrow()
         
-        # Build Excel data
-        rows = []
-        for product in all_products:
-            sku = product.get("sku", "")
-            name = product.get("name", "")
-            base_price = product.get("price", 0)
-            
-            # Extract special price info
-            special_price = None
-            special_from = None
-            special_to = None
-            
-            for attr in product.get("custom_attributes", []):
-                attr_code = attr.get("attribute_code", "")
-                attr_value = attr.get("value")
-                if attr_code == "special_price" and attr_value:
-                    try:
-                        special_price = float(attr_value)
-                    except:
-                        pass
-                elif attr_code == "special_from_date":
-                    special_from = attr_value
-                elif attr_code == "special_to_date":
-                    special_to = attr_value
-            
-            # Add row for each store
-            for store in stores:
-                store_id = store.get("id", 0)
-                store_code = store.get("code", "")
-                store_name = store.get("name", "")
-                vat_rate = vat_rates.get(store_id, 0)
-                
-                # Calculate price with VAT for display
-                vat_multiplier = 1 + (vat_rate / 100) if vat_rate > 0 else 1
-                base_price_incl_vat = base_price * vat_multiplier if base_price else None
-                special_price_incl_vat = special_price * vat_multiplier if special_price else None
-                
-                rows.append({
-                    "SKU": sku,
-                    "Nome Prodotto": name,
-                    "Store": store_code,
-                    "Store Nome": store_name,
-                    "Aliquota IVA %": vat_rate,
-                    "Prezzo Base (IVA incl.)": round(base_price_incl_vat, 2) if base_price_incl_vat else None,
-                    "Prezzo Scontato (IVA incl.)": round(special_price_incl_vat, 2) if special_price_incl_vat else None,
-                    "Data Inizio Sconto": special_from,
-                    "Data Fine Sconto": special_to,
-                })
+        # Get all store views
+        stores = (await get_store_views(config)).stores
         
-        # Create Excel file
-        df = pd.DataFrame(rows)
-        output = BytesIO()
+        # Get VAT rates
+        vat_rates = await vat_rate_cache.by_store()
         
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Prezzi')
-            
-            # Auto-adjust column widths
-            worksheet = writer.sheets['Prezzi']
-            for idx, col in enumerate(df.columns):
-                max_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
-                worksheet.set_column(idx, idx, min(max_len, 40))
+        filename = f"prezzi_magento_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
+        headers["Content-Disposition"] = f"attachment; filename={filename}"
+        pages = iter_export_rows(config, source, stores, vat_rates)
         
-        output.seek(0)
+        if format == "csv":
+            return StreamingResponse(stream_csv_export(pages), media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
         
-        filename = f"prezzi_magento_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        # XLSX and Parquet files are only valid once finished, so they are built on disk first
+        spool = tempfile.TemporaryFile()
+        started = time.perf_counter()
+        if format == "parquet":
+            row_count = await write_parquet_export(spool, pages)
+        else:
+            row_count = await write_xlsx_export(spool, pages)
+        spool.seek(0)
+        record_row_throughput("export", row_count, time.perf_counter() - started)
         
-        return StreamingResponse(
-            output,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        return StreamingResponse(iter_file_chunks(spool), media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
     except HTTPException as e:
+        if spool:
+            spool.close()
         raise e
     except Exception as e:
+        if spool:
+            spool.close()
         logger.error(f"Error exporting prices: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Cross-store price comparison on a columnar SKU x store view price matrix
+# A store is an outlier when its price is this far from the SKU median, in percent
+COMPARISON_OUTLIER_PCT = float(os.environ.get('COMPARISON_OUTLIER_PCT', '20'))
+# A store deviates when its price is this far from the reference store price, in percent
+COMPARISON_DEVIATION_PCT = float(os.environ.get('COMPARISON_DEVIATION_PCT', '5'))
+# Matrices built from a Magento crawl are reused for this many seconds
+COMPARISON_MATRIX_TTL = float(os.environ.get('COMPARISON_MATRIX_TTL', '300'))
+
+class PriceMatrix:
+    """Net prices of every SKU (rows) in every store view (columns); NaN/NaT where nothing applies"""
+
+    def __init__(
+        self,
+        skus: List[str],
+        store_ids: List[int],
+        base: np.ndarray,
+        special: np.ndarray,
+        special_from: np.ndarray,
+        special_to: np.ndarray,
+        version: Optional[str] = None
+    ):
+        self.skus = skus
+        self.sku_index = {sku: row for row, sku in enumerate(skus)}
+        self.store_ids = store_ids
+        self.store_index = {store_id: col for col, store_id in enumerate(store_ids)}
+        self.base = base
+        self.special = special
+        self.special_from = special_from
+        self.special_to = special_to
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def effective_prices(self, today: np.datetime64) -> np.ndarray:
+        """Special price where it is active today and lower, the base price elsewhere"""
+        # NaT compares False, so open-ended special prices count as active
+        active = ~np.isnan(self.special) & ~(self.special_from > today) & ~(self.special_to < today)
+        return np.where(active, np.fmin(self.base, self.special), self.base)
+
+    def vat_multipliers(self, vat_rates: Dict[int, float]) -> np.ndarray:
+        return np.array([1 + vat_rates.get(store_id, 0) / 100 for store_id in self.store_ids])
+
+def build_price_matrix_page(products: List[dict], page_prices: Dict[str, Dict[int, dict]], store_ids: List[int]) -> tuple:
+    """Matrix rows of one product page, store scopes resolved like the export does"""
+    shape = (len(products), len(store_ids))
+    base = np.full(shape, np.nan)
+    special = np.full(shape, np.nan)
+    special_from = np.full(shape, np.datetime64("NaT"), dtype="datetime64[D]")
+    special_to = np.full(shape, np.datetime64("NaT"), dtype="datetime64[D]")
+    skus = []
+    for row, product in enumerate(products):
+        sku = product.get("sku", "")
+        skus.append(sku)
+        fallback = product_price_fallback(product)
+        for col, store_id in enumerate(store_ids):
+            price = resolve_store_price(page_prices.get(sku, {}), store_id, fallback)
+            if price["base_price"] is not None:
+                base[row, col] = price["base_price"]
+            if price["special_price"] is not None:
+                special[row, col] = price["special_price"]
+                special_from[row, col] = parse_export_date(price["special_price_from"])
+                special_to[row, col] = parse_export_date(price["special_price_to"])
+    return skus, base, special, special_from, special_to
+
+async def build_price_matrix(config: MagentoConfig, source: str, store_ids: List[int], version: Optional[str] = None) -> PriceMatrix:
+    """Matrix of the whole catalog from the bulk price reads (or the mirror), one page at a time"""
+    pages = []
+    async for items, page_prices in iter_export_pages(config, source):
+        pages.append(build_price_matrix_page(items, page_prices, store_ids))
+    if not pages:
+        pages.append(build_price_matrix_page([], {}, store_ids))
+    skus = [sku for page in pages for sku in page[0]]
+    arrays = [np.concatenate([page[idx] for page in pages]) for idx in range(1, 5)]
+    return PriceMatrix(skus, store_ids, *arrays, version=version)
+
+# Matrices built from the mirror, rebuilt after each sync like the search index
+price_matrices: Dict[str, PriceMatrix] = {}
+price_matrix_locks: Dict[str, asyncio.Lock] = {}
+
+async def get_price_matrix(config: MagentoConfig, source: str, store_ids: List[int]) -> PriceMatrix:
+    if source != "mirror":
+        # Kept on the client for COMPARISON_MATRIX_TTL seconds, so paging a comparison crawls Magento once
+        client = get_magento_client(config)
+        
+        def is_fresh(matrix: Optional[PriceMatrix]) -> bool:
+            return bool(matrix) and matrix.store_ids == store_ids and time.monotonic() - matrix.built_at < COMPARISON_MATRIX_TTL
+        
+        if is_fresh(client.price_matrix):
+            return client.price_matrix
+        async with client.price_matrix_lock:
+            if not is_fresh(client.price_matrix):
+                client.price_matrix = await build_price_matrix(config, source, store_ids)
+            return client.price_matrix
+    
+    freshness = await require_mirror(config)
+    base_url = config.magento_url.rstrip('/')
+    
+    def is_current(matrix: Optional[PriceMatrix]) -> bool:
+        return bool(matrix) and matrix.version == freshness["last_change"] and matrix.store_ids == store_ids
+    
+    if is_current(price_matrices.get(base_url)):
+        return price_matrices[base_url]
+    # Concurrent comparisons wait for a single rebuild
+    async with price_matrix_locks.setdefault(base_url, asyncio.Lock()):
+        if not is_current(price_matrices.get(base_url)):
+            price_matrices[base_url] = await build_price_matrix(config, source, store_ids, freshness["last_change"])
+        return price_matrices[base_url]
+
+def compare_store_prices(prices: np.ndarray, reference_col: Optional[int], outlier_pct: float, deviation_pct: float) -> dict:
+    """Per-SKU statistics over the store columns, computed for the whole matrix at once"""
+    priced = ~np.isnan(prices)
+    store_count = priced.sum(axis=1)
+    rows = np.flatnonzero(store_count > 0)
+    values = prices[rows]
+    if not len(rows):
+        # No priced SKU, or no store view besides admin: nan-reductions reject empty rows
+        empty, cells = np.empty(0), np.empty(values.shape)
+        return {
+            "rows": rows,
+            "prices": values,
+            "min": empty,
+            "max": empty,
+            "median": empty,
+            "spread": empty,
+            "spread_pct": empty,
+            "outliers": cells.astype(bool),
+            "deviation": cells,
+            "deviates": cells.astype(bool)
+        }
+    
+    minimum = np.nanmin(values, axis=1)
+    maximum = np.nanmax(values, axis=1)
+    median = np.nanmedian(values, axis=1)
+    spread = maximum - minimum
+    spread_pct = np.divide(spread * 100, minimum, out=np.zeros_like(spread), where=minimum > 0)
+    
+    # Relative distance from the SKU median; NaN cells never compare True
+    with np.errstate(invalid="ignore", divide="ignore"):
+        outliers = np.abs(values - median[:, None]) * 100 > outlier_pct * median[:, None]
+        if reference_col is not None:
+            reference = values[:, reference_col][:, None]
+            deviation = (values - reference) * 100 / reference
+            deviation[:, reference_col] = np.nan
+            deviates = np.abs(deviation) > deviation_pct
+        else:
+            deviation = np.full(values.shape, np.nan)
+            deviates = np.zeros(values.shape, dtype=bool)
+    
+    return {
+        "rows": rows,
+        "prices": values,
+        "min": minimum,
+        "max": maximum,
+        "median": median,
+        "spread": spread,
+        "spread_pct": spread_pct,
+        "outliers": outliers,
+        "deviation": deviation,
+        "deviates": deviates
+    }
+
+def rounded(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 2)
+
+@api_router.post("/price-comparison")
+async def compare_prices(
+    config: MagentoConfig,
+    source: str = Query("magento", description="magento or mirror (local catalog copy)"),
+    reference_store_id: Optional[int] = Query(None, description="Store view the others are compared with"),
+    basis: str = Query("net", description="net or gross (VAT included)"),
+    outlier_pct: float = Query(COMPARISON_OUTLIER_PCT, description="Distance from the SKU median, percent"),
+    deviation_pct: float = Query(COMPARISON_DEVIATION_PCT, description="Distance from the reference store, percent"),
+    only_issues: bool = Query(False, description="Only SKUs with outliers or deviating stores"),
+    skus: Optional[str] = Query(None, description="Comma-separated SKUs"),
+    page: int = Query(1, description="Page number"),
+    page_size: int = Query(50, description="Items per page")
+):
+    """Compare the prices of every SKU across store views: spread, outliers and deviations from a reference store"""
+    try:
+        stores = [store for store in (await get_store_views(config)).stores if store.get("id", 0) != 0]
+        store_ids = [store["id"] for store in stores]
+        store_codes = [store.get("code", "") for store in stores]
+        if reference_store_id is not None and reference_store_id not in store_ids:
+            raise HTTPException(status_code=400, detail=f"Store di riferimento non trovato: {reference_store_id}")
+        if basis not in ("net", "gross"):
+            raise HTTPException(status_code=400, detail=f"Base di confronto non supportata: {basis}")
+        
+        with timing_phase("matrix"):
+            matrix = await get_price_matrix(config, source, store_ids)
+        
+        started = time.perf_counter()
+        prices = matrix.effective_prices(np.datetime64(datetime.now(timezone.utc).date(), "D"))
+        if basis == "gross":
+            prices = prices * matrix.vat_multipliers(await vat_rate_cache.by_store())
+        if skus:
+            selected = [matrix.sku_index[sku] for sku in (s.strip() for s in skus.split(",")) if sku in matrix.sku_index]
+            row_ids = np.array(selected, dtype=int)
+        else:
+            row_ids = np.arange(len(matrix.skus))
+        reference_col = matrix.store_index.get(reference_store_id)
+        stats = compare_store_prices(prices[row_ids], reference_col, outlier_pct, deviation_pct)
+        
+        has_outliers = stats["outliers"].any(axis=1)
+        has_deviations = stats["deviates"].any(axis=1)
+        # Largest spread first
+        order = np.argsort(-stats["spread_pct"], kind="stable")
+        if only_issues:
+            order = order[(has_outliers | has_deviations)[order]]
+        add_phase("compare", time.perf_counter() - started)
+        
+        items = []
+        for position in order[(page - 1) * page_size:page * page_size]:
+            values = stats["prices"][position]
+            items.append({
+                "sku": matrix.skus[row_ids[stats["rows"][position]]],
+                "prices": {code: rounded(value) for code, value in zip(store_codes, values)},
+                "min": rounded(stats["min"][position]),
+                "max": rounded(stats["max"][position]),
+                "median": rounded(stats["median"][position]),
+                "spread": rounded(stats["spread"][position]),
+                "spread_pct": rounded(stats["spread_pct"][position]),
+                "outliers": [code for code, flag in zip(store_codes, stats["outliers"][position]) if flag],
+                "deviations": [
+                    {"store_id": store_id, "store_code": code, "price": rounded(value), "deviation_pct": rounded(deviation)}
+                    for store_id, code, value, deviation, flag in zip(
+                        store_ids, store_codes, values, stats["deviation"][position], stats["deviates"][position]
+                    )
+                    if flag
+                ]
+            })
+        
+        return {
+            "items": items,
+            "total_count": len(order),
+            "page": page,
+            "page_size": page_size,
+            "summary": {
+                "skus": len(stats["rows"]),
+                "skus_with_outliers": int(has_outliers.sum()),
+                "skus_deviating": int(has_deviations.sum()),
+                "reference_store_id": reference_store_id,
+                "basis": basis
+            }
+        }
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error comparing prices: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Excel Import
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', '500'))
+IMPORT_CONCURRENCY = int(os.environ.get('IMPORT_CONCURRENCY', '4'))
+# Net prices closer than this to the live Magento price are not written again
+IMPORT_PRICE_TOLERANCE = float(os.environ.get('IMPORT_PRICE_TOLERANCE', '0.005'))
+# Magento catalog price scope: "store" keeps every store view apart, "website" and "global"
+# fold store views that share a price into one write
+MAGENTO_PRICE_SCOPE = os.environ.get('MAGENTO_PRICE_SCOPE', 'store')
+
+class PriceWrite(NamedTuple):
+    row: int  # Excel row number the price comes from
+    price: dict
+    duplicates: tuple = ()  # Earlier rows with the same price folded into this write
+
+class ImportResult(NamedTuple):
+    changed: int
+    unchanged: int
+    failed: int
+    conflicts: int
+    errors: List[str]
+
+def format_magento_datetime(value: Optional[str]) -> str:
+    """Batch price APIs expect 'Y-m-d H:i:s' dates, or an empty string"""
+    if not value:
+        return ""
+    return f"{value} 00:00:00" if len(value) == 10 else value
+
+def format_magento_message(message: str, parameters) -> str:
+    """Fill Magento's %name / %1 placeholders"""
+    if isinstance(parameters, dict):
+        for key, value in parameters.items():
+            message = message.replace(f"%{key}", str(value))
+    else:
+        for position, value in enumerate(parameters or [], start=1):
+            message = message.replace(f"%{position}", str(value))
+    return message
+
+async def send_price_writes(
+    config: MagentoConfig,
+    base_prices: List[PriceWrite],
+    special_prices: List[PriceWrite]
+) -> tuple:
+    """Write prices through the batch endpoints; return (errors by row, errors not tied to a row)"""
+    semaphore = asyncio.Semaphore(IMPORT_CONCURRENCY)
+    row_errors: Dict[int, List[str]] = {}
+    batch_errors: List[str] = []
+
+    async def send_chunk(endpoint: str, chunk: List[PriceWrite]):
+        async with semaphore:
+            try:
+                failures = await magento_request(
+                    config, "POST", endpoint, data={"prices": [w.price for w in chunk]}, idempotent=True
+                )
+            except HTTPException as e:
+                for write in chunk:
+                    for row in (write.row, *write.duplicates):
+                        row_errors.setdefault(row, []).append(str(e.detail))
+                return
+
+        # Magento saves the valid items and returns one result per rejected item
+        for failure in failures or []:
+            parameters = failure.get("parameters") or []
+            values = [str(v) for v in (parameters.values() if isinstance(parameters, dict) else parameters)]
+            message = format_magento_message(failure.get("message", ""), parameters)
+            matched = [w for w in chunk if w.price["sku"] in values]
+            scoped = [w for w in matched if str(w.price["store_id"]) in values]
+            if not matched:
+                batch_errors.append(f"Errore Magento: {message}")
+            for write in scoped or matched:
+                for row in (write.row, *write.duplicates):
+                    row_errors.setdefault(row, []).append(message)
+
+    tasks = []
+    for endpoint, writes in (("/products/base-prices", base_prices), ("/products/special-price", special_prices)):
+        for i in range(0, len(writes), IMPORT_CHUNK_SIZE):
+            tasks.append(send_chunk(endpoint, writes[i:i + IMPORT_CHUNK_SIZE]))
+    await asyncio.gather(*tasks)
+    if tasks:
+        prices_written(config, [write.price["sku"] for write in base_prices + special_prices])
+    return row_errors, batch_errors
+
+def price_scope_targets(stores: List[dict]) -> Dict[int, tuple]:
+    """Magento scope each store view's price is saved in, per MAGENTO_PRICE_SCOPE"""
+    if MAGENTO_PRICE_SCOPE == "global":
+        return {s.get("id"): ("global",) for s in stores}
+    if MAGENTO_PRICE_SCOPE == "website":
+        return {s.get("id"): ("website", s.get("website_id")) for s in stores}
+    return {s.get("id"): ("store", s.get("id")) for s in stores}
+
+def plan_price_writes(writes: List[PriceWrite], price_targets: Dict[int, tuple]) -> tuple:
+    """Keep one write per SKU and price scope, the last row wins; return (writes, conflict messages)"""
+    planned: Dict[tuple, PriceWrite] = {}
+    conflicts = []
+    for write in writes:
+        store_id = write.price["store_id"]
+        key = (write.price["sku"], price_targets.get(store_id, ("store", store_id)))
+        previous = planned.get(key)
+        if previous is None:
+            planned[key] = write
+            continue
+        same_value = all(
+            previous.price.get(field) == write.price.get(field) for field in ("price", "price_from", "price_to")
+        )
+        if same_value:
+            planned[key] = write._replace(duplicates=(*previous.duplicates, previous.row))
+            continue
+        for row in (previous.row, *previous.duplicates):
+            conflicts.append((row, f"Riga {row}: prezzo sostituito dalla riga {write.row} (SKU {write.price['sku']}, store {store_id})"))
+        planned[key] = write
+    return list(planned.values()), conflicts
+
+def price_changed(current, incoming: float) -> bool:
+    return current is None or abs(float(current) - incoming) > IMPORT_PRICE_TOLERANCE
+
+def special_price_changed(current: dict, incoming: dict) -> bool:
+    """Special price differs in amount or in its validity dates"""
+    if price_changed(current["special_price"], incoming["price"]):
+        return True
+    return (
+        (current["special_price_from"] or "")[:19] != incoming["price_from"]
+        or (current["special_price_to"] or "")[:19] != incoming["price_to"]
+    )
+
+async def drop_unchanged_writes(
+    config: MagentoConfig,
+    base_prices: List[PriceWrite],
+    special_prices: List[PriceWrite]
+) -> tuple:
+    """Compare queued writes with the live store-scoped prices; return (changed base writes, changed special writes)"""
+    skus = sorted({write.price["sku"] for write in base_prices + special_prices})
+    if not skus:
+        return base_prices, special_prices
+    live_prices = await fetch_store_prices(config, skus)
+    
+    def live(write: PriceWrite) -> dict:
+        # Effective price of the target store, inherited from the default scope when not overridden
+        return resolve_store_price(live_prices.get(write.price["sku"], {}), write.price["store_id"], {})
+    
+    changed_base = [w for w in base_prices if price_changed(live(w)["base_price"], w.price["price"])]
+    changed_special = [w for w in special_prices if special_price_changed(live(w), w.price)]
+    return changed_base, changed_special
+
+# Column-wise Excel helpers: rows are only visited once, when results are emitted
+def text_column(df: pd.DataFrame, col: str) -> pd.Series:
+    """Stripped strings, empty where the cell is missing"""
+    if col not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    values = df[col]
+    return values.where(values.notna(), "").astype(str).str.strip()
+
+def number_column(df: pd.DataFrame, col: str) -> tuple:
+    """(float values, mask of cells that are present but not numbers)"""
+    if col not in df.columns:
+        return pd.Series(float("nan"), index=df.index), pd.Series(False, index=df.index)
+    values = pd.to_numeric(df[col], errors="coerce")
+    return values, df[col].notna() & values.isna()
+
+def date_column(df: pd.DataFrame, col: str) -> pd.Series:
+    """Excel dates as YYYY-MM-DD, other values cut to their first 10 characters, None when missing"""
+    if col not in df.columns:
+        return pd.Series([None] * len(df), index=df.index, dtype=object)
+    values = df[col]
+    if pd.api.types.is_datetime64_any_dtype(values):
+        formatted = values.dt.strftime("%Y-%m-%d")
+    else:
+        is_date = values.map(type).isin([datetime, pd.Timestamp])
+        formatted = values.astype(str).str[:10]
+        if is_date.any():
+            formatted[is_date] = pd.to_datetime(values[is_date]).dt.strftime("%Y-%m-%d")
+    return formatted.where(values.notna(), None).astype(object)
+
+def row_messages(row_numbers: pd.Series, mask: pd.Series, message) -> List[tuple]:
+    """(row number, 'Riga N: message') pairs for the rows selected by mask"""
+    rows = row_numbers[mask]
+    if isinstance(message, pd.Series):
+        texts = "Riga " + rows.astype(str) + ": " + message[mask]
+    else:
+        texts = "Riga " + rows.astype(str) + f": {message}"
+    return list(zip(rows.tolist(), texts.tolist()))
+
+def prepare_import_rows(df: pd.DataFrame, store_code_to_id: Dict[str, int], vat_rates_by_store: Dict[int, float]) -> tuple:
+    """Validate Excel rows and turn them into net-price writes; return (rows, base writes, special writes, errors)"""
+    row_numbers = pd.Series(df.index + 2, index=df.index)
+    sku = text_column(df, "SKU")
+    store_code = text_column(df, "Store")
+    store_id = store_code.map(store_code_to_id)
+    
+    # Net prices (IVA esclusa) from the VAT rate of each row's store
+    vat_rate = store_id.map(vat_rates_by_store).fillna(0).astype(float)
+    vat_divisor = 1 + vat_rate.where(vat_rate > 0, 0) / 100
+    base_price_incl, base_invalid = number_column(df, "Prezzo Base (IVA incl.)")
+    special_price_incl, special_invalid = number_column(df, "Prezzo Scontato (IVA incl.)")
+    base_price = (base_price_incl / vat_divisor).round(2)
+    special_price = (special_price_incl / vat_divisor).round(2)
+    special_from = date_column(df, "Data Inizio Sconto")
+    special_to = date_column(df, "Data Fine Sconto")
+    
+    # Validation masks, first failing check wins
+    missing = (sku == "") | (store_code == "")
+    unknown_store = ~missing & store_id.isna()
+    invalid_price = ~missing & ~unknown_store & (base_invalid | special_invalid)
+    no_price = ~missing & ~unknown_store & ~invalid_price & base_price.isna() & special_price.isna()
+    valid = ~(missing | unknown_store | invalid_price | no_price)
+    
+    invalid_value = df["Prezzo Base (IVA incl.)"].astype(str).where(base_invalid, "") if base_invalid.any() else ""
+    if special_invalid.any():
+        invalid_value = df["Prezzo Scontato (IVA incl.)"].astype(str).where(~base_invalid & special_invalid, invalid_value)
+    error_pairs = (
+        row_messages(row_numbers, missing, "SKU o Store mancante")
+        + row_messages(row_numbers, unknown_store, "Store '" + store_code + "' non trovato")
+        + row_messages(row_numbers, invalid_price, "Prezzo non valido '" + pd.Series(invalid_value, index=df.index).astype(str) + "'")
+        + row_messages(row_numbers, no_price, "Nessun prezzo da aggiornare")
+    )
+    errors = [text for _, text in sorted(error_pairs, key=lambda pair: pair[0])]
+    
+    # Emit the queued writes for the batch price endpoints
+    imported_rows = row_numbers[valid].tolist()
+    base_prices: List[PriceWrite] = []
+    special_prices: List[PriceWrite] = []
+    has_base = valid & base_price.notna()
+    for row_number, row_sku, row_store_id, price in zip(
+        row_numbers[has_base].tolist(), sku[has_base].tolist(), store_id[has_base].tolist(), base_price[has_base].tolist()
+    ):
+        base_prices.append(PriceWrite(row=row_number, price={
+            "sku": row_sku,
+            "price": price,
+            "store_id": int(row_store_id)
+        }))
+    has_special = valid & special_price.notna()
+    for row_number, row_sku, row_store_id, price, price_from, price_to in zip(
+        row_numbers[has_special].tolist(), sku[has_special].tolist(), store_id[has_special].tolist(),
+        special_price[has_special].tolist(), special_from[has_special].tolist(), special_to[has_special].tolist()
+    ):
+        special_prices.append(PriceWrite(row=row_number, price={
+            "sku": row_sku,
+            "price": price,
+            "store_id": int(row_store_id),
+            "price_from": format_magento_datetime(price_from),
+            "price_to": format_magento_datetime(price_to)
+        }))
+    
+    return imported_rows, base_prices, special_prices, errors
+
+def write_rows(writes: List[PriceWrite]) -> set:
+    return {row for write in writes for row in (write.row, *write.duplicates)}
+
+async def import_price_rows(
+    config: MagentoConfig,
+    df: pd.DataFrame,
+    store_code_to_id: Dict[str, int],
+    vat_rates_by_store: Dict[int, float],
+    price_targets: Dict[int, tuple]
+) -> ImportResult:
+    """Import a block of Excel rows with the fewest Magento writes that reach the same final prices"""
+    with timing_phase("prepare"):
+        imported_rows, base_prices, special_prices, errors = prepare_import_rows(df, store_code_to_id, vat_rates_by_store)
+        
+        # One write per SKU and price scope; rows overridden by a later different price are reported
+        base_prices, base_conflicts = plan_price_writes(base_prices, price_targets)
+        special_prices, special_conflicts = plan_price_writes(special_prices, price_targets)
+        planned_rows = write_rows(base_prices + special_prices)
+    
+    # Only prices that differ from Magento are sent, each write triggers a save and reindex
+    with timing_phase("diff"):
+        base_prices, special_prices = await drop_unchanged_writes(config, base_prices, special_prices)
+    written_rows = write_rows(base_prices + special_prices)
+    
+    # Send queued prices in concurrent chunks and map failures back to rows
+    with timing_phase("write"):
+        row_errors, batch_errors = await send_price_writes(config, base_prices, special_prices)
+    errors.extend(text for _, text in sorted(base_conflicts + special_conflicts))
+    for row_number in sorted(row_errors):
+        for message in row_errors[row_number]:
+            errors.append(f"Riga {row_number}: {message[:100]}")
+    errors.extend(batch_errors)
+    return ImportResult(
+        changed=sum(1 for row in imported_rows if row in written_rows and row not in row_errors),
+        unchanged=sum(1 for row in imported_rows if row in planned_rows and row not in written_rows),
+        failed=len(df) - len(imported_rows) + len(row_errors),
+        conflicts=sum(1 for row in imported_rows if row not in planned_rows),
+        errors=errors
+    )
+
+async def load_import_context(config: MagentoConfig) -> tuple:
+    """Store code to id map, VAT rates by store id and the price scope of each store"""
+    vat_rates_by_store = await vat_rate_cache.by_store()
+    
+    registry = await get_store_views(config)
+    store_code_to_id = {code: store.get("id") for code, store in registry.by_code.items()}
+    return store_code_to_id, vat_rates_by_store, price_scope_targets(registry.stores)
+
+def validate_import_columns(df: pd.DataFrame):
+    required_cols = ["SKU", "Store"]
+    for col in required_cols:
+        if col not in df.columns:
+            raise HTTPException(status_code=400, detail=f"Colonna mancante: {col}")
+
+# Streaming spreadsheet reader (bounded chunks straight from disk)
+UPLOAD_CHUNK_ROWS = int(os.environ.get('UPLOAD_CHUNK_ROWS', '5000'))
+UPLOAD_COPY_BUFFER = 1024 * 1024
+# Text columns keep their literal value, so numeric-looking SKUs do not turn into floats
+UPLOAD_TEXT_COLUMNS = {"SKU": str, "Store": str, "Nome Prodotto": str, "Store Nome": str}
+
+def upload_kind(filename: Optional[str]) -> str:
+    """Spreadsheet format from the file name; uploads without an extension are read as xlsx"""
+    suffix = Path(filename or "").suffix.lower()
+    if suffix == ".csv":
+        return "csv"
+    if suffix == ".parquet":
+        return "parquet"
+    if suffix in ("", ".xlsx", ".xlsm"):
+        return "xlsx"
+    raise HTTPException(status_code=400, detail=f"Formato file non supportato: {suffix}")
+
+async def spool_upload(file: UploadFile, path: Path):
+    """Copy an upload to disk in fixed-size blocks without reading it into memory"""
+    await file.seek(0)
+    with open(path, "wb") as f:
+        await asyncio.to_thread(shutil.copyfileobj, file.file, f, UPLOAD_COPY_BUFFER)
+
+def read_xlsx_chunks(source, chunk_rows: int):
+    """Row chunks of the first sheet read with openpyxl in read-only mode"""
+    import openpyxl
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c).strip() if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+        validate_import_columns(pd.DataFrame(columns=columns))
+        
+        # The index is the sheet row minus 2, so "Riga {idx + 2}" points at the real row
+        block, index = [], []
+        for position, values in enumerate(rows):
+            if all(v is None for v in values):
+                continue
+            block.append(values[:len(columns)])
+            index.append(position)
+            if len(block) >= chunk_rows:
+                yield pd.DataFrame.from_records(block, columns=columns, index=index)
+                block, index = [], []
+        if block:
+            yield pd.DataFrame.from_records(block, columns=columns, index=index)
+    finally:
+        workbook.close()
+
+def sniff_csv_format(source) -> dict:
+    """Delimiter and decimal mark of a CSV; Italian Excel exports use ';' and ','"""
+    sample = source.read(64 * 1024)
+    source.seek(0)
+    if isinstance(sample, bytes):
+        sample = sample.decode("utf-8-sig", errors="ignore")
+    first_line = sample.splitlines()[0] if sample else ""
+    sep = max([",", ";", "\t"], key=first_line.count)
+    return {"sep": sep, "decimal": "," if sep == ";" else "."}
+
+def read_csv_chunks(source, chunk_rows: int):
+    """Row chunks of a CSV file; the running index matches the file row numbers"""
+    if isinstance(source, (str, Path)):
+        # Import jobs pass the path of the stored upload
+        with open(source, "rb") as file:
+            yield from read_csv_chunks(file, chunk_rows)
+        return
+    reader = pd.read_csv(
+        source,
+        chunksize=chunk_rows,
+        dtype=UPLOAD_TEXT_COLUMNS,
+        encoding="utf-8-sig",
+        # Blank lines are read as empty rows and dropped below, so they still count in the row numbers
+        skip_blank_lines=False,
+        **sniff_csv_format(source)
+    )
+    with reader:
+        first = True
+        for chunk in reader:
+            if first:
+                validate_import_columns(chunk)
+                first = False
+            chunk = chunk[chunk.notna().any(axis=1)]
+            if len(chunk):
+                yield chunk
+
+def read_parquet_chunks(source, chunk_rows: int):
+    """Row chunks of a Parquet file, one record batch at a time"""
+    _, pq = load_pyarrow()
+    parquet_file = pq.ParquetFile(source)
+    validate_import_columns(pd.DataFrame(columns=parquet_file.schema_arrow.names))
+    position = 0
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows):
+        chunk = batch.to_pandas()
+        chunk.index = pd.RangeIndex(position, position + len(chunk))
+        position += len(chunk)
+        yield chunk
+
+async def iter_price_chunks(source, kind: str, chunk_rows: Optional[int] = None) -> AsyncIterator[pd.DataFrame]:
+    """Yield DataFrame chunks of an uploaded spreadsheet, parsing each block off the event loop"""
+    chunk_rows = chunk_rows or UPLOAD_CHUNK_ROWS
+    if hasattr(source, "seek"):
+        source.seek(0)
+    readers = {"csv": read_csv_chunks, "parquet": read_parquet_chunks, "xlsx": read_xlsx_chunks}
+    reader = readers[kind](source, chunk_rows)
+    try:
+        while True:
+            with timing_phase("read"):
+                chunk = await asyncio.to_thread(next, reader, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        reader.close()
+
 @api_router.post("/import-prices")
 async def import_prices(
     file: UploadFile = File(...),
@@ -589,26 +2619,11 @@ async def import_prices(
     access_token: str = Query(...),
     access_token_secret: str = Query(...)
 ):
-    """Import prices from Excel file"""
+    """Import prices from an Excel or CSV file, chunk by chunk"""
     try:
-        # Read Excel file
-        contents = await file.read()
-        df = pd.read_excel(BytesIO(contents))
-        
-        # Validate required columns
-        required_cols = ["SKU", "Store"]
-        for col in required_cols:
-            if col not in df.columns:
-                raise HTTPException(status_code=400, detail=f"Colonna mancante: {col}")
-        
-        # Get VAT rates
-        vat_rates_cursor = db.vat_rates.find({}, {"_id": 0})
-        vat_rates_list = await vat_rates_cursor.to_list(100)
-        vat_rates_by_store = {}
-        for rate in vat_rates_list:
-            vat_rates_by_store[rate.get("store_id")] = rate.get("vat_rate", 0)
+        kind = upload_kind(file.filename)
         
-        # Get store views to map codes to IDs
+        # Get VAT rates and store views to map codes to IDs
         config = MagentoConfig(
             magento_url=magento_url,
             consumer_key=consumer_key,
@@ -616,107 +2631,29 @@ async def import_prices(
             access_token=access_token,
             access_token_secret=access_token_secret
         )
-        stores = await magento_request(config, "GET", "/store/storeViews")
-        store_code_to_id = {s.get("code"): s.get("id") for s in stores}
+        import_context = await load_import_context(config)
         
-        # Process each row
-        results = {"success": 0, "errors": []}
-        
-        for idx, row in df.iterrows():
-            try:
-                sku = str(row.get("SKU", "")).strip()
-                store_code = str(row.get("Store", "")).strip()
-                
-                if not sku or not store_code:
-                    results["errors"].append(f"Riga {idx + 2}: SKU o Store mancante")
-                    continue
-                
-                store_id = store_code_to_id.get(store_code)
-                if store_id is None:
-                    results["errors"].append(f"Riga {idx + 2}: Store '{store_code}' non trovato")
-                    continue
-                
-                # Get VAT rate for this store
-                vat_rate = vat_rates_by_store.get(store_id, 0)
-                vat_divisor = 1 + (vat_rate / 100) if vat_rate > 0 else 1
-                
-                # Get prices (IVA inclusa from Excel) and convert to IVA esclusa
-                base_price_incl = row.get("Prezzo Base (IVA incl.)")
-                special_price_incl = row.get("Prezzo Scontato (IVA incl.)")
-                special_from = row.get("Data Inizio Sconto")
-                special_to = row.get("Data Fine Sconto")
-                
-                # Convert to net prices (IVA esclusa)
-                base_price = None
-                if pd.notna(base_price_incl):
-                    base_price = round(float(base_price_incl) / vat_divisor, 2)
-                
-                special_price = None
-                if pd.notna(special_price_incl):
-                    special_price = round(float(special_price_incl) / vat_divisor, 2)
-                
-                # Format dates
-                special_from_str = None
-                special_to_str = None
-                if pd.notna(special_from):
-                    if isinstance(special_from, datetime):
-                        special_from_str = special_from.strftime("%Y-%m-%d")
-                    else:
-                        special_from_str = str(special_from)[:10]
-                
-                if pd.notna(special_to):
-                    if isinstance(special_to, datetime):
-                        special_to_str = special_to.strftime("%Y-%m-%d")
-                    else:
-                        special_to_str = str(special_to)[:10]
-                
-                # Build update payload
-                if base_price is not None or special_price is not None:
-                    product_data = {"product": {"sku": sku}}
-                    
-                    if base_price is not None:
-                        product_data["product"]["price"] = base_price
-                    
-                    custom_attrs = []
-                    if special_price is not None:
-                        custom_attrs.append({"attribute_code": "special_price", "value": str(special_price)})
-                    if special_from_str:
-                        custom_attrs.append({"attribute_code": "special_from_date", "value": special_from_str})
-                    if special_to_str:
-                        custom_attrs.append({"attribute_code": "special_to_date", "value": special_to_str})
-                    
-                    if custom_attrs:
-                        product_data["product"]["custom_attributes"] = custom_attrs
-                    
-                    # Make update request
-                    oauth = OAuth1(
-                        consumer_key,
-                        client_secret=consumer_secret,
-                        resource_owner_key=access_token,
-                        resource_owner_secret=access_token_secret,
-                        signature_method='HMAC-SHA256'
-                    )
-                    
-                    url = f"{magento_url.rstrip('/')}/rest/{store_code}/V1/products/{sku}"
-                    headers = {"Content-Type": "application/json"}
-                    
-                    response = requests.put(url, auth=oauth, headers=headers, json=product_data, timeout=30)
-                    
-                    if response.status_code >= 400:
-                        results["errors"].append(f"Riga {idx + 2}: Errore Magento - {response.text[:100]}")
-                    else:
-                        results["success"] += 1
-                else:
-                    results["errors"].append(f"Riga {idx + 2}: Nessun prezzo da aggiornare")
-                    
-            except Exception as e:
-                results["errors"].append(f"Riga {idx + 2}: {str(e)}")
+        # Each chunk is validated and written before the next one is read
+        updated_count, unchanged_count, failed_count, conflict_count, errors = 0, 0, 0, 0, []
+        started, rows = time.perf_counter(), 0
+        async for chunk in iter_price_chunks(file.file, kind):
+            rows += len(chunk)
+            result = await import_price_rows(config, chunk, *import_context)
+            updated_count += result.changed
+            unchanged_count += result.unchanged
+            failed_count += result.failed
+            conflict_count += result.conflicts
+            errors.extend(result.errors)
+        record_row_throughput("import", rows, time.perf_counter() - started)
         
         return {
             "success": True,
-            "message": f"Importazione completata: {results['success']} prodotti aggiornati",
-            "updated_count": results["success"],
-            "errors": results["errors"][:20]  # Limit errors shown
+            "message": f"Importazione completata: {updated_count} prodotti aggiornati, {unchanged_count} invariati",
+            "updated_count": updated_count,
+            "unchanged_count": unchanged_count,
+            "failed_count": failed_count,
+            "conflict_count": conflict_count,
+            "errors": errors[:20]  # Limit errors shown
         }
     except HTTPException as e:
         raise e
@@ -724,23 +2661,251 @@ async def import_prices(
         logger.error(f"Error importing prices: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Background import jobs (progress persisted in MongoDB)
+IMPORT_JOBS_DIR = Path(os.environ.get('IMPORT_JOBS_DIR', ROOT_DIR / 'import_jobs'))
+IMPORT_JOB_CHUNK_ROWS = int(os.environ.get('IMPORT_JOB_CHUNK_ROWS', '1000'))
+IMPORT_JOB_WORKERS = int(os.environ.get('IMPORT_JOB_WORKERS', '2'))
+IMPORT_JOB_POLL_INTERVAL = float(os.environ.get('IMPORT_JOB_POLL_INTERVAL', '1'))
+# A running job belongs to one worker while its lease is renewed; expired leases can be claimed by any worker
+IMPORT_JOB_LEASE = float(os.environ.get('IMPORT_JOB_LEASE', '60'))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+import_job_semaphore = asyncio.Semaphore(IMPORT_JOB_WORKERS)
+# Keep references to running jobs so the tasks are not garbage collected
+import_job_tasks: Dict[str, asyncio.Task] = {}
+import_job_sweep_task: Optional[asyncio.Task] = None
+
+class ImportJobLeaseLost(Exception):
+    """Another worker took the job over after this worker's lease expired"""
+
+def lease_deadline() -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=IMPORT_JOB_LEASE)).isoformat()
+
+def claimable_jobs_query() -> dict:
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "status": {"$in": ["queued", "running"]},
+        "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]
+    }
+
+async def claim_import_job(job_id: str) -> Optional[dict]:
+    """Take the job atomically; None when it is finished or leased by a live worker"""
+    return await db.import_jobs.find_one_and_update(
+        {"_id": job_id, **claimable_jobs_query()},
+        {"$set": {
+            "status": "running",
+            "owner": WORKER_ID,
+            "lease_until": lease_deadline(),
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def update_owned_job(job_id: str, update: dict):
+    """Apply an update and renew the lease, only while this worker still owns the job"""
+    update = {**update, "$set": {**update.get("$set", {}), "lease_until": lease_deadline()}}
+    if await db.import_jobs.find_one_and_update({"_id": job_id, "owner": WORKER_ID}, update, {"_id": 1}) is None:
+        raise ImportJobLeaseLost()
+
+async def renew_import_job_lease(job_id: str):
+    """Heartbeat for chunks slower than the lease"""
+    while True:
+        await asyncio.sleep(IMPORT_JOB_LEASE / 3)
+        try:
+            await update_owned_job(job_id, {})
+        except ImportJobLeaseLost:
+            return
+        except Exception as e:
+            logger.error(f"Error renewing lease of import job {job_id}: {e}")
+
+def start_import_job(job_id: str):
+    if job_id not in import_job_tasks:
+        task = asyncio.create_task(run_import_job(job_id))
+        import_job_tasks[job_id] = task
+        task.add_done_callback(lambda _: import_job_tasks.pop(job_id, None))
+
+async def run_import_job(job_id: str):
+    """Process a stored upload chunk by chunk, committing progress after every chunk"""
+    async with import_job_semaphore:
+        job = await claim_import_job(job_id)
+        if not job:
+            return
+        heartbeat = asyncio.create_task(renew_import_job_lease(job_id))
+        try:
+            config = MagentoConfig(**job["config"])
+            import_context = await load_import_context(config)
+            
+            committed_chunks = job.get("committed_chunks", 0)
+            chunk_idx = -1
+            chunks = iter_price_chunks(job["file_path"], upload_kind(job["file_path"]), job.get("chunk_rows", IMPORT_JOB_CHUNK_ROWS))
+            async for chunk in chunks:
+                chunk_idx += 1
+                # Resume after the last committed chunk
+                if chunk_idx < committed_chunks:
+                    continue
+                chunk_started = time.perf_counter()
+                result = await import_price_rows(config, chunk, *import_context)
+                record_row_throughput("import_job", len(chunk), time.perf_counter() - chunk_started)
+                await update_owned_job(job_id, {
+                    "$set": {
+                        "committed_chunks": chunk_idx + 1,
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    },
+                    "$inc": {
+                        "processed_rows": len(chunk),
+                        "updated_count": result.changed,
+                        "unchanged_count": result.unchanged,
+                        "failed_count": result.failed,
+                        "conflict_count": result.conflicts,
+                        "error_count": len(result.errors)
+                    },
+                    "$push": {"errors": {"$each": result.errors}}
+                })
+            
+            # Credentials are only kept while the job can still run
+            await update_owned_job(job_id, {
+                "$set": {
+                    "status": "completed",
+                    "finished_at": datetime.now(timezone.utc).isoformat(),
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                },
+                "$unset": {"config": ""}
+            })
+            Path(job["file_path"]).unlink(missing_ok=True)
+        except ImportJobLeaseLost:
+            logger.warning(f"Import job {job_id} was taken over by another worker")
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.error(f"Import job {job_id} failed: {detail}")
+            try:
+                await update_owned_job(job_id, {
+                    "$set": {
+                        "status": "failed",
+                        "failure": detail,
+                        "finished_at": datetime.now(timezone.utc).isoformat(),
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    },
+                    "$unset": {"config": ""}
+                })
+                Path(job["file_path"]).unlink(missing_ok=True)
+            except ImportJobLeaseLost:
+                logger.warning(f"Import job {job_id} was taken over by another worker")
+        finally:
+            heartbeat.cancel()
+
+@api_router.post("/import-jobs")
+async def create_import_job(
+    file: UploadFile = File(...),
+    magento_url: str = Query(...),
+    consumer_key: str = Query(...),
+    consumer_secret: str = Query(...),
+    access_token: str = Query(...),
+    access_token_secret: str = Query(...)
+):
+    """Store the Excel or CSV file and import it in the background"""
+    try:
+        kind = upload_kind(file.filename)
+        job_id = str(uuid.uuid4())
+        IMPORT_JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        file_path = IMPORT_JOBS_DIR / f"{job_id}.{kind}"
+        await spool_upload(file, file_path)
+        
+        now = datetime.now(timezone.utc).isoformat()
+        await db.import_jobs.insert_one({
+            "_id": job_id,
+            "status": "queued",
+            "filename": file.filename,
+            "file_path": str(file_path),
+            "config": {
+                "magento_url": magento_url,
+                "consumer_key": consumer_key,
+                "consumer_secret": consumer_secret,
+                "access_token": access_token,
+                "access_token_secret": access_token_secret
+            },
+            "chunk_rows": IMPORT_JOB_CHUNK_ROWS,
+            "owner": None,
+            "lease_until": None,
+            "committed_chunks": 0,
+            "processed_rows": 0,
+            "updated_count": 0,
+            "unchanged_count": 0,
+            "failed_count": 0,
+            "conflict_count": 0,
+            "error_count": 0,
+            "errors": [],
+            "created_at": now,
+            "updated_at": now
+        })
+        start_import_job(job_id)
+        return {"success": True, "job_id": job_id, "status": "queued"}
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error creating import job: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Credentials and local paths never leave the backend
+IMPORT_JOB_PROJECTION = {"config": 0, "file_path": 0, "owner": 0, "lease_until": 0}
+
+@api_router.get("/import-jobs/{job_id}")
+async def get_import_job(job_id: str):
+    """Import job status, counters and full error list"""
+    job = await db.import_jobs.find_one({"_id": job_id}, IMPORT_JOB_PROJECTION)
+    if not job:
+        raise HTTPException(status_code=404, detail="Importazione non trovata")
+    job["job_id"] = job.pop("_id")
+    return job
+
+@api_router.get("/import-jobs/{job_id}/events")
+async def import_job_events(job_id: str):
+    """Server-Sent Events stream of job progress until the job finishes"""
+    if not await db.import_jobs.find_one({"_id": job_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Importazione non trovata")
+    
+    async def events():
+        last_update = None
+        while True:
+            job = await db.import_jobs.find_one({"_id": job_id}, {**IMPORT_JOB_PROJECTION, "errors": 0})
+            if job is None:
+                return
+            if job.get("updated_at") != last_update:
+                last_update = job.get("updated_at")
+                job["job_id"] = job.pop("_id")
+                yield f"data: {json.dumps(job)}\n\n"
+            if job.get("status") in ("completed", "failed"):
+                return
+            await asyncio.sleep(IMPORT_JOB_POLL_INTERVAL)
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+async def resume_import_jobs():
+    """Pick up jobs whose worker stopped renewing the lease, from their last committed chunk"""
+    try:
+        jobs = await db.import_jobs.find(claimable_jobs_query(), {"_id": 1}).to_list(None)
+        for job in jobs:
+            start_import_job(job["_id"])
+    except Exception as e:
+        logger.error(f"Error resuming import jobs: {e}")
+
+async def sweep_import_jobs():
+    """Resume at startup, then every lease period for workers that died since"""
+    while True:
+        await resume_import_jobs()
+        await asyncio.sleep(IMPORT_JOB_LEASE)
+
+@app.on_event("startup")
+async def start_import_job_sweep():
+    global import_job_sweep_task
+    import_job_sweep_task = asyncio.create_task(sweep_import_jobs())
+
 # Download template Excel
 @api_router.get("/download-template")
 async def download_template():
     """Download empty Excel template for price import"""
     try:
         # Create template DataFrame
-        df = pd.DataFrame(columns=[
-            "SKU",
-            "Nome Prodotto",
-            "Store",
-            "Store Nome",
-            "Aliquota IVA %",
-            "Prezzo Base (IVA incl.)",
-            "Prezzo Scontato (IVA incl.)",
-            "Data Inizio Sconto",
-            "Data Fine Sconto"
-        ])
+        df = pd.DataFrame(columns=EXPORT_COLUMNS)
         
         # Add example row
         df.loc[0] = [
@@ -774,60 +2939,42 @@ async def download_template():
         raise HTTPException(status_code=500, detail=str(e))
 
 # Parse Excel file for C# API integration
+def parse_price_rows(df: pd.DataFrame) -> List[dict]:
+    """Structured price rows for the C# API; rows without SKU or Store are skipped"""
+    sku = text_column(df, "SKU")
+    store_code = text_column(df, "Store")
+    vat_rate, vat_invalid = number_column(df, "Aliquota IVA %")
+    base_price, base_invalid = number_column(df, "Prezzo Base (IVA incl.)")
+    special_price, special_invalid = number_column(df, "Prezzo Scontato (IVA incl.)")
+    
+    invalid = vat_invalid | base_invalid | special_invalid
+    for idx in df.index[invalid]:
+        logger.error(f"Error parsing row {idx}: valore numerico non valido")
+    keep = (sku != "") & (store_code != "") & ~invalid
+    
+    parsed = pd.DataFrame({
+        "sku": sku,
+        "product_name": text_column(df, "Nome Prodotto"),
+        "store_code": store_code,
+        "store_name": text_column(df, "Store Nome"),
+        "vat_rate": vat_rate.fillna(0),
+        "base_price_incl_vat": base_price.astype(object).where(base_price.notna(), None),
+        "special_price_incl_vat": special_price.astype(object).where(special_price.notna(), None),
+        "special_price_from": date_column(df, "Data Inizio Sconto"),
+        "special_price_to": date_column(df, "Data Fine Sconto")
+    })[keep]
+    return parsed.to_dict("records")
+
 @api_router.post("/parse-excel")
 async def parse_excel(file: UploadFile = File(...)):
-    """Parse Excel file and return structured data for C# API"""
+    """Parse Excel or CSV file and return structured data for C# API"""
     try:
-        contents = await file.read()
-        df = pd.read_excel(BytesIO(contents))
-        
-        # Validate required columns
-        required_cols = ["SKU", "Store"]
-        for col in required_cols:
-            if col not in df.columns:
-                raise HTTPException(status_code=400, detail=f"Colonna mancante: {col}")
-        
         items = []
-        for idx, row in df.iterrows():
-            try:
-                sku = str(row.get("SKU", "")).strip()
-                store_code = str(row.get("Store", "")).strip()
-                
-                if not sku or not store_code:
-                    continue
-                
-                item = {
-                    "sku": sku,
-                    "product_name": str(row.get("Nome Prodotto", "")).strip() if pd.notna(row.get("Nome Prodotto")) else "",
-                    "store_code": store_code,
-                    "store_name": str(row.get("Store Nome", "")).strip() if pd.notna(row.get("Store Nome")) else "",
-                    "vat_rate": float(row.get("Aliquota IVA %", 0)) if pd.notna(row.get("Aliquota IVA %")) else 0,
-                    "base_price_incl_vat": float(row.get("Prezzo Base (IVA incl.)")) if pd.notna(row.get("Prezzo Base (IVA incl.)")) else None,
-                    "special_price_incl_vat": float(row.get("Prezzo Scontato (IVA incl.)")) if pd.notna(row.get("Prezzo Scontato (IVA incl.)")) else None,
-                    "special_price_from": None,
-                    "special_price_to": None
-                }
-                
-                # Handle dates
-                special_from = row.get("Data Inizio Sconto")
-                special_to = row.get("Data Fine Sconto")
-                
-                if pd.notna(special_from):
-                    if isinstance(special_from, datetime):
-                        item["special_price_from"] = special_from.strftime("%Y-%m-%d")
-                    else:
-                        item["special_price_from"] = str(special_from)[:10]
-                
-                if pd.notna(special_to):
-                    if isinstance(special_to, datetime):
-                        item["special_price_to"] = special_to.strftime("%Y-%m-%d")
-                    else:
-                        item["special_price_to"] = str(special_to)[:10]
-                
-                items.append(item)
-            except Exception as e:
-                logger.error(f"Error parsing row {idx}: {e}")
-                continue
+        started, rows = time.perf_counter(), 0
+        async for chunk in iter_price_chunks(file.file, upload_kind(file.filename)):
+            rows += len(chunk)
+            items.extend(parse_price_rows(chunk))
+        record_row_throughput("parse", rows, time.perf_counter() - started)
         
         return {
             "success": True,
@@ -843,14 +2990,114 @@ async def parse_excel(file: UploadFile = File(...)):
 # Include the router
 app.include_router(api_router)
 
+class MetricsMiddleware:
+    """Latency of /api requests per route template, measured until the last body chunk is sent"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api"):
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the shared scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(scope["method"], route, status["code"], value=time.perf_counter() - started)
+
+app.add_middleware(MetricsMiddleware)
+
+# Opt-in profiling: a sampled share of requests, or requests sending "X-Profile: 1" when allowed
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', ROOT_DIR / 'profiles'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', '1000'))
+PROFILE_ALLOW_HEADER = os.environ.get('PROFILE_ALLOW_HEADER', 'false').lower() == 'true'
+
+# cProfile hooks the whole event loop thread, so only one request is profiled at a time
+profiler_busy = False
+
+def profile_file_name(scope, elapsed_ms: float) -> str:
+    route = getattr(scope.get("route"), "path", scope["path"])
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_")
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    return f"{stamp}_{scope['method']}_{slug}_{elapsed_ms:.0f}ms.prof"
+
+class ServerTimingMiddleware:
+    """Server-Timing header with the phases of each /api request, plus the optional profiler"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global profiler_busy
+        if scope["type"] != "http" or not scope["path"].startswith("/api"):
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        
+        forced = PROFILE_ALLOW_HEADER and (b"x-profile", b"1") in scope.get("headers", [])
+        profiler = None
+        if (forced or random.random() < PROFILE_SAMPLE_RATE) and not profiler_busy:
+            profiler_busy = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("Server-Timing", timings.header(time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(token)
+            if profiler is not None:
+                profiler.disable()
+                profiler_busy = False
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                # Sampled requests are kept only when slow, forced ones always
+                if forced or elapsed_ms >= PROFILE_SLOW_MS:
+                    await asyncio.to_thread(self.save_profile, profiler, profile_file_name(scope, elapsed_ms))
+
+    @staticmethod
+    def save_profile(profiler: cProfile.Profile, file_name: str):
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(PROFILE_DIR / file_name)
+        logger.info(f"Saved request profile {PROFILE_DIR / file_name}")
+
+app.add_middleware(ServerTimingMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "ETag"],
 )
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+
+@app.on_event("shutdown")
+async def shutdown_magento_clients():
+    retiring = list(retiring_magento_clients)
+    for task in retiring:
+        task.cancel()
+    await asyncio.gather(*retiring, return_exceptions=True)
+    for magento_client in magento_clients.values():
+        await magento_client.aclose()
+    magento_clients.clear()
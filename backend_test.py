@@ -1,280 +1,359 @@
-import requests
-import sys
+"""Backend API checks and load test, run in-process against the FastAPI app
+
+The app is called through httpx.ASGITransport, MongoDB is the in-memory stand-in from
+tests/fake_mongo.py and Magento is the local stub from tests/magento_stub.py, so no deployed
+server, database or Magento installation is needed.
+
+Run with: python backend_test.py [--results DIR]
+          python backend_test.py --load [--rate 50] [--duration 10] [--latency 0.02] [--error-rate 0.0]
+                                 [--max-p99-ms 500] [--max-error-rate 0.01]
+"""
+import argparse
+import asyncio
 import json
+import os
+import random
+import sys
+import time
 from datetime import datetime
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "backend_test")
+
+import server  # noqa: E402
+from tests.conftest import build_workbook  # noqa: E402
+from tests.fake_mongo import FakeDatabase  # noqa: E402
+from tests.magento_stub import ProductCatalog, create_magento_stub  # noqa: E402
+
+RESULTS_DIR = Path(os.environ.get("TEST_REPORTS_DIR", ROOT_DIR / "test_reports"))
+CONFIG = {
+    "magento_url": "https://magento.local",
+    "consumer_key": "test-consumer-key",
+    "consumer_secret": "test-consumer-secret",
+    "access_token": "test-access-token",
+    "access_token_secret": "test-access-token-secret"
+}
+STORE_VIEWS = [
+    {"id": 1, "code": "it", "name": "Italia", "website_id": 1, "store_group_id": 1},
+    {"id": 2, "code": "de", "name": "Deutschland", "website_id": 2, "store_group_id": 2},
+]
+CATALOG_SIZE = 2000
+# Load mode traffic mix: (kind, weight)
+LOAD_MIX = [("products", 0.8), ("update-price", 0.15), ("import-prices", 0.05)]
+IMPORT_ROWS = 200
+
+
+def install_local_backend(latency=0.0, error_rate=0.0):
+    """Point the app at a fresh in-memory database and Magento stub"""
+    stub = create_magento_stub(
+        products=ProductCatalog(CATALOG_SIZE),
+        store_views=STORE_VIEWS,
+        read_latency=latency,
+        write_latency=latency,
+        error_rate=error_rate
+    )
+    server.db = FakeDatabase()
+    server.vat_rate_cache.invalidate()
+    server.magento_transport = httpx.ASGITransport(app=stub)
+    server.magento_clients.clear()
+    return stub
+
+
+def api_client():
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=server.app),
+        base_url="http://backend.local/api",
+        timeout=None
+    )
+
 
 class MagentoAPITester:
-    def __init__(self, base_url="https://multi-store-prices.preview.emergentagent.com/api"):
-        self.base_url = base_url
+    def __init__(self, api: httpx.AsyncClient):
+        self.api = api
         self.tests_run = 0
         self.tests_passed = 0
         self.test_results = []
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, params=None):
-        """Run a single API test"""
-        url = f"{self.base_url}/{endpoint}"
-        headers = {'Content-Type': 'application/json'}
-
+    async def run_test(self, name, method, endpoint, expected_status, data=None, params=None, files=None, check=None):
+        """Run a single API test; `check` gets the response and returns an error message or None"""
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
-        print(f"   URL: {url}")
-        
-        try:
-            if method == 'GET':
-                response = requests.get(url, headers=headers, params=params, timeout=30)
-            elif method == 'POST':
-                response = requests.post(url, json=data, headers=headers, timeout=30)
-            elif method == 'PUT':
-                response = requests.put(url, json=data, headers=headers, timeout=30)
-            elif method == 'DELETE':
-                response = requests.delete(url, headers=headers, params=params, timeout=30)
-
-            success = response.status_code == expected_status
-            
-            result = {
-                "test_name": name,
-                "endpoint": endpoint,
-                "method": method,
-                "expected_status": expected_status,
-                "actual_status": response.status_code,
-                "success": success,
-                "response_data": None,
-                "error": None
-            }
-            
-            if success:
-                self.tests_passed += 1
-                print(f"✅ Passed - Status: {response.status_code}")
-                try:
-                    result["response_data"] = response.json()
-                except:
-                    result["response_data"] = response.text
-            else:
-                print(f"❌ Failed - Expected {expected_status}, got {response.status_code}")
-                try:
-                    error_data = response.json()
-                    result["error"] = error_data
-                    print(f"   Error: {error_data}")
-                except:
-                    result["error"] = response.text
-                    print(f"   Error: {response.text}")
+        print(f"   {method} /api/{endpoint}")
 
-            self.test_results.append(result)
-            return success, result["response_data"] if success else result["error"]
+        result = {
+            "test_name": name,
+            "endpoint": endpoint,
+            "method": method,
+            "expected_status": expected_status,
+            "actual_status": None,
+            "success": False,
+            "duration_ms": None,
+            "error": None
+        }
+        started = time.perf_counter()
+        try:
+            response = await self.api.request(method, endpoint, json=data, params=params, files=files)
+            result["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            result["actual_status"] = response.status_code
 
+            if response.status_code != expected_status:
+                result["error"] = response.text[:500]
+                print(f"❌ Failed - Expected {expected_status}, got {response.status_code}")
+                print(f"   Error: {response.text[:200]}")
+            elif check and (problem := check(response)):
+                result["error"] = problem
+                print(f"❌ Failed - {problem}")
+            else:
+                result["success"] = True
+                self.tests_passed += 1
+                print(f"✅ Passed - Status: {response.status_code} in {result['duration_ms']} ms")
         except Exception as e:
+            result["error"] = str(e)
             print(f"❌ Failed - Exception: {str(e)}")
-            result = {
-                "test_name": name,
-                "endpoint": endpoint,
-                "method": method,
-                "expected_status": expected_status,
-                "actual_status": None,
-                "success": False,
-                "response_data": None,
-                "error": str(e)
-            }
-            self.test_results.append(result)
-            return False, str(e)
-
-    def test_root_endpoint(self):
-        """Test root API endpoint"""
-        return self.run_test(
-            "Root API Endpoint",
-            "GET",
-            "",
-            200
-        )
 
-    def test_connection_with_invalid_data(self):
-        """Test connection with invalid Magento credentials"""
-        return self.run_test(
-            "Test Connection - Invalid Data",
-            "POST",
-            "test-connection",
-            400,  # Expecting validation error or connection failure
-            data={
-                "magento_url": "invalid-url",
-                "access_token": "invalid-token"
-            }
+        self.test_results.append(result)
+        return result["success"]
+
+    async def test_root_endpoint(self):
+        return await self.run_test("Root API Endpoint", "GET", "", 200)
+
+    async def test_save_and_load_config(self):
+        await self.run_test("Save Configuration", "POST", "save-config", 200, data=CONFIG)
+        return await self.run_test(
+            "Load Configuration", "GET", "load-config", 200,
+            check=lambda r: None if r.json().get("config", {}).get("magento_url") == CONFIG["magento_url"]
+            else "saved configuration not returned"
         )
 
-    def test_connection_with_valid_format(self):
-        """Test connection with valid URL format but fake credentials"""
-        return self.run_test(
-            "Test Connection - Valid Format",
-            "POST",
-            "test-connection",
-            502,  # Expecting connection error since it's fake
-            data={
-                "magento_url": "https://fake-magento-store.com",
-                "access_token": "fake-token-12345"
-            }
+    async def test_form_validation(self):
+        """Missing credentials are rejected before Magento is contacted"""
+        return await self.run_test(
+            "Missing OAuth Fields", "POST", "test-connection", 422,
+            data={"magento_url": CONFIG["magento_url"]}
         )
 
-    def test_store_views_invalid(self):
-        """Test store views with invalid credentials"""
-        return self.run_test(
-            "Store Views - Invalid Credentials",
-            "POST",
-            "store-views",
-            502,  # Expecting connection error
-            data={
-                "magento_url": "https://fake-magento-store.com",
-                "access_token": "fake-token-12345"
-            }
+    async def test_connection(self):
+        return await self.run_test(
+            "Test Connection", "POST", "test-connection", 200, data=CONFIG,
+            check=lambda r: None if r.json().get("success") else "connection not reported as successful"
         )
 
-    def test_products_invalid(self):
-        """Test products endpoint with invalid credentials"""
-        return self.run_test(
-            "Products - Invalid Credentials",
-            "POST",
-            "products?store_id=0&page=1&page_size=10",
-            502,  # Expecting connection error
-            data={
-                "magento_url": "https://fake-magento-store.com",
-                "access_token": "fake-token-12345"
-            }
+    async def test_store_views(self):
+        return await self.run_test(
+            "Store Views", "POST", "store-views", 200, data=CONFIG,
+            check=lambda r: None if len(r.json()) == len(STORE_VIEWS) else f"expected {len(STORE_VIEWS)} store views"
         )
 
-    def test_update_price_invalid(self):
-        """Test price update with invalid credentials"""
-        return self.run_test(
-            "Update Price - Invalid Credentials",
-            "POST",
-            "update-price",
-            502,  # Expecting connection error
-            data={
-                "magento_url": "https://fake-magento-store.com",
-                "access_token": "fake-token-12345",
-                "sku": "TEST-SKU",
-                "store_id": 0,
-                "base_price": 99.99
-            }
+    async def test_products(self):
+        return await self.run_test(
+            "Products Page", "POST", "products", 200, data=CONFIG,
+            params={"store_id": 1, "page": 2, "page_size": 10},
+            check=lambda r: None if len(r.json()["items"]) == 10 and r.json()["total_count"] == CATALOG_SIZE
+            else "unexpected page content"
         )
 
-    def test_save_config(self):
-        """Test saving configuration"""
-        return self.run_test(
-            "Save Configuration",
-            "POST",
-            "save-config",
-            200,
-            data={
-                "magento_url": "https://test-store.com",
-                "access_token": "test-token"
-            }
+    async def test_update_price(self):
+        return await self.run_test(
+            "Update Price", "POST", "update-price", 200,
+            data={"config": CONFIG, "price_update": {"sku": "SKU-000001", "store_id": 1, "base_price": 99.99}}
         )
 
-    def test_load_config(self):
-        """Test loading configuration"""
-        return self.run_test(
-            "Load Configuration",
-            "GET",
-            "load-config",
-            200
+    async def test_vat_rates(self):
+        await self.run_test(
+            "Save VAT Rates", "POST", "vat-rates", 200,
+            data={"vat_rates": [{"store_id": 1, "store_code": "it", "store_name": "Italia", "vat_rate": 22}]}
+        )
+        return await self.run_test(
+            "Load VAT Rates", "GET", "vat-rates", 200,
+            check=lambda r: None if r.json()["vat_rates"][0]["vat_rate"] == 22 else "VAT rate not stored"
         )
 
-    def test_form_validation(self):
-        """Test form validation with missing fields"""
-        print("\n🔍 Testing Form Validation...")
-        
-        # Test missing magento_url
-        success1, _ = self.run_test(
-            "Missing Magento URL",
-            "POST",
-            "test-connection",
-            422,  # Validation error
-            data={
-                "access_token": "test-token"
-            }
+    async def test_import_and_parse(self):
+        workbook = build_workbook([
+            {"SKU": f"SKU-{i:06d}", "Store": "it", "Prezzo Base (IVA incl.)": 50.0 + i} for i in range(20)
+        ] + [{"SKU": "SKU-000001", "Store": "xx", "Prezzo Base (IVA incl.)": 1.0}])
+        await self.run_test(
+            "Import Prices", "POST", "import-prices", 200, params=CONFIG,
+            files={"file": ("prezzi.xlsx", workbook, "application/octet-stream")},
+            check=lambda r: None if r.json()["updated_count"] == 20 and len(r.json()["errors"]) == 1
+            else f"unexpected import result {r.json()}"
         )
-        
-        # Test missing access_token
-        success2, _ = self.run_test(
-            "Missing Access Token",
-            "POST",
-            "test-connection",
-            422,  # Validation error
-            data={
-                "magento_url": "https://test-store.com"
-            }
+        return await self.run_test(
+            "Parse Excel", "POST", "parse-excel", 200,
+            files={"file": ("prezzi.xlsx", workbook, "application/octet-stream")},
+            check=lambda r: None if r.json()["total_count"] == 21 else "unexpected parsed rows"
         )
-        
-        # Test empty fields
-        success3, _ = self.run_test(
-            "Empty Fields",
-            "POST",
-            "test-connection",
-            502,  # Connection error with empty values
-            data={
-                "magento_url": "",
-                "access_token": ""
-            }
+
+    async def test_export(self):
+        return await self.run_test(
+            "Export Prices", "POST", "export-prices", 200, data=CONFIG,
+            check=lambda r: None if r.headers["content-type"].startswith("application/vnd.openxmlformats")
+            else "export is not an xlsx file"
         )
-        
-        return success1 or success2 or success3
 
-def main():
-    print("🚀 Starting Magento Price Manager API Tests")
+
+async def run_checks(results_dir: Path) -> int:
+    print("🚀 Starting Magento Price Manager API Tests (in-process)")
     print("=" * 60)
-    
-    tester = MagentoAPITester()
-    
-    # Run all tests
-    print("\n📋 Running Backend API Tests...")
-    
-    # Basic endpoint tests
-    tester.test_root_endpoint()
-    
-    # Configuration tests
-    tester.test_save_config()
-    tester.test_load_config()
-    
-    # Form validation tests
-    tester.test_form_validation()
-    
-    # Connection tests with various scenarios
-    tester.test_connection_with_invalid_data()
-    tester.test_connection_with_valid_format()
-    
-    # API endpoint tests
-    tester.test_store_views_invalid()
-    tester.test_products_invalid()
-    tester.test_update_price_invalid()
-    
-    # Print final results
+    install_local_backend()
+
+    async with api_client() as api:
+        tester = MagentoAPITester(api)
+        await tester.test_root_endpoint()
+        await tester.test_save_and_load_config()
+        await tester.test_form_validation()
+        await tester.test_connection()
+        await tester.test_store_views()
+        await tester.test_products()
+        await tester.test_update_price()
+        await tester.test_vat_rates()
+        await tester.test_import_and_parse()
+        await tester.test_export()
+    await server.shutdown_magento_clients()
+
     print("\n" + "=" * 60)
-    print(f"📊 Test Results Summary:")
+    print("📊 Test Results Summary:")
     print(f"   Total Tests: {tester.tests_run}")
     print(f"   Passed: {tester.tests_passed}")
     print(f"   Failed: {tester.tests_run - tester.tests_passed}")
     print(f"   Success Rate: {(tester.tests_passed/tester.tests_run)*100:.1f}%")
-    
-    # Save detailed results
-    results_file = f"/app/test_reports/backend_test_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    with open(results_file, 'w') as f:
-        json.dump({
-            "timestamp": datetime.now().isoformat(),
-            "summary": {
-                "total_tests": tester.tests_run,
-                "passed_tests": tester.tests_passed,
-                "failed_tests": tester.tests_run - tester.tests_passed,
-                "success_rate": (tester.tests_passed/tester.tests_run)*100
-            },
-            "detailed_results": tester.test_results
-        }, f, indent=2)
-    
+
+    results_file = save_results(results_dir, "backend_test_results", {
+        "summary": {
+            "total_tests": tester.tests_run,
+            "passed_tests": tester.tests_passed,
+            "failed_tests": tester.tests_run - tester.tests_passed,
+            "success_rate": (tester.tests_passed/tester.tests_run)*100
+        },
+        "detailed_results": tester.test_results
+    })
     print(f"\n📄 Detailed results saved to: {results_file}")
-    
-    # Return appropriate exit code
+
     if tester.tests_passed == tester.tests_run:
         print("\n🎉 All tests passed!")
         return 0
-    else:
-        print(f"\n⚠️  {tester.tests_run - tester.tests_passed} tests failed")
+    print(f"\n⚠️  {tester.tests_run - tester.tests_passed} tests failed")
+    return 1
+
+
+async def run_load(args) -> int:
+    """Open-loop load: requests start on schedule whether or not earlier ones have finished"""
+    print(f"🚀 Load test: {args.rate} req/s for {args.duration}s, stub latency {args.latency}s, "
+          f"stub error rate {args.error_rate:.0%}")
+    install_local_backend(latency=args.latency, error_rate=args.error_rate)
+    rng = random.Random(0)
+    workbook = build_workbook([
+        {"SKU": f"SKU-{i:06d}", "Store": STORE_VIEWS[i % 2]["code"], "Prezzo Base (IVA incl.)": 20.0 + i % 50}
+        for i in range(IMPORT_ROWS)
+    ])
+    samples = {kind: [] for kind, _ in LOAD_MIX}
+    failures = {kind: 0 for kind, _ in LOAD_MIX}
+
+    async with api_client() as api:
+        async def send(kind):
+            if kind == "products":
+                request = api.post("products", json=CONFIG, params={
+                    "store_id": rng.choice([0, 1, 2]), "page": rng.randint(1, CATALOG_SIZE // 20), "page_size": 20
+                })
+            elif kind == "update-price":
+                request = api.post("update-price", json={"config": CONFIG, "price_update": {
+                    "sku": f"SKU-{rng.randrange(CATALOG_SIZE):06d}", "store_id": 1, "base_price": round(rng.uniform(5, 500), 2)
+                }})
+            else:
+                request = api.post("import-prices", params=CONFIG, files={
+                    "file": ("prezzi.xlsx", workbook, "application/octet-stream")
+                })
+            started = time.perf_counter()
+            try:
+                response = await request
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            samples[kind].append(time.perf_counter() - started)
+            if not ok:
+                failures[kind] += 1
+
+        kinds, weights = zip(*LOAD_MIX)
+        tasks = []
+        started = time.perf_counter()
+        total = int(args.rate * args.duration)
+        for n in range(total):
+            delay = started + n / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(rng.choices(kinds, weights)[0])))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    await server.shutdown_magento_clients()
+
+    report = {"target_rate": args.rate, "achieved_rate": round(total / elapsed, 1), "requests": total, "by_kind": {}}
+    print(f"\n{'kind':<15}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>9}")
+    all_latencies = []
+    for kind, latencies in samples.items():
+        if not latencies:
+            continue
+        all_latencies.extend(latencies)
+        p50, p95, p99 = (float(np.percentile(latencies, q)) * 1000 for q in (50, 95, 99))
+        stats = {
+            "count": len(latencies),
+            "p50_ms": round(p50, 1),
+            "p95_ms": round(p95, 1),
+            "p99_ms": round(p99, 1),
+            "max_ms": round(max(latencies) * 1000, 1),
+            "error_rate": round(failures[kind] / len(latencies), 4)
+        }
+        report["by_kind"][kind] = stats
+        print(f"{kind:<15}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+              f"{stats['max_ms']:>10.1f}{stats['error_rate']:>9.2%}")
+
+    report["p99_ms"] = round(float(np.percentile(all_latencies, 99)) * 1000, 1)
+    report["error_rate"] = round(sum(failures.values()) / total, 4)
+    print(f"\n📊 {total} requests at {report['achieved_rate']} req/s: p99 {report['p99_ms']} ms, "
+          f"errors {report['error_rate']:.2%}")
+    print(f"📄 Results saved to: {save_results(args.results, 'backend_load_results', report)}")
+
+    exceeded = []
+    if args.max_p99_ms is not None and report["p99_ms"] > args.max_p99_ms:
+        exceeded.append(f"p99 {report['p99_ms']} ms > {args.max_p99_ms} ms")
+    if args.max_error_rate is not None and report["error_rate"] > args.max_error_rate:
+        exceeded.append(f"error rate {report['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    if exceeded:
+        print(f"\n⚠️  Thresholds exceeded: {', '.join(exceeded)}")
         return 1
+    print("\n🎉 Within thresholds")
+    return 0
+
+
+def save_results(results_dir: Path, prefix: str, payload: dict) -> Path:
+    results_dir.mkdir(parents=True, exist_ok=True)
+    results_file = results_dir / f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(results_file, 'w') as f:
+        json.dump({"timestamp": datetime.now().isoformat(), **payload}, f, indent=2)
+    return results_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process backend API checks and load test")
+    parser.add_argument("--results", type=Path, default=RESULTS_DIR, help="directory for the JSON reports")
+    parser.add_argument("--load", action="store_true", help="run the concurrent load test instead of the checks")
+    parser.add_argument("--rate", type=float, default=50, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of traffic")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub latency per Magento call, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Magento calls answered with 503")
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="fail when the overall p99 is higher")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="fail when more requests error out")
+    args = parser.parse_args()
+
+    if args.load:
+        return asyncio.run(run_load(args))
+    return asyncio.run(run_checks(args.results))
+
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import { useMagento } from '../context/MagentoContext';
+import { conditionalFetch } from '../lib/conditionalFetch';
 import { ProductTable } from './ProductTable';
 import { PendingChanges } from './PendingChanges';
 import { ApprovedChanges } from './ApprovedChanges';
@@ -87,7 +88,7 @@ export const Dashboard = () => {
         params.append('search', searchTerm);
       }
 
-      const response = await fetch(`${PYTHON_API}/products?${params}`, {
+      const response = await conditionalFetch(`${PYTHON_API}/products?${params}`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -1,4 +1,5 @@
 import React, { createContext, useContext, useState, useEffect, useCallback } from 'react';
+import { conditionalFetch } from '../lib/conditionalFetch';
 
 const MagentoContext = createContext(null);
 
@@ -109,7 +110,7 @@ export const MagentoProvider = ({ children }) => {
             });
             
             if (testResponse.ok) {
-              const storesResponse = await fetch(`${PYTHON_API}/store-views`, {
+              const storesResponse = await conditionalFetch(`${PYTHON_API}/store-views`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify(oauthConfig),
@@ -180,7 +181,7 @@ export const MagentoProvider = ({ children }) => {
         throw new Error(errorMessage);
       }
       
-      const storesResponse = await fetch(`${PYTHON_API}/store-views`, {
+      const storesResponse = await conditionalFetch(`${PYTHON_API}/store-views`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(oauthConfig),
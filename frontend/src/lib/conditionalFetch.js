@@ -0,0 +1,32 @@
+// Browsers never revalidate POST responses on their own: the last ETag and body of each
+// request are kept here and sent back as If-None-Match, a 304 replays the stored body.
+const MAX_ENTRIES = 100;
+const responses = new Map();
+
+export async function conditionalFetch(url, options = {}) {
+  const key = `${url}|${options.body || ''}`;
+  const cached = responses.get(key);
+  const headers = { ...(options.headers || {}) };
+  if (cached) {
+    headers['If-None-Match'] = cached.etag;
+  }
+
+  const response = await fetch(url, { ...options, headers });
+
+  if (response.status === 304 && cached) {
+    return new Response(cached.body, {
+      status: 200,
+      headers: { 'Content-Type': 'application/json', ETag: cached.etag },
+    });
+  }
+
+  const etag = response.headers.get('ETag');
+  if (response.ok && etag) {
+    responses.delete(key);
+    if (responses.size >= MAX_ENTRIES) {
+      responses.delete(responses.keys().next().value);
+    }
+    responses.set(key, { etag, body: await response.clone().text() });
+  }
+  return response;
+}
@@ -0,0 +1,84 @@
+"""Column-wise Excel row processing at 100k rows, against the former iterrows loop
+
+Run with: python -m tests.bench_excel_rows [rows]
+"""
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+import server  # noqa: E402
+
+STORE_CODE_TO_ID = {"it": 1, "de": 2, "fr": 3, "es": 4}
+VAT_RATES_BY_STORE = {1: 22, 2: 19, 3: 20, 4: 21}
+
+
+def build_frame(rows):
+    rng = np.random.default_rng(0)
+    base = rng.uniform(5, 500, rows).round(2)
+    special = np.where(rng.random(rows) < 0.3, (base * 0.8).round(2), np.nan)
+    return pd.DataFrame({
+        "SKU": [f"SKU-{i:06d}" for i in range(rows)],
+        "Nome Prodotto": [f"Prodotto {i}" for i in range(rows)],
+        "Store": rng.choice(list(STORE_CODE_TO_ID) + ["xx"], rows, p=[0.24, 0.24, 0.24, 0.24, 0.04]),
+        "Store Nome": "Store",
+        "Aliquota IVA %": 22,
+        "Prezzo Base (IVA incl.)": np.where(rng.random(rows) < 0.05, np.nan, base),
+        "Prezzo Scontato (IVA incl.)": special,
+        "Data Inizio Sconto": pd.to_datetime(np.where(np.isnan(special), None, "2026-01-01")),
+        "Data Fine Sconto": pd.to_datetime(np.where(np.isnan(special), None, "2026-03-31")),
+    })
+
+
+def iterrows_baseline(df):
+    """The per-row loop import_prices used before, kept for comparison"""
+    writes, errors = [], []
+    for idx, row in df.iterrows():
+        sku = str(row.get("SKU", "")).strip()
+        store_code = str(row.get("Store", "")).strip()
+        store_id = STORE_CODE_TO_ID.get(store_code)
+        if store_id is None:
+            errors.append(f"Riga {idx + 2}: Store '{store_code}' non trovato")
+            continue
+        vat_rate = VAT_RATES_BY_STORE.get(store_id, 0)
+        vat_divisor = 1 + (vat_rate / 100) if vat_rate > 0 else 1
+        base_incl = row.get("Prezzo Base (IVA incl.)")
+        special_incl = row.get("Prezzo Scontato (IVA incl.)")
+        base_price = round(float(base_incl) / vat_divisor, 2) if pd.notna(base_incl) else None
+        special_price = round(float(special_incl) / vat_divisor, 2) if pd.notna(special_incl) else None
+        dates = []
+        for value in (row.get("Data Inizio Sconto"), row.get("Data Fine Sconto")):
+            if pd.notna(value):
+                dates.append(value.strftime("%Y-%m-%d") if isinstance(value, datetime) else str(value)[:10])
+        writes.append((sku, store_id, base_price, special_price, dates))
+    return writes, errors
+
+
+def timed(label, func, *args):
+    started = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28}{elapsed * 1000:>10.0f} ms")
+    return elapsed
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    df = build_frame(rows)
+    print(f"{rows} rows")
+    baseline = timed("iterrows (before)", iterrows_baseline, df)
+    vectorized = timed("prepare_import_rows", server.prepare_import_rows, df, STORE_CODE_TO_ID, VAT_RATES_BY_STORE)
+    timed("parse_price_rows", server.parse_price_rows, df)
+    print(f"import speed-up: {baseline / vectorized:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Payload size and parse time of a /V1/products page with and without `fields` projection
+
+Run with: python -m tests.bench_field_projection
+"""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+import server  # noqa: E402
+from tests.magento_stub import build_product, parse_fields, project_fields  # noqa: E402
+
+PAGE_SIZE = 100
+REPEAT = 50
+
+
+def measure(payload):
+    body = json.dumps(payload).encode()
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        json.loads(body)
+    return len(body), (time.perf_counter() - started) / REPEAT
+
+
+def main():
+    page = {
+        "items": [build_product(i) for i in range(PAGE_SIZE)],
+        "search_criteria": {"current_page": 1, "page_size": PAGE_SIZE},
+        "total_count": 12000,
+    }
+    full_size, full_parse = measure(page)
+    print(f"{'projection':<22}{'bytes/page':>12}{'parse ms':>10}{'size':>8}{'parse':>8}")
+    print(f"{'none':<22}{full_size:>12}{full_parse * 1000:>10.2f}{'100%':>8}{'100%':>8}")
+    for label, fields in (
+        ("PRODUCT_LIST_FIELDS", server.PRODUCT_LIST_FIELDS),
+        ("EXPORT_FIELDS", server.EXPORT_FIELDS),
+        ("CATALOG_SYNC_FIELDS", server.CATALOG_SYNC_FIELDS),
+    ):
+        size, parse = measure(project_fields(page, parse_fields(fields)))
+        print(f"{label:<22}{size:>12}{parse * 1000:>10.2f}{size / full_size:>8.0%}{parse / full_parse:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""End-to-end throughput of products, export-prices, import-prices and parse-excel against the local Magento stub
+
+Everything runs in one process: the backend through httpx.ASGITransport, Magento as the
+in-process stub and MongoDB as the in-memory fake, so runs are reproducible on any machine.
+Stub work (building and serializing products) is included in the timings, like a fast
+Magento on localhost would be.
+
+Run with: python -m tests.bench_suite [--sizes 1000,10000,100000] [--latency 0.0] [--error-rate 0.0]
+                                      [--repeat 3] [--update-baseline] [--check]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+import httpx
+import numpy as np
+import xlsxwriter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+import server  # noqa: E402
+from tests.fake_mongo import FakeDatabase  # noqa: E402
+from tests.magento_stub import ProductCatalog, create_magento_stub  # noqa: E402
+
+BASELINE_FILE = Path(__file__).resolve().parent / "bench_baselines.json"
+CONFIG = {
+    "magento_url": "https://magento.bench",
+    "consumer_key": "ck",
+    "consumer_secret": "cs",
+    "access_token": "at",
+    "access_token_secret": "ats",
+}
+STORE_VIEWS = [
+    {"id": 1, "code": "it", "name": "Italia", "website_id": 1, "store_group_id": 1},
+    {"id": 2, "code": "de", "name": "Deutschland", "website_id": 2, "store_group_id": 2},
+]
+VAT_RATES = [{"store_id": 1, "store_name": "Italia", "vat_rate": 22}, {"store_id": 2, "store_name": "Deutschland", "vat_rate": 19}]
+PRODUCT_REQUESTS = 50
+# A run is a regression when it is this much worse than the baseline
+REGRESSION_TOLERANCE = 0.25
+
+
+def read_peak_rss():
+    """Peak resident memory in MB; resettable on Linux, process-wide maximum elsewhere"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def build_price_sheet(rows):
+    """Import sheet touching every SKU once, alternating stores, a third with special prices"""
+    rng = np.random.default_rng(0)
+    base = rng.uniform(5, 500, rows).round(2)
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+    worksheet = workbook.add_worksheet("Prezzi")
+    worksheet.write_row(0, 0, ["SKU", "Store", "Prezzo Base (IVA incl.)", "Prezzo Scontato (IVA incl.)",
+                               "Data Inizio Sconto", "Data Fine Sconto"])
+    for i in range(rows):
+        special = [round(base[i] * 0.8, 2), "2026-01-01", "2026-03-31"] if i % 3 == 0 else []
+        worksheet.write_row(i + 1, 0, [f"SKU-{i:06d}", STORE_VIEWS[i % 2]["code"], base[i], *special])
+    workbook.close()
+    return output.getvalue()
+
+
+def percentile(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+
+async def measure(name, size, runs, call):
+    """Run `call` `runs` times; it returns the number of rows it handled"""
+    reset_peak_rss()
+    rss_before = read_peak_rss()
+    latencies, rows = [], 0
+    for _ in range(runs):
+        started = time.perf_counter()
+        rows += await call()
+        latencies.append(time.perf_counter() - started)
+    return {
+        "scenario": name,
+        "size": size,
+        "runs": runs,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "rows_per_s": round(rows / sum(latencies), 1),
+        "peak_mb": round(read_peak_rss() - rss_before, 1),
+    }
+
+
+async def run_size(size, args):
+    stub = create_magento_stub(
+        products=ProductCatalog(size),
+        store_views=STORE_VIEWS,
+        read_latency=args.latency,
+        write_latency=args.latency,
+        error_rate=args.error_rate,
+    )
+    server.db = FakeDatabase()
+    server.db.vat_rates.documents = [dict(rate) for rate in VAT_RATES]
+    server.vat_rate_cache.invalidate()
+    server.magento_transport = httpx.ASGITransport(app=stub)
+    server.magento_clients.clear()
+    sheet = build_price_sheet(size)
+    rng = np.random.default_rng(size)
+    results = []
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://backend.bench", timeout=None) as api:
+
+        async def products():
+            page = int(rng.integers(1, max(size // 20, 1) + 1))
+            response = await api.post("/api/products", json=CONFIG, params={"page": page, "page_size": 20, "store_id": 1})
+            response.raise_for_status()
+            return len(response.json()["items"])
+
+        async def export():
+            async with api.stream("POST", "/api/export-prices", json=CONFIG) as response:
+                response.raise_for_status()
+                async for _ in response.aiter_bytes():
+                    pass
+            # One row per product and store view
+            return size * len(STORE_VIEWS)
+
+        async def import_prices():
+            # Fresh store prices, so every run writes the whole sheet instead of skipping unchanged rows
+            stub.state.base_prices.clear()
+            stub.state.special_prices.clear()
+            stub.state.writes.clear()
+            response = await api.post(
+                "/api/import-prices",
+                params=CONFIG,
+                files={"file": ("prezzi.xlsx", sheet, "application/octet-stream")},
+            )
+            response.raise_for_status()
+            return size
+
+        async def parse_excel():
+            response = await api.post("/api/parse-excel", files={"file": ("prezzi.xlsx", sheet, "application/octet-stream")})
+            response.raise_for_status()
+            return response.json()["total_count"]
+
+        results.append(await measure("products", size, PRODUCT_REQUESTS, products))
+        results.append(await measure("export-prices", size, args.repeat, export))
+        results.append(await measure("import-prices", size, args.repeat, import_prices))
+        results.append(await measure("parse-excel", size, args.repeat, parse_excel))
+
+    await server.shutdown_magento_clients()
+    if stub.state.errors_served:
+        print(f"  stub answered {stub.state.errors_served} calls with 503")
+    return results
+
+
+def compare(result, baseline):
+    """Change against the baseline per metric, positive when worse"""
+    return {
+        "p50_ms": result["p50_ms"] / baseline["p50_ms"] - 1 if baseline["p50_ms"] else 0,
+        "p99_ms": result["p99_ms"] / baseline["p99_ms"] - 1 if baseline["p99_ms"] else 0,
+        "rows_per_s": baseline["rows_per_s"] / result["rows_per_s"] - 1 if result["rows_per_s"] else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated SKU counts")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub latency per Magento call, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Magento calls answered with 503")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of export, import and parse per size")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 on a regression")
+    args = parser.parse_args()
+
+    baselines = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    print(f"{'scenario':<15}{'SKUs':>8}{'p50 ms':>11}{'p99 ms':>11}{'rows/s':>11}{'peak MB':>9}  vs baseline")
+    regressions = []
+    for size in (int(value) for value in args.sizes.split(",")):
+        for result in asyncio.run(run_size(size, args)):
+            key = f"{result['scenario']}@{result['size']}"
+            note = ""
+            if key in baselines and not args.update_baseline:
+                changes = compare(result, baselines[key])
+                note = "  ".join(f"{metric} {change:+.0%}" for metric, change in changes.items())
+                if any(change > REGRESSION_TOLERANCE for change in changes.values()):
+                    regressions.append(key)
+                    note += "  REGRESSION"
+            print(f"{result['scenario']:<15}{result['size']:>8}{result['p50_ms']:>11.1f}{result['p99_ms']:>11.1f}"
+                  f"{result['rows_per_s']:>11.1f}{result['peak_mb']:>9.1f}  {note}")
+            if args.update_baseline:
+                baselines[key] = {metric: result[metric] for metric in ("p50_ms", "p99_ms", "rows_per_s", "peak_mb")}
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline written to {args.baseline}")
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import asyncio
+import os
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import httpx
+import pandas as pd
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# server.py reads these at import time; the real database is never contacted
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+
+import server  # noqa: E402
+from tests.fake_mongo import FakeDatabase  # noqa: E402
+
+CONFIG = {
+    "magento_url": "https://magento.test",
+    "consumer_key": "ck",
+    "consumer_secret": "cs",
+    "access_token": "at",
+    "access_token_secret": "ats",
+}
+
+
+def api_client():
+    """httpx client calling the app in-process"""
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://backend.test")
+
+
+def call_api(method, path, **kwargs):
+    """Send one request to the app and return the response"""
+    async def scenario():
+        async with api_client() as api:
+            return await api.request(method, path, **kwargs)
+
+    return asyncio.run(scenario())
+
+
+def build_workbook(rows):
+    """Excel upload with one sheet built from row dicts"""
+    output = BytesIO()
+    pd.DataFrame(rows).to_excel(output, index=False, engine="xlsxwriter")
+    return output.getvalue()
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """Replace the Motor database with an in-memory stand-in"""
+    database = FakeDatabase()
+    monkeypatch.setattr(server, "db", database)
+    server.vat_rate_cache.invalidate()
+    return database
+
+
+@pytest.fixture
+def magento_stub_transport(monkeypatch):
+    """Route every outbound Magento call to the given ASGI stub app"""
+
+    def install(stub_app):
+        monkeypatch.setattr(server, "magento_transport", httpx.ASGITransport(app=stub_app))
+        server.magento_clients.clear()
+
+    yield install
+    server.magento_clients.clear()
@@ -0,0 +1,165 @@
+"""Minimal in-memory stand-in for the Motor collections used by server.py"""
+import copy
+import re
+
+
+def _matches(document, query):
+    for key, expected in query.items():
+        if key == "$or":
+            if not any(_matches(document, branch) for branch in expected):
+                return False
+        elif isinstance(expected, dict) and any(k.startswith("$") for k in expected):
+            value = document.get(key)
+            for op, operand in expected.items():
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$lt" and not (value is not None and value < operand):
+                    return False
+                if op == "$regex":
+                    flags = re.IGNORECASE if "i" in expected.get("$options", "") else 0
+                    if value is None or not re.search(operand, str(value), flags):
+                        return False
+        elif document.get(key) != expected:
+            return False
+    return True
+
+
+def _project(document, projection):
+    document = copy.deepcopy(document)
+    if not projection:
+        return document
+    included = [key for key, flag in projection.items() if flag and key != "_id"]
+    if included:
+        document = {key: document[key] for key in ["_id", *included] if key in document}
+    for key, flag in projection.items():
+        if not flag:
+            document.pop(key, None)
+    return document
+
+
+def _apply_update(document, update):
+    document.update(copy.deepcopy(update.get("$set", {})))
+    for key, amount in update.get("$inc", {}).items():
+        document[key] = document.get(key, 0) + amount
+    for key in update.get("$unset", {}):
+        document.pop(key, None)
+    for key, value in update.get("$push", {}).items():
+        values = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+        document.setdefault(key, []).extend(copy.deepcopy(values))
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, key, direction=1):
+        self.documents = sorted(self.documents, key=lambda d: d.get(key), reverse=direction < 0)
+        return self
+
+    def skip(self, count):
+        self.documents = self.documents[count:]
+        return self
+
+    def limit(self, count):
+        if count:
+            self.documents = self.documents[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self.documents if length is None else self.documents[:length]
+
+    def __aiter__(self):
+        self._iter = iter(self.documents)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = []
+
+    def find(self, query=None, projection=None):
+        query = query or {}
+        return FakeCursor([_project(d, projection) for d in self.documents if _matches(d, query)])
+
+    async def find_one(self, query=None, projection=None):
+        query = query or {}
+        for document in self.documents:
+            if _matches(document, query):
+                return _project(document, projection)
+        return None
+
+    async def insert_one(self, document):
+        self.documents.append(copy.deepcopy(document))
+
+    async def insert_many(self, documents):
+        self.documents.extend(copy.deepcopy(d) for d in documents)
+
+    async def update_one(self, query, update, upsert=False):
+        for document in self.documents:
+            if _matches(document, query):
+                _apply_update(document, update)
+                return
+        if upsert:
+            document = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            _apply_update(document, update)
+            self.documents.append(document)
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=False):
+        for document in self.documents:
+            if _matches(document, query):
+                before = _project(document, projection)
+                _apply_update(document, update)
+                # pymongo.ReturnDocument.AFTER is True
+                return _project(document, projection) if return_document else before
+        return None
+
+    async def delete_many(self, query):
+        self.documents = [d for d in self.documents if not _matches(d, query)]
+
+    async def count_documents(self, query):
+        return sum(1 for d in self.documents if _matches(d, query))
+
+    async def replace_one(self, query, replacement, upsert=False):
+        for position, document in enumerate(self.documents):
+            if _matches(document, query):
+                self.documents[position] = {"_id": document.get("_id"), **copy.deepcopy(replacement)}
+                return
+        if upsert:
+            self.documents.append(copy.deepcopy(replacement))
+
+    async def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            # pymongo write models keep their arguments in private attributes
+            kind = type(operation).__name__
+            if kind == "DeleteMany":
+                await self.delete_many(operation._filter)
+            elif kind == "ReplaceOne":
+                await self.replace_one(operation._filter, operation._doc, upsert=operation._upsert)
+            else:
+                await self.update_one(operation._filter, operation._doc, upsert=operation._upsert)
+
+    async def create_index(self, keys, **kwargs):
+        return "_".join(str(k) for k in keys)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.collections.setdefault(name, FakeCollection())
+
+    def __getitem__(self, name):
+        return self.__getattr__(name)
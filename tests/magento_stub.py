@@ -0,0 +1,310 @@
+"""In-process Magento 2 REST stub served through httpx.ASGITransport"""
+import asyncio
+import random
+import re
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+FILTER_PARAM = re.compile(r"searchCriteria\[filter_groups\]\[(\d+)\]\[filters\]\[(\d+)\]\[(\w+)\]")
+
+
+def _filter_groups(query_params):
+    """searchCriteria filter groups: filters inside a group are OR-ed, groups are AND-ed"""
+    groups = {}
+    for key, value in query_params.items():
+        match = FILTER_PARAM.fullmatch(key)
+        if match:
+            group, position, part = match.groups()
+            groups.setdefault(group, {}).setdefault(position, {})[part] = value
+    return [list(filters.values()) for filters in groups.values()]
+
+
+def _filter_matches(product, condition):
+    value = str(product.get(condition["field"], ""))
+    expected = condition.get("value", "")
+    kind = condition.get("condition_type", "eq")
+    if kind == "like":
+        pattern = re.escape(expected).replace("%", ".*")
+        return re.fullmatch(pattern, value, re.IGNORECASE) is not None
+    if kind == "gteq":
+        return value >= expected
+    if kind == "gt":
+        return value > expected
+    if kind == "in":
+        return value in expected.split(",")
+    return value == expected
+
+
+def parse_fields(fields):
+    """Parse Magento's `fields` syntax, e.g. items[id,sku,custom_attributes[value]],total_count"""
+    tree, stack, name = {}, [], ""
+    node = tree
+    for char in fields + ",":
+        if char == "[":
+            node[name] = {}
+            stack.append(node)
+            node, name = node[name], ""
+        elif char in ",]":
+            if name:
+                node[name] = None
+            name = ""
+            if char == "]":
+                node = stack.pop()
+        else:
+            name += char.strip()
+    return tree
+
+
+def project_fields(payload, tree):
+    """Keep only the requested keys, like Magento's webapi field filter"""
+    if tree is None:
+        return payload
+    if isinstance(payload, list):
+        return [project_fields(item, tree) for item in payload]
+    if isinstance(payload, dict):
+        return {key: project_fields(payload[key], subtree) for key, subtree in tree.items() if key in payload}
+    return payload
+
+
+def build_product(i, price=None):
+    """Product shaped like a real Magento 2 /V1/products item, attributes and media included"""
+    sku = f"SKU-{i:06d}"
+    price = price if price is not None else round(10 + (i % 500) * 1.37, 2)
+    description = "<p>" + " ".join(f"Descrizione dettagliata del prodotto {i}, parte {n}." for n in range(12)) + "</p>"
+    return {
+        "id": i + 1,
+        "sku": sku,
+        "name": f"Prodotto di esempio {i}",
+        "attribute_set_id": 4,
+        "price": price,
+        "status": 1,
+        "visibility": 4,
+        "type_id": "simple",
+        "created_at": "2025-06-01 08:00:00",
+        "updated_at": f"2026-01-01 10:{(i // 60) % 60:02d}:{i % 60:02d}",
+        "weight": 1.2,
+        "extension_attributes": {
+            "website_ids": [1, 2],
+            "category_links": [{"position": n, "category_id": str(10 + n)} for n in range(3)],
+            "stock_item": {
+                "item_id": i + 1, "product_id": i + 1, "stock_id": 1, "qty": 100, "is_in_stock": True,
+                "is_qty_decimal": False, "show_default_notification_message": False, "use_config_min_qty": True,
+                "min_qty": 0, "use_config_min_sale_qty": 1, "min_sale_qty": 1, "use_config_max_sale_qty": True,
+                "max_sale_qty": 10000, "use_config_backorders": True, "backorders": 0,
+                "use_config_notify_stock_qty": True, "notify_stock_qty": 1, "use_config_qty_increments": True,
+                "qty_increments": 0, "use_config_enable_qty_inc": True, "enable_qty_increments": False,
+                "use_config_manage_stock": True, "manage_stock": True, "low_stock_date": None,
+                "is_decimal_divided": False, "stock_status_changed_auto": 0,
+            },
+        },
+        "product_links": [],
+        "options": [],
+        "media_gallery_entries": [
+            {"id": i * 3 + n, "media_type": "image", "label": f"Immagine {n}", "position": n, "disabled": False,
+             "types": ["image", "small_image", "thumbnail"] if n == 0 else [], "file": f"/s/k/{sku.lower()}_{n}.jpg"}
+            for n in range(3)
+        ],
+        "tier_prices": [],
+        "custom_attributes": [
+            {"attribute_code": "description", "value": description},
+            {"attribute_code": "short_description", "value": f"<p>Prodotto {i}</p>"},
+            {"attribute_code": "meta_title", "value": f"Prodotto di esempio {i}"},
+            {"attribute_code": "meta_keyword", "value": f"prodotto, esempio, {i}"},
+            {"attribute_code": "meta_description", "value": f"Acquista il prodotto di esempio {i}"},
+            {"attribute_code": "image", "value": f"/s/k/{sku.lower()}_0.jpg"},
+            {"attribute_code": "small_image", "value": f"/s/k/{sku.lower()}_0.jpg"},
+            {"attribute_code": "thumbnail", "value": f"/s/k/{sku.lower()}_0.jpg"},
+            {"attribute_code": "url_key", "value": f"prodotto-di-esempio-{i}"},
+            {"attribute_code": "category_ids", "value": ["10", "11", "12"]},
+            {"attribute_code": "options_container", "value": "container2"},
+            {"attribute_code": "required_options", "value": "0"},
+            {"attribute_code": "has_options", "value": "0"},
+            {"attribute_code": "tax_class_id", "value": "2"},
+            {"attribute_code": "gift_message_available", "value": "2"},
+            {"attribute_code": "msrp_display_actual_price_type", "value": "0"},
+            {"attribute_code": "special_price", "value": f"{price * 0.9:.2f}"} if i % 4 == 0 else
+            {"attribute_code": "color", "value": "49"},
+            {"attribute_code": "special_from_date", "value": "2026-01-01 00:00:00"},
+            {"attribute_code": "special_to_date", "value": "2026-12-31 00:00:00"},
+        ],
+    }
+
+
+class ProductCatalog:
+    """List-like catalog of `count` build_product items generated on access, so 100k SKUs cost no memory"""
+
+    def __init__(self, count):
+        self.count = count
+        self.overrides = {}
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(self.count))]
+        if key < 0:
+            key += self.count
+        if not 0 <= key < self.count:
+            raise IndexError(key)
+        return self.overrides.get(key) or build_product(key)
+
+    def __setitem__(self, key, product):
+        self.overrides[key] = product
+
+    def __iter__(self):
+        return (self[i] for i in range(self.count))
+
+    def find(self, sku):
+        """Product for a SKU-NNNNNN code without generating the whole catalog"""
+        if not re.fullmatch(r"SKU-\d{6}", sku) or int(sku[4:]) >= self.count:
+            return None
+        product = self[int(sku[4:])]
+        return product if product["sku"] == sku else None
+
+
+def create_magento_stub(products=None, store_views=None, read_latency=0.0, write_latency=0.0, error_rate=0.0, seed=0):
+    """Build a stub app; latencies are in seconds and use asyncio.sleep, like a slow remote.
+
+    error_rate is the share of calls answered with 503, drawn from a seeded generator so runs repeat.
+    """
+    stub = FastAPI()
+    stub.state.products = products if products is not None else []
+    stub.state.store_views = store_views if store_views is not None else [
+        {"id": 1, "code": "default", "name": "Default Store View", "website_id": 1, "store_group_id": 1},
+    ]
+    stub.state.writes = []
+    stub.state.store_view_calls = 0
+    stub.state.product_list_calls = 0
+    # Store-scoped overrides keyed by (sku, store_id); store 0 falls back to the product data
+    stub.state.base_prices = {}
+    stub.state.special_prices = {}
+    stub.state.error_rate = error_rate
+    stub.state.errors_served = 0
+    rng = random.Random(seed)
+    sku_index = {"size": None, "products": {}}
+
+    def find_product(sku):
+        products = stub.state.products
+        if isinstance(products, ProductCatalog):
+            return products.find(sku)
+        # Rebuilt whenever a test swaps or grows the product list
+        if sku_index["size"] != (id(products), len(products)):
+            sku_index["products"] = {p["sku"]: p for p in products}
+            sku_index["size"] = (id(products), len(products))
+        return sku_index["products"].get(sku)
+
+    @stub.middleware("http")
+    async def inject_errors(request: Request, call_next):
+        if stub.state.error_rate and rng.random() < stub.state.error_rate:
+            stub.state.errors_served += 1
+            return JSONResponse({"message": "Service temporarily unavailable"}, status_code=503)
+        return await call_next(request)
+
+    @stub.get("/rest/V1/store/storeViews")
+    async def store_views_route():
+        await asyncio.sleep(read_latency)
+        stub.state.store_view_calls += 1
+        return stub.state.store_views
+
+    @stub.get("/rest/V1/products")
+    async def products_route(request: Request):
+        stub.state.product_list_calls += 1
+        await asyncio.sleep(read_latency)
+        page_size = int(request.query_params.get("searchCriteria[pageSize]", 20))
+        current_page = int(request.query_params.get("searchCriteria[currentPage]", 1))
+        groups = _filter_groups(request.query_params)
+        if not groups:
+            products = stub.state.products
+        elif len(groups) == 1 and len(groups[0]) == 1 and groups[0][0]["field"] == "sku" and groups[0][0].get("condition_type") == "in":
+            # Page of SKUs picked by the backend search index
+            found = (find_product(sku) for sku in groups[0][0]["value"].split(","))
+            products = [p for p in found if p is not None]
+        else:
+            products = [
+                p for p in stub.state.products
+                if all(any(_filter_matches(p, condition) for condition in group) for group in groups)
+            ]
+        start = (current_page - 1) * page_size
+        result = {
+            "items": products[start:start + page_size],
+            "total_count": len(products),
+            "search_criteria": {"current_page": current_page, "page_size": page_size},
+        }
+        if "fields" in request.query_params:
+            result = project_fields(result, parse_fields(request.query_params["fields"]))
+        return result
+
+    def scoped_keys(skus):
+        """(sku, store_id) pairs for the default scope and every store view"""
+        store_ids = [0] + [view["id"] for view in stub.state.store_views]
+        return [(sku, store_id) for sku in sorted(skus) for store_id in store_ids]
+
+    @stub.post("/rest/V1/products/base-prices-information")
+    async def base_prices_information_route(request: Request):
+        await asyncio.sleep(read_latency)
+        skus = set((await request.json())["skus"])
+        found = (find_product(sku) for sku in skus)
+        entries = [{"sku": p["sku"], "store_id": 0, "price": p.get("price", 0)} for p in found if p is not None]
+        entries += [
+            {"sku": sku, "store_id": store_id, "price": stub.state.base_prices[(sku, store_id)]}
+            for sku, store_id in scoped_keys(skus) if (sku, store_id) in stub.state.base_prices
+        ]
+        return entries
+
+    @stub.post("/rest/V1/products/special-price-information")
+    async def special_price_information_route(request: Request):
+        await asyncio.sleep(read_latency)
+        skus = set((await request.json())["skus"])
+        return [
+            {"sku": sku, "store_id": store_id, **stub.state.special_prices[(sku, store_id)]}
+            for sku, store_id in scoped_keys(skus) if (sku, store_id) in stub.state.special_prices
+        ]
+
+    def known_sku(sku):
+        return find_product(sku) is not None
+
+    def price_failure(price):
+        return {
+            "message": "Requested product doesn't exist. Verify it and try again. "
+                       "Row ID: SKU = %SKU, Store ID: %storeId, Price: %price.",
+            "parameters": {"SKU": price["sku"], "storeId": str(price["store_id"]), "price": str(price["price"])},
+        }
+
+    @stub.post("/rest/V1/products/base-prices")
+    async def base_prices_route(request: Request):
+        await asyncio.sleep(write_latency)
+        prices = (await request.json())["prices"]
+        stub.state.writes.append(("base-prices", prices))
+        failures = []
+        for price in prices:
+            if not known_sku(price["sku"]):
+                failures.append(price_failure(price))
+                continue
+            stub.state.base_prices[(price["sku"], price["store_id"])] = price["price"]
+        return failures
+
+    @stub.post("/rest/V1/products/special-price")
+    async def special_price_route(request: Request):
+        await asyncio.sleep(write_latency)
+        prices = (await request.json())["prices"]
+        stub.state.writes.append(("special-price", prices))
+        failures = []
+        for price in prices:
+            if not known_sku(price["sku"]):
+                failures.append(price_failure(price))
+                continue
+            stub.state.special_prices[(price["sku"], price["store_id"])] = {
+                "price": price["price"], "price_from": price["price_from"], "price_to": price["price_to"],
+            }
+        return failures
+
+    @stub.put("/rest/{store_code}/V1/products/{sku}")
+    async def product_put_route(store_code: str, sku: str, request: Request):
+        await asyncio.sleep(write_latency)
+        payload = await request.json()
+        stub.state.writes.append((store_code, sku, payload))
+        return payload["product"]
+
+    return stub
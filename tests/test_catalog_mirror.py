@@ -0,0 +1,149 @@
+"""Local catalog mirror: full and incremental sync, listing and export from MongoDB"""
+import asyncio
+from datetime import datetime, timezone
+from io import BytesIO
+
+import pandas as pd
+
+import server
+from tests.conftest import CONFIG, api_client, call_api
+from tests.magento_stub import create_magento_stub
+
+STORE_VIEWS = [
+    {"id": 1, "code": "it", "name": "Italia", "website_id": 1, "store_group_id": 1},
+    {"id": 2, "code": "de", "name": "Deutschland", "website_id": 2, "store_group_id": 2},
+]
+
+
+def product(i, updated_at=None):
+    updated_at = updated_at or f"2026-01-01 10:{i // 60:02d}:{i % 60:02d}"
+    return {"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0 + i, "updated_at": updated_at,
+            "custom_attributes": [{"attribute_code": "image", "value": f"/s/k/sku-{i}.jpg"}]}
+
+
+def test_mirror_sync_and_serving(fake_db, magento_stub_transport):
+    stub = create_magento_stub(products=[product(i) for i in range(150)], store_views=STORE_VIEWS)
+    stub.state.base_prices[("SKU-3", 2)] = 99.0
+    magento_stub_transport(stub)
+    config = server.MagentoConfig(**CONFIG)
+
+    async def scenario():
+        first = await server.sync_catalog(config)
+
+        # Only products updated since the last sync are read again
+        stub.state.products[5] = {**product(5, "2026-02-01 09:00:00"), "name": "Rinominato"}
+        second = await server.sync_catalog(config)
+
+        async with api_client() as api:
+            listing = await api.post("/api/products", json=CONFIG,
+                                     params={"source": "mirror", "store_id": 2, "search": "sku-3", "page_size": 5})
+            export = await api.post("/api/export-prices", json=CONFIG, params={"source": "mirror"})
+        return first, second, listing, export
+
+    first, second, listing, export = asyncio.run(scenario())
+
+    assert first["full"] and first["synced_count"] == 150
+    # The changed product, plus the one saved in the same second as the cursor
+    assert not second["full"] and second["synced_count"] == 2
+    assert fake_db.catalog_products.documents[5]["name"] == "Rinominato"
+
+    body = listing.json()
+    assert body["freshness"]["product_count"] == 150
+    assert body["total_count"] == 11  # SKU-3, SKU-30..39
+    assert body["items"][0]["prices"][0]["base_price"] == 99.0
+    assert body["items"][0]["image_url"] == "https://magento.test/media/catalog/product/s/k/sku-3.jpg"
+
+    assert export.headers["X-Catalog-Synced-At"] == body["freshness"]["last_sync"]
+    sheet = pd.read_excel(BytesIO(export.content))
+    assert len(sheet) == 300
+    assert sheet.loc[(sheet["SKU"] == "SKU-3") & (sheet["Store"] == "de"), "Prezzo Base (IVA incl.)"].item() == 99.0
+
+
+def test_mirror_requires_a_sync(fake_db, magento_stub_transport):
+    magento_stub_transport(create_magento_stub())
+
+    assert call_api("POST", "/api/products", json=CONFIG, params={"source": "mirror"}).status_code == 409
+
+
+def test_search_index_ranking():
+    search_index = server.ProductSearchIndex([
+        {"sku": "CAF-100", "name": "Caffè macinato 250g"},
+        {"sku": "CAF-1", "name": "Capsule caffè intenso"},
+        {"sku": "TAZ-01", "name": "Tazza da caffe"},
+        {"sku": "ZUC-01", "name": "Zucchero di canna"},
+    ], version="v1")
+
+    # Exact SKU first, then SKU prefix matches
+    assert search_index.search("caf-1")[:2] == ["CAF-1", "CAF-100"]
+    # Accent-insensitive, exact words ranked above word prefixes
+    assert search_index.search("caffe") == ["CAF-1", "CAF-100", "TAZ-01"]
+    assert search_index.search("CAFFÈ mac") == ["CAF-100"]
+    assert search_index.search("zucch") == ["ZUC-01"]
+    assert search_index.search("latte") == []
+
+
+def test_magento_listing_uses_search_index(fake_db, magento_stub_transport):
+    stub = create_magento_stub(products=[product(i) for i in range(30)], store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+    config = server.MagentoConfig(**CONFIG)
+
+    async def scenario():
+        await server.sync_catalog(config)
+        async with api_client() as api:
+            return await api.post("/api/products", json=CONFIG, params={"search": "SKU-2", "page": 2, "page_size": 5})
+
+    body = asyncio.run(scenario()).json()
+    assert body["total_count"] == 11
+    assert [item["sku"] for item in body["items"]] == ["SKU-24", "SKU-25", "SKU-26", "SKU-27", "SKU-28"]
+
+
+def test_magento_listing_ignores_stale_search_index(fake_db, magento_stub_transport, monkeypatch):
+    stub = create_magento_stub(products=[product(i) for i in range(30)], store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+    config = server.MagentoConfig(**CONFIG)
+    monkeypatch.setattr(server, "SEARCH_INDEX_MAX_AGE", 60)
+
+    async def scenario():
+        await server.sync_catalog(config)
+        await fake_db.catalog_sync.update_one({"_id": CONFIG["magento_url"]}, {"$set": {"last_sync": "2026-01-01T00:00:00+00:00"}})
+        # Created in Magento after the last sync
+        stub.state.products.append(product(200))
+        async with api_client() as api:
+            return await api.post("/api/products", json=CONFIG, params={"search": "SKU-200"})
+
+    body = asyncio.run(scenario()).json()
+    assert [item["sku"] for item in body["items"]] == ["SKU-200"]
+
+
+def test_price_writes_are_copied_into_the_mirror(fake_db, magento_stub_transport):
+    stub = create_magento_stub(products=[product(i) for i in range(5)], store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+    config = server.MagentoConfig(**CONFIG)
+
+    async def scenario():
+        await server.sync_catalog(config)
+        before = await server.catalog_freshness(config)
+        async with api_client() as api:
+            await api.post("/api/update-special-price", json={
+                "config": CONFIG,
+                "price_update": {"sku": "SKU-2", "store_id": 2, "special_price": 7.5,
+                                 "special_price_from": "2026-01-01", "special_price_to": "2026-02-01"},
+            })
+            await asyncio.gather(*server.mirror_refresh_tasks)
+            listing = await api.post("/api/products", json=CONFIG, params={"source": "mirror", "store_id": 2, "page_size": 5})
+        return before, await server.catalog_freshness(config), listing.json()
+
+    before, after, listing = asyncio.run(scenario())
+
+    # Batch price writes keep updated_at, so only the refresh brings them into the mirror
+    assert next(item for item in listing["items"] if item["sku"] == "SKU-2")["prices"][0]["special_price"] == 7.5
+    assert after["last_sync"] == before["last_sync"]
+    assert after["last_change"] > before["last_change"]
+
+
+def test_scheduled_sync_is_full_once_the_last_full_one_is_old(monkeypatch):
+    monkeypatch.setattr(server, "CATALOG_FULL_SYNC_INTERVAL", 3600)
+
+    assert server.full_sync_due({"last_full_sync": "2026-01-01T00:00:00+00:00"})
+    assert not server.full_sync_due({"last_full_sync": datetime.now(timezone.utc).isoformat()})
+    assert not server.full_sync_due({})
@@ -0,0 +1,68 @@
+"""ETag, Cache-Control and If-None-Match for product listings and store views"""
+import asyncio
+
+import server
+from tests.conftest import CONFIG, api_client
+from tests.magento_stub import create_magento_stub
+
+STORE_VIEWS = [
+    {"id": 1, "code": "it", "name": "Italia", "website_id": 1, "store_group_id": 1},
+    {"id": 2, "code": "de", "name": "Deutschland", "website_id": 2, "store_group_id": 2},
+]
+
+PRODUCTS = [{"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0, "updated_at": "2026-01-01 10:00:00"}
+            for i in range(5)]
+
+
+def test_listings_answer_304_until_content_changes(fake_db, magento_stub_transport):
+    stub = create_magento_stub(products=PRODUCTS, store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+
+    async def scenario():
+        async with api_client() as api:
+            stores = await api.post("/api/store-views", json=CONFIG)
+            stores_again = await api.post("/api/store-views", json=CONFIG, headers={"If-None-Match": stores.headers["etag"]})
+            page = await api.post("/api/products", json=CONFIG)
+            page_again = await api.post("/api/products", json=CONFIG, headers={"If-None-Match": f'W/{page.headers["etag"]}'})
+            stub.state.products[0] = {**PRODUCTS[0], "price": 11.0}
+            changed = await api.post("/api/products", json=CONFIG, headers={"If-None-Match": page.headers["etag"]})
+            return stores, stores_again, page, page_again, changed
+
+    stores, stores_again, page, page_again, changed = asyncio.run(scenario())
+
+    assert stores.status_code == 200
+    assert [store["code"] for store in stores.json()] == ["it", "de"]
+    assert stores.headers["cache-control"] == "private, no-cache"
+    assert stores_again.status_code == 304 and stores_again.content == b""
+    assert page.status_code == 200 and len(page.json()["items"]) == 5
+    assert page_again.status_code == 304
+    assert page_again.headers["etag"] == page.headers["etag"]
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != page.headers["etag"]
+    assert changed.json()["items"][0]["prices"][0]["base_price"] == 11.0
+
+
+def test_mirror_pages_are_tagged_by_sync_version(fake_db, magento_stub_transport):
+    stub = create_magento_stub(products=PRODUCTS, store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+    config = server.MagentoConfig(**CONFIG)
+    params = {"source": "mirror", "store_id": 1}
+
+    async def scenario():
+        await server.sync_catalog(config)
+        async with api_client() as api:
+            first = await api.post("/api/products", json=CONFIG, params=params)
+            etag = first.headers["etag"]
+            again = await api.post("/api/products", json=CONFIG, params=params, headers={"If-None-Match": etag})
+            other_store = await api.post("/api/products", json=CONFIG, params={**params, "store_id": 2},
+                                         headers={"If-None-Match": etag})
+            await fake_db.catalog_sync.update_one({"_id": CONFIG["magento_url"]}, {"$set": {"last_sync": "2026-09-01T00:00:00+00:00"}})
+            resynced = await api.post("/api/products", json=CONFIG, params=params, headers={"If-None-Match": etag})
+            return first, again, other_store, resynced
+
+    first, again, other_store, resynced = asyncio.run(scenario())
+
+    assert first.status_code == 200 and first.json()["total_count"] == 5
+    assert again.status_code == 304
+    assert other_store.status_code == 200
+    assert resynced.status_code == 200
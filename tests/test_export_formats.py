@@ -0,0 +1,85 @@
+"""Price export as CSV and Parquet, and import of the same formats"""
+import csv
+import datetime
+from io import BytesIO, StringIO
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import server
+from tests.conftest import CONFIG, call_api
+from tests.magento_stub import create_magento_stub
+
+STORE_VIEWS = [
+    {"id": 1, "code": "it", "name": "Italia", "website_id": 1, "store_group_id": 1},
+    {"id": 2, "code": "de", "name": "Deutschland", "website_id": 2, "store_group_id": 2},
+]
+
+
+def export(fmt):
+    return call_api("POST", "/api/export-prices", json=CONFIG, params={"format": fmt})
+
+
+def setup_catalog(fake_db, magento_stub_transport, monkeypatch):
+    fake_db.vat_rates.documents = [{"store_id": 1, "store_name": "Italia", "vat_rate": 22}]
+    products = [{"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0} for i in range(5)]
+    stub = create_magento_stub(products=products, store_views=STORE_VIEWS)
+    stub.state.special_prices[("SKU-1", 1)] = {
+        "price": 8.0, "price_from": "2026-01-01 00:00:00", "price_to": "2026-03-31 00:00:00",
+    }
+    magento_stub_transport(stub)
+    return stub
+
+
+def test_csv_export_streams_one_row_per_product_and_store(fake_db, magento_stub_transport, monkeypatch):
+    setup_catalog(fake_db, magento_stub_transport, monkeypatch)
+
+    response = export("csv")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"].endswith(".csv")
+    rows = list(csv.reader(StringIO(response.text)))
+    assert rows[0] == server.EXPORT_COLUMNS
+    assert len(rows) == 1 + 5 * len(STORE_VIEWS)
+    assert {row[0] for row in rows[1:]} == {f"SKU-{i}" for i in range(5)}
+
+
+def test_parquet_export_has_typed_columns_and_imports_back(fake_db, magento_stub_transport, monkeypatch):
+    stub = setup_catalog(fake_db, magento_stub_transport, monkeypatch)
+
+    response = export("parquet")
+
+    assert response.status_code == 200
+    table = pq.read_table(BytesIO(response.content))
+    assert table.num_rows == 5 * len(STORE_VIEWS)
+    assert table.schema.field("Prezzo Base (IVA incl.)").type == pa.float64()
+    assert table.schema.field("Data Inizio Sconto").type == pa.date32()
+    discounted = table.to_pandas().query("SKU == 'SKU-1' and Store == 'it'").iloc[0]
+    assert discounted["Data Inizio Sconto"] == datetime.date(2026, 1, 1)
+
+    # The exported file is a valid import: re-importing it with raised prices writes every row
+    edited = table.to_pandas()
+    edited["Prezzo Base (IVA incl.)"] = edited["Prezzo Base (IVA incl.)"] + 1
+    output = BytesIO()
+    pq.write_table(pa.Table.from_pandas(edited, preserve_index=False), output)
+
+    imported = call_api(
+        "POST",
+        "/api/import-prices",
+        params=CONFIG,
+        files={"file": ("prezzi.parquet", output.getvalue(), "application/octet-stream")},
+    )
+
+    assert imported.status_code == 200
+    assert imported.json()["failed_count"] == 0
+    assert imported.json()["updated_count"] == 5 * len(STORE_VIEWS)
+    assert stub.state.special_prices[("SKU-1", 1)]["price_from"].startswith("2026-01-01")
+
+
+def test_export_rejects_unknown_format(fake_db, magento_stub_transport, monkeypatch):
+    setup_catalog(fake_db, magento_stub_transport, monkeypatch)
+
+    response = export("ods")
+
+    assert response.status_code == 400
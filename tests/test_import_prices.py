@@ -0,0 +1,272 @@
+"""Batched price import through the Magento bulk price endpoints"""
+import asyncio
+
+import server
+from tests.conftest import CONFIG, api_client, build_workbook, call_api
+from tests.magento_stub import create_magento_stub
+
+STORE_VIEWS = [
+    {"id": 1, "code": "it", "name": "Italia", "website_id": 1, "store_group_id": 1},
+    {"id": 2, "code": "de", "name": "Deutschland", "website_id": 2, "store_group_id": 2},
+]
+
+
+def post_import(file, filename="prezzi.xlsx"):
+    return call_api(
+        "POST",
+        "/api/import-prices",
+        params=CONFIG,
+        files={"file": (filename, file, "application/octet-stream")},
+    )
+
+
+def test_import_batches_prices_and_maps_failures_to_rows(fake_db, magento_stub_transport, monkeypatch):
+    fake_db.vat_rates.documents = [{"store_id": 1, "store_name": "Italia", "vat_rate": 22}]
+    products = [{"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0} for i in range(5)]
+    stub = create_magento_stub(products=products, store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+    monkeypatch.setattr(server, "IMPORT_CHUNK_SIZE", 2)
+
+    rows = [
+        {"SKU": f"SKU-{i}", "Store": "it", "Prezzo Base (IVA incl.)": 122.0, "Prezzo Scontato (IVA incl.)": None}
+        for i in range(5)
+    ]
+    rows.append({"SKU": "MISSING", "Store": "de", "Prezzo Base (IVA incl.)": 50.0, "Prezzo Scontato (IVA incl.)": 40.0})
+    rows.append({"SKU": "SKU-0", "Store": "de", "Prezzo Base (IVA incl.)": None, "Prezzo Scontato (IVA incl.)": 8.0})
+
+    response = post_import(build_workbook(rows))
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["updated_count"] == 6
+    # Row 7 is the unknown SKU: both of its writes were rejected by Magento
+    assert len(body["errors"]) == 2
+    assert all(error.startswith("Riga 7: Requested product doesn't exist") for error in body["errors"])
+    assert stub.state.base_prices[("SKU-3", 1)] == 100.0
+    assert stub.state.special_prices[("SKU-0", 2)]["price"] == 8.0
+    # 6 base prices in chunks of 2, 2 special prices in one chunk
+    assert [endpoint for endpoint, _ in stub.state.writes].count("base-prices") == 3
+    assert [endpoint for endpoint, _ in stub.state.writes].count("special-price") == 1
+
+
+def test_import_job_runs_in_background_and_resumes(fake_db, magento_stub_transport, monkeypatch, tmp_path):
+    products = [{"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0} for i in range(6)]
+    stub = create_magento_stub(products=products, store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+    monkeypatch.setattr(server, "IMPORT_JOBS_DIR", tmp_path)
+    monkeypatch.setattr(server, "IMPORT_JOB_CHUNK_ROWS", 2)
+
+    rows = [{"SKU": f"SKU-{i}", "Store": "de", "Prezzo Base (IVA incl.)": 20.0 + i} for i in range(6)]
+    rows.append({"SKU": "SKU-0", "Store": "fr", "Prezzo Base (IVA incl.)": 1.0})
+
+    async def scenario():
+        async with api_client() as api:
+            created = await api.post(
+                "/api/import-jobs",
+                params=CONFIG,
+                files={"file": ("prezzi.xlsx", build_workbook(rows), "application/octet-stream")},
+            )
+            job_id = created.json()["job_id"]
+            await asyncio.gather(*server.import_job_tasks.values())
+            finished = (await api.get(f"/api/import-jobs/{job_id}")).json()
+
+            stored = dict(fake_db.import_jobs.documents[0])
+
+            # Simulate a worker that died after the first two chunks were committed
+            job = fake_db.import_jobs.documents[0]
+            job.update(status="running", committed_chunks=2, processed_rows=4, updated_count=4, error_count=0, errors=[],
+                       config=CONFIG, owner="dead-worker", lease_until="2026-01-01T00:00:00+00:00")
+            (tmp_path / f"{job_id}.xlsx").write_bytes(build_workbook(rows))
+            stub.state.writes.clear()
+            stub.state.base_prices.clear()
+            server.start_import_job(job_id)
+            await asyncio.gather(*server.import_job_tasks.values())
+            resumed = (await api.get(f"/api/import-jobs/{job_id}")).json()
+            return stored, finished, resumed
+
+    stored, finished, resumed = asyncio.run(scenario())
+
+    assert finished["status"] == "completed"
+    assert finished["processed_rows"] == 7
+    assert finished["updated_count"] == 6
+    assert finished["errors"] == ["Riga 8: Store 'fr' non trovato"]
+    assert "config" not in finished
+    # Credentials are dropped from MongoDB once the job is done
+    assert "config" not in stored
+    # Only the last two chunks (rows 6-7) were sent again
+    assert resumed["status"] == "completed"
+    assert resumed["updated_count"] == 6
+    assert [price["sku"] for _, prices in stub.state.writes for price in prices] == ["SKU-4", "SKU-5"]
+
+
+def test_csv_import_job_reads_the_stored_upload(fake_db, magento_stub_transport, monkeypatch, tmp_path):
+    products = [{"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0} for i in range(3)]
+    stub = create_magento_stub(products=products, store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+    monkeypatch.setattr(server, "IMPORT_JOBS_DIR", tmp_path)
+    monkeypatch.setattr(server, "IMPORT_JOB_CHUNK_ROWS", 2)
+    csv_file = b"SKU;Store;Prezzo Base (IVA incl.)\nSKU-0;de;20,50\nSKU-1;de;21,50\n\nSKU-2;fr;1,00\n"
+
+    async def scenario():
+        async with api_client() as api:
+            created = await api.post(
+                "/api/import-jobs",
+                params=CONFIG,
+                files={"file": ("prezzi.csv", csv_file, "text/csv")},
+            )
+            await asyncio.gather(*server.import_job_tasks.values())
+            return (await api.get(f"/api/import-jobs/{created.json()['job_id']}")).json()
+
+    finished = asyncio.run(scenario())
+
+    assert finished["status"] == "completed", finished.get("failure")
+    assert finished["updated_count"] == 2
+    assert finished["errors"] == ["Riga 5: Store 'fr' non trovato"]
+    assert stub.state.base_prices[("SKU-1", 2)] == 21.5
+    assert not list(tmp_path.iterdir())
+
+
+def test_import_job_leased_by_a_live_worker_is_not_taken_over(fake_db, magento_stub_transport, monkeypatch, tmp_path):
+    stub = create_magento_stub(products=[], store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+    upload = tmp_path / "broken.xlsx"
+    upload.write_bytes(b"not a workbook")
+    live_upload = tmp_path / "live.xlsx"
+    live_upload.write_bytes(b"")
+    fake_db.import_jobs.documents = [
+        {"_id": "live", "status": "running", "owner": "other-worker", "lease_until": "2999-01-01T00:00:00+00:00",
+         "config": CONFIG, "file_path": str(live_upload), "committed_chunks": 0},
+        {"_id": "broken", "status": "queued", "owner": None, "lease_until": None,
+         "config": CONFIG, "file_path": str(upload), "committed_chunks": 0},
+    ]
+
+    async def scenario():
+        await server.resume_import_jobs()
+        await asyncio.gather(*server.import_job_tasks.values())
+
+    asyncio.run(scenario())
+
+    live, broken = fake_db.import_jobs.documents
+    assert live["status"] == "running" and live["owner"] == "other-worker"
+    assert live_upload.exists()
+    # A failed job keeps no credentials and no upload on disk
+    assert broken["status"] == "failed" and broken["owner"] == server.WORKER_ID
+    assert "config" not in broken
+    assert not upload.exists()
+
+
+def test_csv_import_streams_chunks_and_keeps_row_numbers(fake_db, magento_stub_transport, monkeypatch):
+    products = [{"id": i, "sku": f"{1000 + i}", "name": f"Prodotto {i}", "price": 10.0} for i in range(5)]
+    stub = create_magento_stub(products=products, store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+    monkeypatch.setattr(server, "UPLOAD_CHUNK_ROWS", 2)
+
+    # Italian Excel CSV export: ';' separator, decimal comma, numeric-looking SKUs
+    lines = ["SKU;Store;Prezzo Base (IVA incl.);Prezzo Scontato (IVA incl.);Data Fine Sconto"]
+    lines += [f"{1000 + i};de;12,5{i};;" for i in range(5)]
+    lines.append("1000;fr;1,00;;")
+    csv_file = ("\n".join(lines) + "\n").encode("utf-8")
+
+    async def scenario():
+        async with api_client() as api:
+            imported = await api.post(
+                "/api/import-prices",
+                params=CONFIG,
+                files={"file": ("prezzi.csv", csv_file, "text/csv")},
+            )
+            parsed = await api.post("/api/parse-excel", files={"file": ("prezzi.csv", csv_file, "text/csv")})
+            return imported, parsed
+
+    imported, parsed = asyncio.run(scenario())
+
+    assert imported.status_code == 200
+    assert imported.json()["updated_count"] == 5
+    assert imported.json()["errors"] == ["Riga 7: Store 'fr' non trovato"]
+    assert stub.state.base_prices[("1003", 2)] == 12.53
+    # One writer call per streamed chunk
+    assert [endpoint for endpoint, _ in stub.state.writes].count("base-prices") == 3
+    items = parsed.json()["items"]
+    assert parsed.json()["total_count"] == 6
+    assert items[0]["sku"] == "1000"
+    assert items[4]["base_price_incl_vat"] == 12.54
+
+
+def test_csv_blank_lines_count_in_row_numbers(fake_db, magento_stub_transport, monkeypatch):
+    products = [{"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0} for i in range(2)]
+    stub = create_magento_stub(products=products, store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+    monkeypatch.setattr(server, "UPLOAD_CHUNK_ROWS", 1)
+    csv_file = b"SKU,Store,Prezzo Base (IVA incl.)\nSKU-0,de,12.50\n\n,,\nSKU-1,fr,1.00\n"
+
+    imported = post_import(csv_file, "prezzi.csv")
+
+    assert imported.status_code == 200
+    assert imported.json()["updated_count"] == 1
+    assert imported.json()["errors"] == ["Riga 5: Store 'fr' non trovato"]
+
+
+def test_import_skips_rows_matching_live_prices(fake_db, magento_stub_transport):
+    fake_db.vat_rates.documents = [{"store_id": 1, "store_name": "Italia", "vat_rate": 22}]
+    products = [{"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0} for i in range(4)]
+    stub = create_magento_stub(products=products, store_views=STORE_VIEWS)
+    stub.state.base_prices[("SKU-1", 1)] = 20.0
+    stub.state.special_prices[("SKU-2", 2)] = {"price": 8.0, "price_from": "2025-01-01 00:00:00", "price_to": ""}
+    magento_stub_transport(stub)
+
+    rows = [
+        # 12.2 / 1.22 = 10.00, inherited from the default scope
+        {"SKU": "SKU-0", "Store": "it", "Prezzo Base (IVA incl.)": 12.2},
+        # 24.4 / 1.22 = 20.00, the store-level override
+        {"SKU": "SKU-1", "Store": "it", "Prezzo Base (IVA incl.)": 24.4},
+        {"SKU": "SKU-2", "Store": "de", "Prezzo Scontato (IVA incl.)": 8.0, "Data Inizio Sconto": "2025-01-01"},
+        {"SKU": "SKU-2", "Store": "it", "Prezzo Scontato (IVA incl.)": 9.76, "Data Inizio Sconto": "2025-01-01"},
+        {"SKU": "SKU-3", "Store": "de", "Prezzo Base (IVA incl.)": 11.0},
+        {"SKU": "SKU-3", "Store": "fr", "Prezzo Base (IVA incl.)": 11.0},
+    ]
+
+    response = post_import(build_workbook(rows))
+
+    body = response.json()
+    assert body["unchanged_count"] == 3
+    assert body["updated_count"] == 2
+    assert body["failed_count"] == 1
+    written = [(endpoint, price["sku"]) for endpoint, prices in stub.state.writes for price in prices]
+    assert sorted(written) == [("base-prices", "SKU-3"), ("special-price", "SKU-2")]
+
+
+def test_import_plans_one_write_per_sku_and_price_scope(fake_db, magento_stub_transport, monkeypatch):
+    store_views = STORE_VIEWS + [{"id": 3, "code": "it_en", "name": "Italy EN", "website_id": 1, "store_group_id": 1}]
+    products = [{"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0} for i in range(3)]
+    stub = create_magento_stub(products=products, store_views=store_views)
+    magento_stub_transport(stub)
+    monkeypatch.setattr(server, "MAGENTO_PRICE_SCOPE", "website")
+
+    rows = [
+        {"SKU": "SKU-0", "Store": "it", "Prezzo Base (IVA incl.)": 11.0},
+        {"SKU": "SKU-0", "Store": "it", "Prezzo Base (IVA incl.)": 12.0},
+        # Same website as "it": one price for both store views
+        {"SKU": "SKU-1", "Store": "it", "Prezzo Base (IVA incl.)": 15.0},
+        {"SKU": "SKU-1", "Store": "it_en", "Prezzo Base (IVA incl.)": 15.0},
+        {"SKU": "SKU-1", "Store": "de", "Prezzo Base (IVA incl.)": 15.0},
+        {"SKU": "SKU-2", "Store": "it", "Prezzo Base (IVA incl.)": 20.0, "Prezzo Scontato (IVA incl.)": 18.0},
+        {"SKU": "SKU-2", "Store": "it_en", "Prezzo Scontato (IVA incl.)": 17.0},
+    ]
+
+    response = post_import(build_workbook(rows))
+
+    body = response.json()
+    # Row 7 still counts as updated through its base price
+    assert body["updated_count"] == 6
+    assert body["conflict_count"] == 1
+    assert body["errors"] == [
+        "Riga 2: prezzo sostituito dalla riga 3 (SKU SKU-0, store 1)",
+        "Riga 7: prezzo sostituito dalla riga 8 (SKU SKU-2, store 3)",
+    ]
+    written = sorted((endpoint, price["sku"], price["store_id"], price["price"]) for endpoint, prices in stub.state.writes for price in prices)
+    assert written == [
+        ("base-prices", "SKU-0", 1, 12.0),
+        ("base-prices", "SKU-1", 2, 15.0),
+        ("base-prices", "SKU-1", 3, 15.0),
+        ("base-prices", "SKU-2", 1, 20.0),
+        ("special-price", "SKU-2", 3, 17.0),
+    ]
@@ -0,0 +1,226 @@
+"""Retries, AIMD backoff and circuit breaker around outbound Magento calls"""
+import asyncio
+
+from fastapi import FastAPI, Response
+
+import server
+from tests.conftest import CONFIG, api_client
+from tests.magento_stub import ProductCatalog, create_magento_stub
+
+
+def create_flaky_magento(statuses):
+    """Magento answering with the given statuses in order, then succeeding"""
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.get("/rest/V1/store/storeViews")
+    async def store_views():
+        app.state.calls += 1
+        if statuses:
+            return Response(status_code=statuses.pop(0), content="busy")
+        return [{"id": 1, "code": "default", "name": "Default", "website_id": 1, "store_group_id": 1}]
+
+    @app.post("/rest/V1/products/special-price-delete")
+    async def delete_special_price():
+        app.state.calls += 1
+        if statuses:
+            return Response(status_code=statuses.pop(0), content="busy")
+        return []
+
+    @app.put("/rest/V1/products/{sku}")
+    async def save_product(sku: str):
+        app.state.calls += 1
+        if statuses:
+            return Response(status_code=statuses.pop(0), content="busy", headers={"Retry-After": "1"})
+        return {"sku": sku}
+
+    return app
+
+
+def call(method, path, **kwargs):
+    async def scenario():
+        async with api_client() as api:
+            response = await api.request(method, path, **kwargs)
+            traffic = (await api.get("/api/magento/traffic")).json()
+            return response, traffic
+
+    return asyncio.run(scenario())
+
+
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(server, "MAGENTO_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(server, "MAGENTO_BACKOFF_WINDOW", 0)
+
+
+def test_idempotent_calls_retry_and_back_off(magento_stub_transport, monkeypatch):
+    no_retry_delay(monkeypatch)
+    monkeypatch.setattr(server, "MAGENTO_MAX_CONCURRENCY", 8)
+    flaky = create_flaky_magento([503, 429])
+    magento_stub_transport(flaky)
+
+    response, traffic = call("POST", "/api/store-views", json=CONFIG)
+
+    assert response.status_code == 200
+    assert flaky.state.calls == 3
+    host = traffic["hosts"][0]
+    assert host["retries"] == 2
+    assert host["throttled"] == 1
+    assert host["failures"] == 1
+    # Halved twice, then one additive step back up
+    assert host["concurrency_limit"] == 2.5
+    assert host["breaker"] == "closed"
+
+
+def test_non_idempotent_calls_are_not_retried(magento_stub_transport, monkeypatch):
+    no_retry_delay(monkeypatch)
+    flaky = create_flaky_magento([503])
+    magento_stub_transport(flaky)
+
+    async def scenario():
+        try:
+            await server.magento_request(server.MagentoConfig(**CONFIG), "POST", "/products/special-price-delete", data={})
+        except server.HTTPException as e:
+            return e.status_code
+
+    assert asyncio.run(scenario()) == 503
+    assert flaky.state.calls == 1
+
+
+def test_breaker_opens_and_fails_fast(magento_stub_transport, monkeypatch):
+    no_retry_delay(monkeypatch)
+    monkeypatch.setattr(server, "MAGENTO_RETRIES", 0)
+    monkeypatch.setattr(server, "MAGENTO_BREAKER_THRESHOLD", 2)
+    flaky = create_flaky_magento([500, 500, 500])
+    magento_stub_transport(flaky)
+
+    async def scenario():
+        async with api_client() as api:
+            responses = [(await api.post("/api/store-views", json=CONFIG)).status_code for _ in range(4)]
+            traffic = (await api.get("/api/magento/traffic")).json()
+            # After the cooldown one probe goes through: a failure reopens, a success closes
+            control = next(iter(server.magento_clients.values())).traffic
+            for _ in range(2):
+                control.opened_until = 0
+                responses.append((await api.post("/api/store-views", json=CONFIG)).status_code)
+                responses.append(control.breaker)
+            return responses, traffic
+
+    responses, traffic = asyncio.run(scenario())
+
+    # Two failures reach Magento, then calls are rejected without contacting it
+    assert responses[:4] == [500, 500, 503, 503]
+    assert flaky.state.calls == 4
+    host = traffic["hosts"][0]
+    assert host["breaker"] == "open"
+    assert host["rejected"] == 2
+    assert responses[4:] == [500, "open", 200, "closed"]
+
+
+def test_listing_survives_stub_error_rate(fake_db, magento_stub_transport, monkeypatch):
+    no_retry_delay(monkeypatch)
+    stub = create_magento_stub(products=ProductCatalog(200), error_rate=0.3, seed=1)
+    magento_stub_transport(stub)
+
+    async def scenario():
+        async with api_client() as api:
+            return [
+                (await api.post("/api/products", json=CONFIG, params={"page": page})).status_code
+                for page in range(1, 11)
+            ]
+
+    assert asyncio.run(scenario()) == [200] * 10
+    assert stub.state.errors_served > 0
+
+
+def test_cancelled_calls_give_their_slot_back(magento_stub_transport, monkeypatch):
+    monkeypatch.setattr(server, "MAGENTO_MAX_RPS", 1)
+    app = FastAPI()
+
+    @app.post("/rest/V1/products/special-price-delete")
+    async def slow_delete():
+        await asyncio.sleep(1)
+        return []
+
+    magento_stub_transport(app)
+    client = server.get_magento_client(server.MagentoConfig(**CONFIG))
+    control = client.traffic
+
+    async def cancel_after(delay):
+        call = asyncio.ensure_future(client.request("POST", "/products/special-price-delete", data={}))
+        await asyncio.sleep(delay)
+        call.cancel()
+        try:
+            await call
+        except asyncio.CancelledError:
+            pass
+
+    async def scenario():
+        # Cancelled mid-flight, then while waiting for its rate-cap slot
+        await cancel_after(0.05)
+        await cancel_after(0.05)
+        after_cancel = control.in_flight
+        # A cancelled half-open probe reopens the breaker and lets the next call probe
+        control.breaker, control.opened_until, control.next_slot = "open", 0, 0
+        await cancel_after(0.05)
+        breaker = control.breaker
+        control.check_breaker()
+        return after_cancel, breaker, control.breaker
+
+    assert asyncio.run(scenario()) == (0, "open", "half_open")
+    assert control.in_flight == 0
+
+
+def test_least_recently_used_clients_are_closed(magento_stub_transport, monkeypatch):
+    magento_stub_transport(create_flaky_magento([]))
+    monkeypatch.setattr(server, "MAGENTO_CLIENT_CACHE_SIZE", 2)
+    configs = [server.MagentoConfig(**{**CONFIG, "access_token": token}) for token in ("a", "b", "c", "d")]
+
+    async def scenario():
+        first, second = server.get_magento_client(configs[0]), server.get_magento_client(configs[1])
+        server.get_magento_client(configs[0])
+        # The second client is least recently used and still has a call in flight
+        second.active_calls = 1
+        server.get_magento_client(configs[2])
+        await asyncio.sleep(0.1)
+        busy_closed = second.http.is_closed
+        second.active_calls = 0
+        await asyncio.sleep(1.1)
+        # Shutdown closes clients that are still waiting to retire
+        third = server.get_magento_client(configs[2])
+        server.get_magento_client(configs[0])
+        third.active_calls = 1
+        server.get_magento_client(configs[3])
+        await asyncio.sleep(0.1)
+        await server.shutdown_magento_clients()
+        return first, second, third, busy_closed
+
+    first, second, third, busy_closed = asyncio.run(scenario())
+
+    assert not busy_closed
+    assert second.http.is_closed
+    assert third.http.is_closed
+    assert first.http.is_closed and not server.retiring_magento_clients
+
+
+def test_evicted_client_stays_open_while_a_call_backs_off(magento_stub_transport, monkeypatch):
+    flaky = create_flaky_magento([503])
+    magento_stub_transport(flaky)
+    monkeypatch.setattr(server, "MAGENTO_CLIENT_CACHE_SIZE", 1)
+    monkeypatch.setattr(server, "retry_delay", lambda attempt, retry_after: 0.2)
+    config = server.MagentoConfig(**CONFIG)
+
+    async def scenario():
+        update = asyncio.ensure_future(server.magento_request(config, "PUT", "/products/SKU-1", data={"product": {}}))
+        await asyncio.sleep(0.05)
+        # Evicted while the PUT sleeps before its retry, holding no traffic slot
+        evicted = server.magento_clients[next(iter(server.magento_clients))]
+        server.get_magento_client(server.MagentoConfig(**{**CONFIG, "access_token": "other"}))
+        result = await update
+        await asyncio.gather(*server.retiring_magento_clients)
+        return result, evicted
+
+    result, evicted = asyncio.run(scenario())
+
+    assert result == {"sku": "SKU-1"}
+    assert flaky.state.calls == 2
+    assert evicted.http.is_closed
@@ -0,0 +1,58 @@
+"""Prometheus metrics for API routes, Magento calls and MongoDB commands"""
+import asyncio
+from types import SimpleNamespace
+
+import server
+from tests.conftest import CONFIG, api_client
+from tests.magento_stub import build_product, create_magento_stub
+
+
+def sample(text, name, **labels):
+    """Value of the sample whose labels include the given ones"""
+    for line in text.splitlines():
+        if line.startswith(name + "{") and all(f'{key}="{value}"' in line for key, value in labels.items()):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_metrics_cover_routes_and_magento_endpoints(fake_db, magento_stub_transport):
+    stub = create_magento_stub(products=[build_product(i) for i in range(3)])
+    magento_stub_transport(stub)
+
+    async def scenario():
+        async with api_client() as api:
+            await api.post("/api/products", json=CONFIG)
+            await api.post("/api/products", json=CONFIG)
+            await api.post("/api/update-price", json={
+                "config": CONFIG,
+                "price_update": {"sku": "SKU-00001", "store_id": 1, "base_price": 10.0},
+            })
+            return await api.get("/api/metrics")
+
+    response = asyncio.run(scenario())
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert sample(text, "http_request_duration_seconds_count", route="/api/products", status="200") >= 2
+    assert sample(text, "http_request_duration_seconds_bucket", route="/api/products", le="+Inf") >= 2
+    assert sample(text, "magento_responses_total", method="GET", endpoint="/products", status="200") >= 2
+    # SKUs are folded into the endpoint template
+    assert sample(text, "magento_responses_total", method="PUT", endpoint="/products/{sku}", status="200") >= 1
+    assert 'endpoint="/products/SKU-00001"' not in text
+    assert sample(text, "magento_concurrency_limit", host="https://magento.test") is not None
+
+
+def test_mongo_listener_times_commands_per_collection():
+    listener = server.MongoCommandMetrics()
+    started = SimpleNamespace(command_name="find", command={"find": "vat_rates"}, connection_id=("db", 1), request_id=7)
+    finished = SimpleNamespace(command_name="find", connection_id=("db", 1), request_id=7, duration_micros=1500)
+
+    listener.started(started)
+    listener.succeeded(finished)
+
+    key = ("find", "vat_rates", "ok")
+    _, total, count = server.MONGO_COMMAND_SECONDS.values[key]
+    assert count >= 1
+    assert total >= 0.0015
+    assert listener.collections == {}
@@ -0,0 +1,50 @@
+"""Slow Magento writes must not stall other requests on the same event loop"""
+import asyncio
+import time
+
+import server
+from tests.conftest import CONFIG, api_client, build_workbook
+from tests.magento_stub import create_magento_stub
+
+WRITE_LATENCY = 0.2
+IMPORT_ROWS = 10
+
+
+def test_product_listing_latency_during_import(fake_db, magento_stub_transport, monkeypatch):
+    products = [{"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0, "custom_attributes": []} for i in range(IMPORT_ROWS)]
+    stub = create_magento_stub(products=products, write_latency=WRITE_LATENCY)
+    magento_stub_transport(stub)
+    # One slow batch call per row, sent one at a time, keeps the import running for a while
+    monkeypatch.setattr(server, "IMPORT_CHUNK_SIZE", 1)
+    monkeypatch.setattr(server, "IMPORT_CONCURRENCY", 1)
+    workbook = build_workbook([
+        {"SKU": f"SKU-{i}", "Store": "default", "Prezzo Base (IVA incl.)": 12.2} for i in range(IMPORT_ROWS)
+    ])
+
+    async def scenario():
+        async with api_client() as api:
+            import_task = asyncio.create_task(api.post(
+                "/api/import-prices",
+                params=CONFIG,
+                files={"file": ("prezzi.xlsx", workbook, "application/octet-stream")},
+            ))
+            await asyncio.sleep(WRITE_LATENCY)
+
+            latencies = []
+            while not import_task.done():
+                started = time.perf_counter()
+                response = await api.post("/api/products", json=CONFIG, params={"page_size": 5})
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200
+                await asyncio.sleep(0.05)
+
+            return await import_task, latencies
+
+    import_response, latencies = asyncio.run(scenario())
+
+    assert import_response.status_code == 200
+    assert import_response.json()["updated_count"] == IMPORT_ROWS
+    assert sum(len(prices) for _, prices in stub.state.writes) == IMPORT_ROWS
+    # The import takes IMPORT_ROWS * WRITE_LATENCY; listings kept being served meanwhile
+    assert len(latencies) >= 5
+    assert max(latencies) < WRITE_LATENCY
@@ -0,0 +1,103 @@
+"""Cross-store price comparison on the SKU x store price matrix"""
+import numpy as np
+
+import server
+from tests.conftest import CONFIG, call_api
+from tests.magento_stub import create_magento_stub
+
+STORE_VIEWS = [
+    {"id": 1, "code": "it", "name": "Italia", "website_id": 1, "store_group_id": 1},
+    {"id": 2, "code": "de", "name": "Deutschland", "website_id": 2, "store_group_id": 2},
+    {"id": 3, "code": "fr", "name": "France", "website_id": 3, "store_group_id": 3},
+]
+
+
+def compare(**params):
+    return call_api("POST", "/api/price-comparison", json=CONFIG, params=params)
+
+
+def test_comparison_reports_spread_outliers_and_reference_deviations(fake_db, magento_stub_transport):
+    fake_db.vat_rates.documents = [{"store_id": 1, "store_name": "Italia", "vat_rate": 22}]
+    products = [{"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0} for i in range(4)]
+    stub = create_magento_stub(products=products, store_views=STORE_VIEWS)
+    # SKU-1: France far above the others; SKU-2: Germany slightly below Italy
+    stub.state.base_prices.update({("SKU-1", 1): 10.0, ("SKU-1", 2): 10.0, ("SKU-1", 3): 15.0})
+    stub.state.base_prices.update({("SKU-2", 1): 10.0, ("SKU-2", 2): 9.0, ("SKU-2", 3): 10.0})
+    # An active special price is the price customers pay
+    stub.state.special_prices[("SKU-3", 2)] = {"price": 7.0, "price_from": None, "price_to": None}
+    magento_stub_transport(stub)
+
+    response = compare(reference_store_id=1)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["summary"]["skus"] == 4
+    items = {item["sku"]: item for item in body["items"]}
+    assert [item["sku"] for item in body["items"]][0] == "SKU-1"
+    assert items["SKU-1"]["spread"] == 5.0
+    assert items["SKU-1"]["spread_pct"] == 50.0
+    assert items["SKU-1"]["outliers"] == ["fr"]
+    assert items["SKU-2"]["deviations"] == [{"store_id": 2, "store_code": "de", "price": 9.0, "deviation_pct": -10.0}]
+    assert items["SKU-3"]["prices"] == {"it": 10.0, "de": 7.0, "fr": 10.0}
+    assert items["SKU-0"]["spread"] == 0.0 and not items["SKU-0"]["outliers"]
+
+    only_issues = compare(reference_store_id=1, only_issues=True).json()
+    assert {item["sku"] for item in only_issues["items"]} == {"SKU-1", "SKU-2", "SKU-3"}
+
+    gross = compare(basis="gross", skus="SKU-0").json()
+    assert gross["items"][0]["prices"] == {"it": 12.2, "de": 10.0, "fr": 10.0}
+
+
+def test_comparison_rejects_unknown_reference_store(fake_db, magento_stub_transport):
+    stub = create_magento_stub(products=[{"id": 1, "sku": "SKU-1", "name": "Prodotto", "price": 10.0}], store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+
+    assert compare(reference_store_id=99).status_code == 400
+
+
+def test_comparison_without_store_views_or_prices_is_empty(fake_db, magento_stub_transport):
+    products = [{"id": 1, "sku": "SKU-1", "name": "Prodotto", "price": 10.0}]
+    admin_only = [{"id": 0, "code": "admin", "name": "Admin", "website_id": 0, "store_group_id": 0}]
+    magento_stub_transport(create_magento_stub(products=products, store_views=admin_only))
+
+    response = compare()
+
+    assert response.status_code == 200
+    assert response.json()["items"] == [] and response.json()["summary"]["skus"] == 0
+
+    unpriced = server.compare_store_prices(np.full((2, 3), np.nan), 0, 20, 5)
+    assert len(unpriced["rows"]) == 0 and unpriced["outliers"].shape == (0, 3)
+
+
+def test_expired_special_price_is_ignored():
+    matrix = server.PriceMatrix(
+        ["SKU-1"],
+        [1, 2],
+        np.array([[10.0, 10.0]]),
+        np.array([[8.0, 8.0]]),
+        np.array([["2020-01-01", "NaT"]], dtype="datetime64[D]"),
+        np.array([["2020-12-31", "NaT"]], dtype="datetime64[D]"),
+    )
+
+    prices = matrix.effective_prices(np.datetime64("2026-01-01"))
+
+    assert prices.tolist() == [[10.0, 8.0]]
+
+
+def test_magento_matrix_is_reused_across_pages_until_a_price_write(fake_db, magento_stub_transport):
+    products = [{"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0} for i in range(4)]
+    stub = create_magento_stub(products=products, store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+
+    first = compare(page=1, page_size=2)
+    crawls = stub.state.product_list_calls
+    second = compare(page=2, page_size=2)
+
+    assert first.status_code == 200 and second.status_code == 200
+    assert stub.state.product_list_calls == crawls
+    assert {item["sku"] for item in first.json()["items"] + second.json()["items"]} == {f"SKU-{i}" for i in range(4)}
+
+    server.prices_written(server.MagentoConfig(**CONFIG), [])
+    compare(page=1, page_size=2)
+
+    assert stub.state.product_list_calls > crawls
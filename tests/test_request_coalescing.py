@@ -0,0 +1,49 @@
+"""Coalescing of identical concurrent Magento GETs and the optional /products page cache"""
+import asyncio
+
+import server
+from tests.conftest import CONFIG, api_client
+from tests.magento_stub import create_magento_stub
+
+PRODUCTS = [{"id": i, "sku": f"SKU-{i}", "name": f"Prodotto {i}", "price": 10.0} for i in range(30)]
+
+
+def test_identical_concurrent_gets_share_one_magento_call(fake_db, magento_stub_transport):
+    stub = create_magento_stub(products=PRODUCTS, read_latency=0.05)
+    magento_stub_transport(stub)
+
+    async def scenario():
+        async with api_client() as api:
+            same_page = [api.post("/api/products", json=CONFIG, params={"page": 1}) for _ in range(5)]
+            other_page = api.post("/api/products", json=CONFIG, params={"page": 2})
+            return await asyncio.gather(*same_page, other_page)
+
+    responses = asyncio.run(scenario())
+
+    assert all(response.status_code == 200 for response in responses)
+    assert stub.state.product_list_calls == 2
+    assert [item["sku"] for item in responses[0].json()["items"]] == [f"SKU-{i}" for i in range(20)]
+    # Every caller gets its own parsed copy
+    assert all(response.json() == responses[0].json() for response in responses[1:5])
+    assert not server.get_magento_client(server.MagentoConfig(**CONFIG)).inflight
+
+
+def test_products_page_cache_is_dropped_on_price_writes(fake_db, magento_stub_transport, monkeypatch):
+    monkeypatch.setattr(server, "PRODUCTS_CACHE_TTL", 30)
+    stub = create_magento_stub(products=PRODUCTS)
+    magento_stub_transport(stub)
+
+    async def scenario():
+        async with api_client() as api:
+            await api.post("/api/products", json=CONFIG)
+            await api.post("/api/products", json=CONFIG)
+            cached_calls = stub.state.product_list_calls
+            await api.post("/api/update-price", json={
+                "config": CONFIG,
+                "price_update": {"sku": "SKU-1", "store_id": 0, "base_price": 12.0},
+            })
+            await api.post("/api/products", json=CONFIG)
+            return cached_calls
+
+    assert asyncio.run(scenario()) == 1
+    assert stub.state.product_list_calls == 2
@@ -0,0 +1,74 @@
+"""Server-Timing phases and opt-in request profiling"""
+import asyncio
+import pstats
+import threading
+
+import httpx
+
+import server
+from tests.conftest import CONFIG, call_api
+from tests.magento_stub import build_product, create_magento_stub
+
+
+def post_products(headers=None):
+    return call_api("POST", "/api/products", json=CONFIG, headers=headers or {})
+
+
+def parse_server_timing(header):
+    phases = {}
+    for entry in header.split(","):
+        name, duration = entry.strip().split(";dur=")
+        phases[name] = float(duration)
+    return phases
+
+
+def test_products_response_carries_phase_breakdown(fake_db, magento_stub_transport):
+    magento_stub_transport(create_magento_stub(products=[build_product(i) for i in range(20)], read_latency=0.05))
+
+    response = post_products()
+
+    assert response.status_code == 200
+    phases = parse_server_timing(response.headers["Server-Timing"])
+    for name in ("magento_queue", "magento", "magento_parse", "extract", "validate", "endpoint", "serialize", "total"):
+        assert name in phases
+    # The stub round-trip dominates and fits inside the endpoint, which fits inside the total
+    assert phases["magento"] >= 50
+    assert phases["magento"] <= phases["endpoint"] <= phases["total"]
+
+
+def test_profile_header_saves_a_profile_only_when_allowed(fake_db, magento_stub_transport, monkeypatch, tmp_path):
+    magento_stub_transport(create_magento_stub(products=[build_product(i) for i in range(5)]))
+    monkeypatch.setattr(server, "PROFILE_DIR", tmp_path)
+
+    post_products({"X-Profile": "1"})
+    assert list(tmp_path.iterdir()) == []
+
+    monkeypatch.setattr(server, "PROFILE_ALLOW_HEADER", True)
+    post_products({"X-Profile": "1"})
+
+    profiles = list(tmp_path.iterdir())
+    assert len(profiles) == 1
+    assert "_POST_api_products_" in profiles[0].name
+    stats = pstats.Stats(str(profiles[0]))
+    assert any(function == "get_products" for _, _, function in stats.stats)
+
+
+def test_sync_endpoints_run_in_the_threadpool():
+    router = server.APIRouter(route_class=server.TimedRoute)
+    main_thread = threading.get_ident()
+
+    @router.get("/sync")
+    def sync_endpoint():
+        return {"in_threadpool": threading.get_ident() != main_thread}
+
+    app = server.FastAPI()
+    app.include_router(router)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://backend.test") as api:
+            return await api.get("/sync")
+
+    response = asyncio.run(scenario())
+
+    assert response.status_code == 200
+    assert response.json() == {"in_threadpool": True}
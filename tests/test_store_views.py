@@ -0,0 +1,55 @@
+"""Store view registry shared by all endpoints"""
+import asyncio
+
+import server
+from tests.conftest import CONFIG, api_client
+from tests.magento_stub import create_magento_stub
+
+STORE_VIEWS = [
+    {"id": 1, "code": "it", "name": "Italia", "website_id": 1, "store_group_id": 1},
+    {"id": 2, "code": "de", "name": "Deutschland", "website_id": 2, "store_group_id": 2},
+]
+
+
+def update_price(api, store_id):
+    return api.post("/api/update-price", json={
+        "config": CONFIG,
+        "price_update": {"sku": "SKU-1", "store_id": store_id, "base_price": 10.0},
+    })
+
+
+def test_price_edits_reuse_cached_store_views(fake_db, magento_stub_transport):
+    stub = create_magento_stub(products=[{"id": 1, "sku": "SKU-1", "name": "Prodotto", "price": 5.0}], store_views=STORE_VIEWS)
+    magento_stub_transport(stub)
+
+    async def scenario():
+        async with api_client() as api:
+            await api.post("/api/store-views", json=CONFIG)
+            for store_id in (1, 2, 1):
+                assert (await update_price(api, store_id)).status_code == 200
+            # A store view added in Magento is picked up on the first edit that needs it
+            stub.state.store_views.append({"id": 3, "code": "fr", "name": "France", "website_id": 3, "store_group_id": 3})
+            assert (await update_price(api, 3)).status_code == 200
+            refreshed = await api.post("/api/store-views", json=CONFIG, params={"refresh": True})
+            return refreshed.json()
+
+    refreshed = asyncio.run(scenario())
+
+    assert [write[0] for write in stub.state.writes] == ["it", "de", "it", "fr"]
+    assert stub.state.store_view_calls == 3
+    assert [store["code"] for store in refreshed] == ["it", "de", "fr"]
+
+
+def test_concurrent_loads_share_one_magento_call(fake_db, magento_stub_transport):
+    stub = create_magento_stub(store_views=STORE_VIEWS, read_latency=0.02)
+    magento_stub_transport(stub)
+
+    async def scenario():
+        registries = await asyncio.gather(*[server.get_store_views(server.MagentoConfig(**CONFIG)) for _ in range(5)])
+        return registries[0]
+
+    registry = asyncio.run(scenario())
+
+    assert stub.state.store_view_calls == 1
+    assert registry.by_code["de"]["id"] == 2
+    assert registry.by_id[1]["code"] == "it"
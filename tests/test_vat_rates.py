@@ -0,0 +1,59 @@
+"""VAT rate table: cached reads for pricing, atomic replacement on save"""
+import asyncio
+
+import server
+from tests.conftest import call_api
+
+
+def test_save_replaces_rates_in_place_and_invalidates_cache(fake_db):
+    fake_db.vat_rates.documents = [
+        {"_id": "a", "store_id": 1, "store_name": "Italia", "vat_rate": 22},
+        {"_id": "b", "store_id": 2, "store_name": "Deutschland", "vat_rate": 19},
+    ]
+    assert asyncio.run(server.vat_rate_cache.by_store()) == {1: 22, 2: 19}
+
+    # Pricing reads the cache until a save invalidates it, the endpoint always reads MongoDB
+    fake_db.vat_rates.documents[0]["vat_rate"] = 0
+    assert asyncio.run(server.vat_rate_cache.by_store()) == {1: 22, 2: 19}
+    assert [rate["vat_rate"] for rate in call_api("GET", "/api/vat-rates").json()["vat_rates"]] == [0, 19]
+
+    response = call_api("POST", "/api/vat-rates", json={"vat_rates": [
+        {"store_id": 1, "store_name": "Italia", "vat_rate": 10},
+        {"store_id": 3, "store_name": "France", "vat_rate": 20},
+    ]})
+
+    assert response.status_code == 200
+    # Store 1 kept its document, store 2 was dropped, store 3 was added
+    assert sorted((doc["store_id"], doc["vat_rate"]) for doc in fake_db.vat_rates.documents) == [(1, 10), (3, 20)]
+    assert next(doc for doc in fake_db.vat_rates.documents if doc["store_id"] == 1)["_id"] == "a"
+    assert call_api("GET", "/api/vat-rates").json()["vat_rates"] == [
+        {"store_id": 1, "store_name": "Italia", "vat_rate": 10},
+        {"store_id": 3, "store_name": "France", "vat_rate": 20},
+    ]
+    assert asyncio.run(server.vat_rate_cache.by_store()) == {1: 10, 3: 20}
+
+
+def test_load_racing_with_a_save_is_not_cached(fake_db, monkeypatch):
+    fake_db.vat_rates.documents = [{"store_id": 1, "store_name": "Italia", "vat_rate": 22}]
+    cache = server.VatRateCache(ttl=60)
+    find = fake_db.vat_rates.find
+
+    class SlowCursor:
+        def __init__(self, *args):
+            self.cursor = find(*args)
+
+        async def to_list(self, length=None):
+            await asyncio.sleep(0.01)
+            return await self.cursor.to_list(length)
+
+    monkeypatch.setattr(fake_db.vat_rates, "find", SlowCursor)
+
+    async def scenario():
+        load = asyncio.ensure_future(cache.get())
+        await asyncio.sleep(0)
+        # A save lands while the rates are being read
+        cache.invalidate()
+        return await load
+
+    assert asyncio.run(scenario()) == {1: {"store_id": 1, "store_name": "Italia", "vat_rate": 22}}
+    assert cache.rates is None